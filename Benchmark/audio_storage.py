@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+편지 음성 저장 지연 측정 (AWS 없이: AUDIO_STORAGE=local, 또는 S3 모의 서버)
+
+    AUDIO_STORAGE=local AUDIO_LOCAL_DIR=/tmp/natna-audio python Benchmark/audio_storage.py [편지 수] [동시성] [KB]
+    AUDIO_STORAGE=s3 S3_ENDPOINT_URL=http://localhost:9000 S3_BUCKET=natna-mock \
+        AWS_ACCESS_KEY_ID=mock AWS_SECRET_ACCESS_KEY=mock python Benchmark/audio_storage.py
+
+실제 버킷에 쓰지 않도록 s3 백엔드는 S3_ENDPOINT_URL 이 로컬 모의 서버를 가리킬 때만 실행한다.
+"""
+import os
+import sys
+import math
+import time
+import uuid
+import asyncio
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_storage import audio_storage
+
+
+async def main(letters: int, concurrency: int, size_kb: int):
+    endpoint = os.getenv("S3_ENDPOINT_URL", "")
+    if audio_storage.name == "s3" and "localhost" not in endpoint and "127.0.0.1" not in endpoint:
+        print(f"S3_ENDPOINT_URL 이 모의 서버가 아닙니다: {endpoint or '(AWS)'}")
+        return
+    audio = os.urandom(size_kb * 1024)
+    run = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(concurrency)
+    times = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await audio_storage.upload(audio, f"benchmark/{run}/{i}/letter_voice.mp3")
+            times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(letters)))
+    wall = time.perf_counter() - start
+    audio_storage.shutdown()
+
+    p95 = sorted(times)[math.ceil(len(times) * 0.95) - 1]
+    print(f"backend={audio_storage.name} letters={letters} concurrency={concurrency} size={size_kb}KB")
+    print(f"{'mean(ms)':>9} {'p95(ms)':>8} {'max(ms)':>8} {'letters/s':>10}")
+    print(f"{statistics.mean(times) * 1000:>9.1f} {p95 * 1000:>8.1f} {max(times) * 1000:>8.1f} {letters / wall:>10.1f}")
+    print(audio_storage.snapshot())
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    defaults = [200, 16, 300]
+    asyncio.run(main(*(args + defaults[len(args):])))
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+TTS 한 번 호출 vs 문장 단위 조각 동시 합성 비교 (모의 서버 사용)
+
+    python mock_server.py                       # 다른 터미널에서 (0.0.0.0:9000)
+    TTS_URL=http://localhost:9000/tts-premium/v1/tts python Benchmark/tts_chunk.py [반복 횟수]
+
+실제 CLOVA Voice 한도를 쓰지 않도록 TTS_URL 이 모의 서버를 가리킬 때만 실행한다.
+"""
+import os
+import sys
+import math
+import time
+import asyncio
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat
+import mp3_frames
+from hcx_client import close_async_client
+
+LETTER = (
+    "안녕, 오늘 얘기 들어줘서 고마웠어!\n\n"
+    "사실 처음엔 이런 얘기 해도 되나 모르겠더라. 내가 너무 예민한 걸까 싶어서 한참 고민했어... "
+    "그런데 네가 내 마음을 먼저 알아봐 줘서 정말 놀랐어. 친구들이 아무 말도 안 해줘서 속상했는데, "
+    "너라면 알아줄 줄 알았거든. 가끔은 서운한 말도 했지만, 그래도 끝까지 들어줘서 고마워. "
+    "다음에 또 힘든 일이 생기면 제일 먼저 너한테 얘기할게. 오늘 하루도 정말 수고 많았어!\n\n"
+    "빛나는 우리의 우정을 염원하며,\n\n투닥이가"
+)
+
+
+async def measure(chunk_chars: int, runs: int):
+    chat.TTS_CHUNK_CHARS = chunk_chars
+    times, sizes = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        audio = await chat.async_generate_tts(LETTER)
+        times.append(time.perf_counter() - start)
+        if not audio:
+            raise RuntimeError("TTS failed")
+        sizes.append(mp3_frames.duration(audio))
+    return times, sizes
+
+
+async def main(runs: int):
+    if "localhost" not in chat.TTS_URL and "127.0.0.1" not in chat.TTS_URL:
+        print(f"TTS_URL 이 모의 서버가 아닙니다: {chat.TTS_URL}")
+        return
+    print(f"편지 {len(LETTER)}자, {runs}회")
+    print(f"{'mode':>10} {'chunks':>6} {'mean(s)':>8} {'p95(s)':>8} {'audio(s)':>9}")
+    configured = chat.TTS_CHUNK_CHARS or 100
+    for label, chunk_chars in (("single", 0), ("chunked", configured)):
+        chunks = len(chat.split_sentences(LETTER, chunk_chars)) if chunk_chars else 1
+        times, durations = await measure(chunk_chars, runs)
+        p95 = sorted(times)[math.ceil(len(times) * 0.95) - 1]
+        print(f"{label:>10} {chunks:>6} {statistics.mean(times):>8.3f} {p95:>8.3f} {statistics.mean(durations):>9.2f}")
+    await close_async_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
@@ -0,0 +1,155 @@
+# audio_storage.py
+"""
+편지 음성 저장소 (AUDIO_STORAGE=s3 | local)
+
+- s3: s3_utils 로 업로드하고 공개 URL 또는 presigned URL 을 준다 (s3_utils 는 이 백엔드를 쓸 때만 import →
+  local 모드에서는 boto3 클라이언트를 만들지 않고 AWS 자격 증명도 필요 없다)
+- local: AUDIO_LOCAL_DIR 아래 HMAC-SHA256(비밀 키, 키) 앞 4자리로 나눈 두 단계 디렉토리에 저장한다
+  ({AUDIO_LOCAL_DIR}/ab/cd/abcd....mp3). 한 디렉토리에 파일이 몰리지 않는다.
+  비밀 키를 모르면 채팅방 ID 를 알아도 URL 을 계산할 수 없다 (/audio 는 인증 없이 열려 있으므로 URL 이 곧 접근 권한).
+  비밀 키는 AUDIO_LOCAL_SECRET, 없으면 처음 한 번 만들어 {AUDIO_LOCAL_DIR}_url_secret 에 두고 워커들이 같이 쓴다
+  (nginx 가 내보내는 디렉토리 밖)
+  (바뀌면 이전에 저장한 음성의 URL 도 바뀌므로 고정해 둔다)
+  - 임시 파일에 쓰고 fsync 후 rename 하므로 nginx 나 다른 워커가 반쯤 쓴 파일을 내보내지 않는다
+  - URL 은 {AUDIO_LOCAL_BASE_URL}/audio/ab/cd/abcd....mp3. 앱은 파일이 있는지만 보고
+    X-Accel-Redirect 로 nginx 의 internal location(/_audio/)에 넘긴다 → 전송은 nginx 가 sendfile 로,
+    Range 요청(탐색 재생)도 nginx 가 처리한다. AUDIO_LOCAL_ACCEL=false 면 앱이 직접 파일을 보낸다 (nginx 없이 실행할 때)
+"""
+import os
+import re
+import time
+import hmac
+import asyncio
+import hashlib
+import secrets
+from typing import Dict, Optional
+
+import metrics
+
+AUDIO_STORAGE = os.getenv("AUDIO_STORAGE", "s3").lower()
+AUDIO_LOCAL_DIR = os.getenv("AUDIO_LOCAL_DIR", "chat_data/audio")
+AUDIO_LOCAL_BASE_URL = os.getenv("AUDIO_LOCAL_BASE_URL", "").rstrip("/")   # 비우면 상대 경로 URL
+AUDIO_LOCAL_ACCEL = os.getenv("AUDIO_LOCAL_ACCEL", "true").lower() == "true"
+AUDIO_LOCAL_SECRET = os.getenv("AUDIO_LOCAL_SECRET", "")
+AUDIO_LOCAL_ACCEL_PREFIX = os.getenv("AUDIO_LOCAL_ACCEL_PREFIX", "/_audio")  # nginx internal location
+
+AUDIO_ROUTE = "/audio"
+_NAME = re.compile(r"^[0-9a-f]{64}\.mp3$")
+
+
+class S3AudioStorage:
+    name = "s3"
+
+    def __init__(self):
+        import s3_utils
+        self._s3 = s3_utils
+
+    async def upload(self, audio: bytes, key: str) -> str:
+        return await self._s3.upload_audio_async(audio, key)
+
+    def url(self, key: str) -> str:
+        return self._s3.audio_url(key)
+
+    def snapshot(self) -> Dict:
+        return {"backend": self.name, "bucket": self._s3.S3_BUCKET, "public": self._s3.S3_PUBLIC}
+
+    def shutdown(self):
+        self._s3.shutdown()
+
+
+class LocalAudioStorage:
+    name = "local"
+
+    def __init__(self, directory: str = AUDIO_LOCAL_DIR, base_url: str = AUDIO_LOCAL_BASE_URL):
+        self.directory = directory
+        self.base_url = base_url
+        self.secret = (AUDIO_LOCAL_SECRET or self._load_secret()).encode("utf-8")
+        self.stats = {"stored": 0, "failed": 0, "bytes": 0}
+
+    def _load_secret(self) -> str:
+        """저장된 비밀 키를 읽거나, 없으면 만든다 (워커들이 동시에 만들어도 먼저 link 한 것 하나만 남는다)"""
+        path = f"{self.directory.rstrip(os.sep)}_url_secret"
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(secrets.token_hex(32))
+            os.chmod(tmp, 0o600)
+            try:
+                os.link(tmp, path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp)
+        with open(path) as f:
+            return f.read().strip()
+
+    def relative_path(self, key: str) -> str:
+        """키 → 샤딩한 상대 경로 (ab/cd/abcd....mp3)"""
+        digest = hmac.new(self.secret, key.encode("utf-8"), hashlib.sha256).hexdigest()
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.mp3"
+
+    def resolve(self, shard1: str, shard2: str, name: str) -> Optional[str]:
+        """URL 경로 조각 → 파일 경로 (형식이 맞지 않거나 파일이 없으면 None)"""
+        if not _NAME.match(name) or shard1 != name[:2] or shard2 != name[2:4]:
+            return None
+        path = os.path.join(self.directory, shard1, shard2, name)
+        return path if os.path.isfile(path) else None
+
+    def _write(self, audio: bytes, key: str) -> str:
+        relative = self.relative_path(key)
+        path = os.path.join(self.directory, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(audio)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, 0o644)   # nginx 워커(다른 사용자)가 읽을 수 있게
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return relative
+
+    async def upload(self, audio: bytes, key: str) -> str:
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write, audio, key)
+        except OSError as e:
+            self.stats["failed"] += 1
+            metrics.registry.inc("natna_audio_upload_total", result="failed")
+            raise RuntimeError(f"Local audio write failed: {e}")
+        self.stats["stored"] += 1
+        self.stats["bytes"] += len(audio)
+        metrics.registry.inc("natna_audio_upload_total", result="ok")
+        metrics.registry.observe("natna_audio_upload_seconds", time.perf_counter() - start, metrics.LATENCY_BUCKETS)
+        return self.url(key)
+
+    def url(self, key: str) -> str:
+        return f"{self.base_url}{AUDIO_ROUTE}/{self.relative_path(key)}"
+
+    def accel_path(self, shard1: str, shard2: str, name: str) -> str:
+        return f"{AUDIO_LOCAL_ACCEL_PREFIX}/{shard1}/{shard2}/{name}"
+
+    def snapshot(self) -> Dict:
+        return {"backend": self.name, "directory": self.directory, "accel": AUDIO_LOCAL_ACCEL, **self.stats}
+
+    def shutdown(self):
+        pass
+
+
+def create_storage(backend: str = AUDIO_STORAGE):
+    if backend == "local":
+        return LocalAudioStorage()
+    if backend != "s3":
+        print(f"Unknown AUDIO_STORAGE={backend}, using s3")
+    return S3AudioStorage()
+
+
+# 프로세스 공용 인스턴스
+audio_storage = create_storage()
@@ -1,17 +1,12 @@
 import os
 import re
-import requests
 import httpx
 import json
 import time
-import psutil
+import asyncio
 import yaml
 import random
-import urllib.request
-import urllib.parse
-from typing import List, Dict, Any, Optional
-import uuid
-import base64
+from contextlib import aclosing
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -26,176 +21,38 @@ LONG_PARAMS = ALL_PARAMS["LONG_PARAMS"]
 SITUATION_QUIZ_PARAMS = ALL_PARAMS["SITUATION_QUIZ"]
 VERIFICAIION_AND_SCORE_PARAMS = ALL_PARAMS["VERIFICATION_AND_SCORE"]
 FEEDBACK_PARAMS = ALL_PARAMS["FEEDBACK_PARAMS"]
-
-host = os.environ.get("HOST")
-api_key = os.environ.get("CLOVASTUDIO_API_KEY")
-request_id = os.environ.get("REQUEST_ID")
+REACT_IMPROVED_PARAMS = ALL_PARAMS["REACT_IMPROVED"]
 
 client_id = os.environ.get("CLIENT_ID")
 client_secret = os.environ.get("CLIENT_SECRET")
 
-API_CONFIG = {
-    'host': host,
-    'api_key': api_key,  # 실제 API 키로 변경
-    'request_id': request_id
-}
-
 MAX_REACT_LENGTH = 60
 MAX_FEEDBACK_LENGTH = 300
-attempt_limit = 5
 quiz_num = 5
 
-# HTTP 클라이언트 설정 (연결 풀링)
-http_client = httpx.Client(
-    timeout=30.0,
-    limits=httpx.Limits(
-        max_keepalive_connections=20,
-        max_connections=100,
-        keepalive_expiry=30.0
-    )
-)
-
-def execute_chat(system_message: str,parameter:dict, **kwargs) -> Optional[Dict[str, Any]]:
-    """
-    시스템 메시지만 넘겨서 간단하게 API 호출
-    
-    Args:
-        system_message: 시스템 메시지 (유일한 필수 파라미터)
-        **kwargs: 추가 파라미터 (temperature, topP 등)
-    
-    Returns:
-        API 응답 결과 딕셔너리 또는 None (실패시)
-    """
-    # 요청 데이터 구성
-    params = parameter.copy()
-    params.update(kwargs)  # 추가 파라미터가 있으면 업데이트
-    
-    completion_request = {
-        "messages": [{"role": "system", "content": system_message}],
-        **params
-    }
-    
-    # 헤더 설정
-    headers = {
-        'Authorization': f"Bearer {API_CONFIG['api_key']}",
-        'X-NCP-CLOVASTUDIO-REQUEST-ID': API_CONFIG['request_id'],
-        'Content-Type': 'application/json; charset=utf-8',
-        'Accept': 'application/json'
-    }
-    
-    # 성능 측정 시작
-    start_time = time.time()
-    memory_before = psutil.Process().memory_info().rss / 1024 / 1024  # MB
-    
-    try:
-        response = requests.post(
-            API_CONFIG['host'] + '/v3/chat-completions/HCX-007',
-            headers=headers, 
-            json=completion_request,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            response_text = result.get('result', {}).get('message', {}).get('content', '')
-            generated_tokens = result.get('result', {}).get('usage', {}).get('completionTokens', 0)
-            total_tokens = result.get('result', {}).get('usage', {}).get('totalTokens', 0)
-        else:
-            print(f"API Error: {response.status_code}, {response.text}")
-            return None
-            
-    except Exception as e:
-        print(f"Request failed: {e}")
-        return None
-    
-    # 성능 측정 종료
-    end_time = time.time()
-    memory_after = psutil.Process().memory_info().rss / 1024 / 1024  # MB
-    
-    total_time = end_time - start_time
-    first_token_time = total_time  # 비스트리밍이므로 전체시간과 동일
-    tps = generated_tokens / total_time if total_time > 0 else 0
-    
-    return {
-        'response_text': response_text,
-        'total_time': total_time,
-        'ttft': first_token_time,
-        'generated_tokens': generated_tokens,
-        'total_tokens':total_tokens,
-        'tps': tps,
-        'memory_usage': memory_after - memory_before,
-    }
+# 길이 가드 스트리밍: 길이 초과가 보이는 즉시 업스트림 요청을 끊고 문장 경계에서 자르거나 바로 재생성
+LENGTH_GUARD = os.getenv("LENGTH_GUARD", "false").lower() == "true"
+
+# 리액션 + 다음 문제 생성 방식
+# two_call: 리액션 생성 후 문제 개선 (호출 2번)
+# combined: REACT_IMPROVED 스키마로 한 번에 생성, 길이를 넘긴 필드만 다시 생성
+# decoupled: 문제 개선을 리액션 없이 (대화 기록만 보고) 리액션과 동시에 생성한 뒤 로컬에서 이어 붙임
+REACT_MODE = os.getenv("REACT_MODE", "two_call")
+
+# 비동기 HTTP 클라이언트 (프로세스 공용 연결 풀) - hcx_client.py
+from hcx_client import get_async_client, async_execute_chat, async_execute_react, async_stream_chat, async_stream_react
+from hedging import hedger, HEDGE_ENABLED
+from resilience import upstream, is_overload_status, UpstreamUnavailable
+import metrics
+import mp3_frames
+from tts_cache import tts_cache
+from verdict_cache import verdict_cache
+from retry_policy import retry_policy
+from text_fit import try_fit, is_emoji, split_sentences, SENTENCE_END
+from token_calibration import calibration
+from content_filter import content_filter
+from empathy_scorer import empathy_scorer
 
-def execute_react(system_message: str,user_message:str, parameter:dict, **kwargs) -> Optional[Dict[str, Any]]:
-    """
-    시스템 메시지만 넘겨서 간단하게 API 호출
-    
-    Args:
-        system_message: 시스템 메시지 (유일한 필수 파라미터)
-        **kwargs: 추가 파라미터 (temperature, topP 등)
-    
-    Returns:
-        API 응답 결과 딕셔너리 또는 None (실패시)
-    """
-    # 요청 데이터 구성
-    params = parameter.copy()
-    params.update(kwargs)  # 추가 파라미터가 있으면 업데이트
-    
-    completion_request = {
-        "messages": [{"role": "system", "content": system_message}, {"role":"user","content":user_message}],
-        **params
-    }
-    
-    # 헤더 설정
-    headers = {
-        'Authorization': f"Bearer {API_CONFIG['api_key']}",
-        'X-NCP-CLOVASTUDIO-REQUEST-ID': API_CONFIG['request_id'],
-        'Content-Type': 'application/json; charset=utf-8',
-        'Accept': 'application/json'
-    }
-    
-    # 성능 측정 시작
-    start_time = time.time()
-    memory_before = psutil.Process().memory_info().rss / 1024 / 1024  # MB
-    
-    try:
-        response = requests.post(
-            API_CONFIG['host'] + '/v3/chat-completions/HCX-007',
-            headers=headers, 
-            json=completion_request,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            response_text = result.get('result', {}).get('message', {}).get('content', '')
-            generated_tokens = result.get('result', {}).get('usage', {}).get('completionTokens', 0)
-            total_tokens = result.get('result', {}).get('usage', {}).get('totalTokens', 0)
-        else:
-            print(f"API Error: {response.status_code}, {response.text}")
-            return None
-            
-    except Exception as e:
-        print(f"Request failed: {e}")
-        return None
-    
-    # 성능 측정 종료
-    end_time = time.time()
-    memory_after = psutil.Process().memory_info().rss / 1024 / 1024  # MB
-    
-    total_time = end_time - start_time
-    first_token_time = total_time  # 비스트리밍이므로 전체시간과 동일
-    tps = generated_tokens / total_time if total_time > 0 else 0
-    
-    return {
-        'response_text': response_text,
-        'total_time': total_time,
-        'ttft': first_token_time,
-        'generated_tokens': generated_tokens,
-        'total_tokens':total_tokens,
-        'tps': tps,
-        'memory_usage': memory_after - memory_before,
-    }
 # def extract_json_from_response(response_text):
 #     """응답에서 JSON 부분을 추출하는 함수"""
 #     # JSON 객체 패턴 찾기
@@ -225,7 +82,8 @@ def execute_react(system_message: str,user_message:str, parameter:dict, **kwargs
 #  "단체 사진에서 나만 눈을 감았더라..\n아무도 그 이야기를 해주지 않았고, 그 사진은 계속 대표 사진으로 쓰이고 있어.\n그냥 웃어넘기려고 했는데 다들 나를 신경 안 쓴 것 같아 서운해.\n말하면 민망할까봐 아무도 말을 안해주걸까? 말을 안하면 이 사진이 계속 돌아다닐텐데 불편하고 서운해."]
 
 # 1. situation
-def generate_situation_and_quiz():
+def _situation_and_quiz_prompt():
+    """상황 및 문제 생성 프롬프트 (예시 상황 랜덤 선택)"""
     sinario = ["깜짝 생일 파티를 준비 중인데, 친구가 좋아해줄까 걱정돼.\n친구가 부담스러워하거나, 별로 안 좋아하면 어떡하지? 불안해...\n친구가 조용한 걸 좋아하는 편이라 더 고민돼.\n",
     "친하다고 생각했던 친구가 내 생일을 완전히 잊어버려서 너무 속상해.\n그냥 아무렇지 않게 넘어가려고 했는데 다른 친구들은 다 챙기더라고..\n내가 너무 기대를 많이 했나? 나만 의미를 부여했나 복잡해.",
     "단체 사진에서 나만 눈을 감았더라..\n아무도 그 이야기를 해주지 않았고, 그 사진은 계속 대표 사진으로 쓰이고 있어.\n그냥 웃어넘기려고 했는데 다들 나를 신경 안 쓴 것 같아 서운해.\n말하면 민망할까봐 아무도 말을 안해주걸까? 말을 안하면 이 사진이 계속 돌아다닐텐데 불편하고 서운해."]
@@ -275,28 +133,26 @@ def generate_situation_and_quiz():
     "situation": ...
     "sentences": [1.\n2.\n3.\n4.\n5.]
     """
-    for attempt in range(MAX_REACT_LENGTH):
-        print("\n=== 상황 및 문제 생성 ===")
-        result = execute_chat(system_message_situation_and_quiz, SITUATION_QUIZ_PARAMS)
-        print(result)
-        
-        if result:
-            try:
-                json_str = result['response_text']
-                json_str = json.loads(json_str)
-                situation = json_str['situation']
-
-                raw_questions = json_str['sentences']
-                questions = [re.sub(r'^\d+\.\s*', '', line.strip()) for line in raw_questions if line.strip()][:5]
-                if questions[0].find("내 말 좀 들어줄래...?") != -1:
-                    questions[0] = ''.join(questions[0].split("말 좀 들어줄래...?")[1:]).strip()
-                if questions[0].find("내 말 좀 들어줄래...") != -1:
-                    questions[0] = ''.join(questions[0].split("말 좀 들어줄래...")[1:]).strip()
-                try:
-                    if len(questions[0]) > 60:
-                        print("\n첫 번째 퀴즈 수정 중....")
-                        change_q = questions[0]
-                        change_quiz = f"""Your task is to abbreviate a sentence to less than {MAX_REACT_LENGTH*1.3} characters.
+    return system_message_situation_and_quiz
+
+
+def _parse_situation_and_quiz(response_text):
+    """상황 및 문제 생성 응답 파싱 -> (situation, questions)"""
+    json_str = json.loads(response_text)
+    situation = json_str['situation']
+
+    raw_questions = json_str['sentences']
+    questions = [re.sub(r'^\d+\.\s*', '', line.strip()) for line in raw_questions if line.strip()][:5]
+    if questions[0].find("내 말 좀 들어줄래...?") != -1:
+        questions[0] = ''.join(questions[0].split("말 좀 들어줄래...?")[1:]).strip()
+    if questions[0].find("내 말 좀 들어줄래...") != -1:
+        questions[0] = ''.join(questions[0].split("말 좀 들어줄래...")[1:]).strip()
+    return situation, questions
+
+
+def _abbreviation_prompt(change_q):
+    """긴 첫 번째 퀴즈 축약 프롬프트"""
+    return f"""Your task is to abbreviate a sentence to less than {MAX_REACT_LENGTH*1.3} characters.
                         This is the sentence: {change_q}
 
                         Do not change the content.
@@ -304,21 +160,10 @@ def generate_situation_and_quiz():
 
                         Return only abbreviated sentences without any additional explanation or text and react.
                         """
-                        result = execute_chat(change_quiz, DEFAULT_PARAMS)
-                        result = result['response_text']
-                        print(f"수정된 첫 번째 퀴즈: {result}")
-                        questions[0] = result
-                except:
-                    pass
 
-                if len(questions) == 5 and questions[0].strip() != "":
-                    return situation, questions
-            except Exception as e:
-                print(f"[에러] JSON 파싱 실패: {e}")
-        else:
-            print(f"[재시도 {attempt+1}] 다시 생성합니다.")
 
-    return "깜짝 생일파티 준비 중인데, 친구가 좋아해줄까 걱정될 때", ['친구가 다음 주에 생일이라 깜짝 파티 준비하려는데, 정말 마음이 무거워...',
+DEFAULT_SITUATION = "깜짝 생일파티 준비 중인데, 친구가 좋아해줄까 걱정될 때"
+DEFAULT_QUIZ_LIST = ['친구가 다음 주에 생일이라 깜짝 파티 준비하려는데, 정말 마음이 무거워...',
             '요즘 일이 너무 바빠서 시간 내기가 쉽지 않아... 그래서 더 초조해지고 있어.',
             '친구 몰래 다른 애들이랑 연락하면서 계획을 세워야 하니까 부담스럽기도 하고...',
             '선물도 골라야 하는데 도대체 어디서부터 시작해야 할지 감이 안 와...',
@@ -341,7 +186,8 @@ score = 0
 
 
 # 2. conversation
-def generate_verification_and_score(conversation, chatbot_name, user_nickname):
+def _verification_and_score_prompt(conversation, chatbot_name, user_nickname):
+    """검증 및 점수 프롬프트 (직전 챗봇 발화 + 사용자 응답 기준)"""
     print(f"대화리스트:{conversation}")
     ref = ""
     ref += f"- {chatbot_name}: {conversation[-2]}\n"
@@ -392,36 +238,39 @@ def generate_verification_and_score(conversation, chatbot_name, user_nickname):
 
     Return the filer and score as JSON format with fields "verification" and "score" and "reason_score" without any additional explanation or text and react.
     """
+    return system_message_verification_score
 
-    print("\n=== 검증 및 점수 ===")
-    result = execute_chat(system_message_verification_score, VERIFICAIION_AND_SCORE_PARAMS)
 
-    if result:
-        print(f"{result['response_text']}")
-        json_str = result['response_text']
+def _parse_verification_and_score(response_text):
+    """검증 및 점수 응답 파싱 -> (verification, score, reason_score)
 
-        if json_str:
-            try:
-                json_str = json.loads(json_str)
-                verification = json_str['verification']
-                score = json_str['score']
+    응답이 비었거나 JSON이 아니면 예외를 그대로 올려 호출 측 재시도에 맡긴다.
+    """
+    if not response_text:
+        raise ValueError("empty verification response")
 
-                try:
-                    reason_score = json_str['reason_score']
-                except:
-                    reason_score = ""
-                
-                if score != 0:
-                    score = 1
-                return verification, score, reason_score
-            except json.JSONDecodeError:
-                return result['verification'], 0, reason_score
-        else:
-            return result['verification'], 0, reason_score
-    return True, 0, ""
+    json_str = json.loads(response_text)
+    verification = json_str['verification']
+    score = json_str['score']
+    reason_score = json_str.get('reason_score', "")
+
+    if score != 0:
+        score = 1
+    return verification, score, reason_score
 
 
-def generate_response(conversation, score, chatbot_name, user_nickname):
+def _local_verdict(conversation):
+    """로컬 사전 필터로 확실한 부적절 판정이면 (False, 0, 이유), 아니면 None (HCX 검증으로 진행)"""
+    screened = content_filter.check(conversation[-1])
+    if not screened.reject:
+        return None
+    terms = ", ".join(hit.term for hit in screened.hits)
+    print(f"\n=== 검증 및 점수 (로컬 필터: {screened.category}, {screened.confidence:.2f}) ===\n{terms}")
+    return False, 0, f"부적절한 표현 ({screened.category})"
+
+
+def _react_prompt(conversation, score, chatbot_name, user_nickname):
+    """리액션 프롬프트 (점수에 따라 톤 결정)"""
     ref = ""
     for i in range(0,len(conversation)-1,2):
         ref += f"- {chatbot_name}: {conversation[i]}\n"
@@ -454,58 +303,18 @@ def generate_response(conversation, score, chatbot_name, user_nickname):
 
     Return your statement without any additional explanation or text.
     """
+    return system_message_react_and_improved
 
-    # print(f"=== {chatbot_name} 리액션 ===")
-    # result = execute_chat(system_message_react_and_improved, DEFAULT_PARAMS)
 
-    try:
-        attempt = 0
-        while True:
-            print(f"\n=== {chatbot_name} 리액션 ({attempt + 1}) ===")
-            if attempt > 0:
-                result = execute_react(system_message_react_and_improved + f"Generate the statement with {MAX_REACT_LENGTH*0.7} characters or less.\n", conversation[-1], REACT_PARAMS)
-            else:
-                result = execute_react(system_message_react_and_improved, conversation[-1],  REACT_PARAMS)
-            if result:
-                # print(f"{result['response_text']}")
-                react = result['response_text']
-
-                if react[:len(chatbot_name)] == chatbot_name:
-                    react = react[len(chatbot_name)+1:].strip()
-                print(react)
-            if len(react) <= MAX_REACT_LENGTH:
-                print(f"리액션 길이: {len(react)}")
-                return react
-
-            attempt += 1
-            if attempt >= attempt_limit:
-                # 최대 시도 횟수 도달 시 가장 마지막 결과로 탈출
-                print("⚠️ 최대 시도 횟수 도달. 길이 조건을 충족하지 못했지만 진행합니다.")
-                # react = ".".join(react.split(".")[:-1])
-                print(f"리액션 길이: {len(react)}")
-                return react
-    # if result:
-    #     print(f"{result['response_text']}")
-    #     react = result['response_text']
-
-    #     if react[:len(chatbot_name)] == chatbot_name:
-    #         react = react[len(chatbot_name)+1:].strip()
-
-        # return react
-    except Exception as e:
-        print(f"Error generating reaction: {e}")
-        # 예외 발생 시 기본 리액션 반환
-        # 여기서는 기본 리액션을 빈 문자열로 설정
-        return "..."
-
-
-"""
-react = generate_response(conversation, score, chatbot_name, user_nickname)
-"""
+def _strip_speaker(react, chatbot_name):
+    """응답 앞에 붙은 '{chatbot_name}:' 제거"""
+    if react[:len(chatbot_name)] == chatbot_name:
+        react = react[len(chatbot_name)+1:].strip()
+    return react
 
-def improved_question(quiz_list, conversation, react, chatbot_name):
-    default_question = quiz_list[len(conversation) // 2]
 
+def _improved_question_prompt(default_question, react, chatbot_name):
+    """다음 퀴즈 개선 프롬프트 (리액션 뒤에 자연스럽게 이어지도록)"""
     system_message_improved = f"""You are an emotion-based chatbot that converses with T-type users who are not good at expressing their emotions.
     Your name is {chatbot_name}.
     You are an F-type (emotional) MBTI personality type, and you have the following tone of voice and personality.
@@ -522,62 +331,128 @@ def improved_question(quiz_list, conversation, react, chatbot_name):
     Do not include {react}.
     Return ONLY improved phrase without any additional explanation or text and react.
     """
+    return system_message_improved
 
-    try:
-        print(f"\n=== 기존 문제 ===\n{default_question}")
-        attempt = 0
-        while True:
-            print(f"\n=== 문제 개선 ({attempt + 1}) ===")
-            if attempt > 0:
-                result = execute_chat(system_message_improved + f"Generate improved phrase with {MAX_REACT_LENGTH*0.7} characters or less.\n", DEFAULT_PARAMS)
-            else:
-                result = execute_chat(system_message_improved, DEFAULT_PARAMS)
-            if result:
-                print(f"{result['response_text']}")
-                improved_quiz = result['response_text']
-                check_length = len(react) + len(default_question)
-                if check_length - 5 < len(improved_quiz) < check_length + 5:
-                    improved_quiz = default_question
 
-            if len(improved_quiz) <= MAX_REACT_LENGTH:
-                print(f"\n퀴즈 길이: {len(improved_quiz)}")
-                return improved_quiz
+def _react_improved_prompt(conversation, score, chatbot_name, user_nickname, default_question):
+    """리액션 + 다음 문제 개선을 한 번에 생성하는 프롬프트 (REACT_IMPROVED 스키마)"""
+    ref = ""
+    for i in range(0,len(conversation)-1,2):
+        ref += f"- {chatbot_name}: {conversation[i]}\n"
+        ref += f"- {user_nickname}: {conversation[i+1]}\n"
+    if score == 0:
+        tone = "with disappointment or sad"
+    else:
+        tone = ""
 
-            attempt += 1
-            if attempt >= attempt_limit:
-                # 최대 시도 횟수 도달 시 가장 마지막 결과로 탈출
-                print("⚠️ 최대 시도 횟수 도달. 길이 조건을 충족하지 못했지만 진행합니다.")
-                print(f"개선된 퀴즈 길이: {len(improved_quiz)}")
-                print(f"기존 퀴즈 길이: {len(default_question)}")
-                return default_question
+    return f"""You are an emotion-based chatbot that converses with T-type users who are not good at expressing their emotions.
+    Your name is {chatbot_name}.
+    You are an F-type (emotional) MBTI personality type, and you have the following tone of voice and personality.
+    - Personality: Shy, emotionally intense, seeking validation, and using relationship-centric language
+    - Tone: Frequently using emotional words with emoji, 반말
 
-    # if result:
-    #     print(f"{result['response_text']}")
-    #     react = result['response_text']
+    This is a situation about {chatbot_name}: {conversation[0]}
 
-    #     if react[:len(chatbot_name)] == chatbot_name:
-    #         react = react[len(chatbot_name)+1:].strip()
+    Here is the previous conversation:
+    {ref}
 
-        # return react
-    except Exception as e:
-        print(f"Error generating reaction: {e}")
-        # 예외 발생 시 기본 리액션 반환
-        # 여기서는 기본 리액션을 빈 문자열로 설정
-        return default_question
+    {chatbot_name}가 말하는 "친구"는 {user_nickname}가 아닌 다른 친구입니다.
+
+    TASK 1: Respond emotionally {tone} and specifically to {user_nickname}'s last comment.
+    This is the last comment as you know:
+    - {user_nickname}: {conversation[-1]}
+
+    TASK 2: Improve a sentence so that it flows naturally.
+    - The sentence is what you should say after respond (task1).
+    - Consider the previous conversation.
+    - You can use conjunctions("그런데", "하지만", etc...) if necessary.
+    - Don't add any other phrases.
+    - This is the sentence: "{default_question}"
+
+    Generate "respond" and "improved_sentence" with {MAX_REACT_LENGTH*0.7} characters or less each.
+    Return "respond" and "improved_sentence" as JSON FORMAT.
+    """
+
+
+def _parse_react_improved(response_text, chatbot_name):
+    """통합 응답 파싱 -> (respond, improved_sentence). 형식이 틀리면 예외"""
+    json_str = json.loads(response_text)
+    respond = _strip_speaker(json_str['respond'].strip(), chatbot_name)
+    improved_sentence = json_str['improved_sentence'].strip()
+    if not respond or not improved_sentence:
+        raise ValueError("empty field in combined response")
+    return respond, improved_sentence
+
+
+def _decoupled_question_prompt(default_question, conversation, chatbot_name, user_nickname):
+    """리액션 없이 대화 기록만으로 다음 문제를 다듬는 프롬프트 (리액션과 동시에 생성)"""
+    ref = ""
+    for i in range(0,len(conversation)-1,2):
+        ref += f"- {chatbot_name}: {conversation[i]}\n"
+        ref += f"- {user_nickname}: {conversation[i+1]}\n"
 
+    return f"""You are an emotion-based chatbot that converses with T-type users who are not good at expressing their emotions.
+    Your name is {chatbot_name}.
+    You are an F-type (emotional) MBTI personality type, and you have the following tone of voice and personality.
+    - Personality: Shy, emotionally intense, seeking validation, and using relationship-centric language
+    - Tone: Frequently using emotional words with emoji, 반말
 
-    # print("=== 검증 및 점수 ===")
-    # result = execute_chat(system_message_improved, DEFAULT_PARAMS)
+    Here is the previous conversation:
+    {ref}
 
-    # if result:
-    #     print(f"{result['response_text']}")
-    #     improved_quiz = result['response_text']
-    #     check_length = len(react) + len(default_question)
-    #     if check_length - 5 < len(improved_quiz) < check_length + 5:
-    #         improved_quiz = default_question
+    Your goal is:
+    <improved_sentence>
+    - The phrase {default_question} is what you will say next, right after a short reaction to {user_nickname}'s last comment.
+    - Just improve this phrase so that it flows naturally from the previous conversation.
+    - Do not start with a conjunction("그런데", "하지만", etc...).
+    - Don't add any other phrases.
+
+    Return ONLY improved phrase without any additional explanation or text and react.
+    """
+
+
+CONJUNCTIONS = ("그런데", "근데", "하지만", "그렇지만", "그래도", "그리고", "그래서", "아무튼")
+
+
+def _split_sentences(text):
+    return [s for s in re.split(r"(?<=[.!?…~])\s+", text.strip()) if s]
+
+
+def join_react_and_quiz(react, improved_quiz):
+    """
+    따로 생성한 리액션과 다음 문제를 자연스럽게 잇는다
 
-    #     return improved_quiz
-    # return default_question
+    - 문제 앞에 붙은 접속사는 떼고, 리액션이 질문(?)으로 끝나면 "그런데"로 화제를 넘긴다
+    - 리액션 마지막 문장과 문제 첫 문장이 같으면 문제 쪽을 뺀다
+    - 리액션이 문장부호나 이모지 없이 끝나면 마침표를 붙인다
+    """
+    react = react.strip()
+    quiz = improved_quiz.strip()
+    if not react or react == "..." or not quiz:
+        return react, quiz
+
+    for conjunction in CONJUNCTIONS:
+        if quiz.startswith(conjunction):
+            quiz = quiz[len(conjunction):].lstrip(" ,")
+            break
+
+    last_sentence = _split_sentences(react)[-1]
+    if len(quiz) > len(last_sentence) and quiz.startswith(last_sentence):
+        quiz = quiz[len(last_sentence):].lstrip()
+
+    if react.rstrip(" ~").endswith("?"):
+        quiz = f"그런데 {quiz}"
+    elif not (react[-1] in SENTENCE_END or is_emoji(react[-1])):
+        react += "."
+    return react, quiz
+
+
+def _check_improved_quiz(improved_quiz, default_question, react):
+    """개선 결과가 리액션+기존 문제를 그대로 이어 붙인 수준이면 기존 문제 사용"""
+    check_length = len(react) + len(default_question)
+    if check_length - 5 < len(improved_quiz) < check_length + 5:
+        improved_quiz = default_question
+    return improved_quiz
 
 """
 current_distance = 7
@@ -587,40 +462,34 @@ chatbot_name = "투닥이"
 user_nickname = "삐롱이"
 """
 
-def generate_tts(text, save_path = "sample.mp3"):
-    # encText = text.encode('utf-8')
-    data = urllib.parse.urlencode({
-        "speaker": "nwoof",
-        "volume": "0",
-        "speed": "0",
-        "alpha": "2",
-        "pitch": "1",
-        "text": text,
-        "format": "mp3"
-    }).encode("utf-8")
-
-    url = "https://naveropenapi.apigw.ntruss.com/tts-premium/v1/tts"
-    request = urllib.request.Request(url)
-    request.add_header("X-NCP-APIGW-API-KEY-ID", client_id)
-    request.add_header("X-NCP-APIGW-API-KEY", client_secret)
-
-    response = urllib.request.urlopen(request, data=data)
-    rescode = response.getcode()
-
-    file_id = uuid.uuid4().hex[:16]
-    save_path = f"{file_id}.mp3"
-    if rescode == 200:
-        print("TTS mp3 save")
-        response_body = response.read()
-        with open(save_path, 'wb') as f:
-            f.write(response_body)
-        return save_path
-    else:
-        print("Error Code:", rescode)
-        return None
-    
+TTS_URL = os.getenv("TTS_URL", "https://naveropenapi.apigw.ntruss.com/tts-premium/v1/tts")  # 모의 서버 사용 시 변경
+# 긴 글은 문장 단위로 나눠 동시에 합성한 뒤 MP3 프레임 단위로 이어 붙인다 (0이면 나누지 않음)
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "100"))
+TTS_CHUNK_CONCURRENCY = int(os.getenv("TTS_CHUNK_CONCURRENCY", "4"))
+TTS_VOICE = {
+    "speaker": "nwoof",
+    "volume": "0",
+    "speed": "0",
+    "alpha": "2",
+    "pitch": "1",
+}
+
+
+def _tts_form(text):
+    """CLOVA Voice 요청 폼 데이터"""
+    return {**TTS_VOICE, "text": text, "format": "mp3"}
+
+
+def _tts_headers():
+    headers = {
+        "X-NCP-APIGW-API-KEY-ID": client_id,
+        "X-NCP-APIGW-API-KEY": client_secret,
+    }
+    return {k: v for k, v in headers.items() if v is not None}
 
-def generate_feedback(conversation, current_distance, chatbot_name, user_nickname):
+
+def _feedback_prompt(conversation, current_distance, chatbot_name, user_nickname):
+    """피드백 편지 프롬프트 (거리에 따라 톤 결정)"""
     if current_distance == 0:
         letter_tone = "Write the letter with a sense of happiness and being moved."
     elif current_distance == 1:
@@ -674,51 +543,636 @@ def generate_feedback(conversation, current_distance, chatbot_name, user_nicknam
 
     Return the letter as JSON format with fields "first_greeting", "text", "last_greeting"
     """
+    return system_message_feedback
+
+
+def _parse_feedback(response_text):
+    """피드백 응답 파싱 -> (first_greeting, text, last_greeting)"""
+    json_str = json.loads(response_text)
+    print(json_str)
+    return json_str['first_greeting'], json_str['text'], json_str['last_greeting']
+
+
+def _compose_letter(first_greeting, text, last_greeting, chatbot_name):
+    return f"{first_greeting}\n\n{text}\n\n{last_greeting}\n\n{chatbot_name}가"
+
+
+def _letter_segments(first_greeting, text, last_greeting, chatbot_name):
+    """편지 TTS 조각 (글, 캐시 여부): 인사말과 끝인사+서명은 편지마다 거의 같아서 TTS 조각 캐시를 쓴다"""
+    return [(first_greeting, True), (text, False), (f"{last_greeting}\n\n{chatbot_name}가", True)]
+
+
+FEEDBACK_FALLBACK = ("", "", "힘들었던 하루 끝에,", "")
+
+
+# =============================================================================
+# 길이 가드 스트리밍
+# =============================================================================
+async def _async_generate_within(stream_factory, system_message, hint, limit, clean):
+    """
+    스트리밍으로 생성하면서 clean(누적 텍스트)가 limit을 넘는 순간 업스트림 요청을 끊는다.
+    끊긴 텍스트는 문장 경계에서 자르고, 자를 곳이 없으면 hint를 붙여 바로 재생성한다.
+
+    Args:
+        stream_factory: system_message -> async_stream 이벤트 이터레이터
+        hint: 재시도 시 system_message 뒤에 붙일 길이 지시문
+        clean: 누적 텍스트 정리 함수 (화자 이름 제거 등)
+
+    Returns:
+        limit 이내의 텍스트 또는 None (모든 시도 실패)
+    """
+    text = ""
+    attempts = retry_policy.attempts()
+    async for attempt in attempts:
+        message = system_message + hint if attempt > 0 else system_message
+        raw = ""
+        over = False
+        result = None
+        async with aclosing(stream_factory(message)) as stream:
+            async for event, value in stream:
+                if event == "result":
+                    result = value
+                    continue
+                raw += value
+                if len(clean(raw)) > limit:
+                    over = True
+                    break  # aclosing이 스트림을 닫으면서 업스트림 연결도 끊긴다
+
+        text = clean(raw)
+        if not over:
+            if result:
+                return text
+            attempts.fail()
+            continue
+
+        cut = try_fit(text, limit)
+        if cut:
+            return cut
+        print(f"✂️ 길이 초과 - 생성 중단 후 재생성 ({attempt + 1})")
+
+    # 마지막까지 실패하면 공백 경계까지 허용해서 자른다
+    return try_fit(text, limit, loose=True)
+
+
+# =============================================================================
+# 비동기 버전 (공용 httpx.AsyncClient 사용, 스레드풀 불필요)
+# =============================================================================
+@metrics.timed_stage("situation")
+async def async_generate_situation_and_quiz():
+    system_message_situation_and_quiz = _situation_and_quiz_prompt()
+    attempts = retry_policy.attempts("situation")
+    async for attempt in attempts:
+        print("\n=== 상황 및 문제 생성 ===")
+        result = await async_execute_chat(system_message_situation_and_quiz, SITUATION_QUIZ_PARAMS)
+        print(result)
+
+        if result:
+            try:
+                situation, questions = _parse_situation_and_quiz(result['response_text'])
+                try:
+                    if len(questions[0]) > 60:
+                        print("\n첫 번째 퀴즈 수정 중....")
+                        result = await async_execute_chat(_abbreviation_prompt(questions[0]), DEFAULT_PARAMS)
+                        result = result['response_text']
+                        print(f"수정된 첫 번째 퀴즈: {result}")
+                        questions[0] = result
+                except:
+                    pass
+
+                if len(questions) == 5 and questions[0].strip() != "":
+                    return situation, questions
+            except Exception as e:
+                print(f"[에러] JSON 파싱 실패: {e}")
+        else:
+            attempts.fail()
+            print(f"[재시도 {attempt+1}] 다시 생성합니다.")
+
+    return DEFAULT_SITUATION, list(DEFAULT_QUIZ_LIST)
+
+
+@metrics.timed_stage("verification")
+async def async_generate_verification_and_score(conversation, chatbot_name, user_nickname):
+    local = _local_verdict(conversation)
+    if local:
+        # 명백한 욕설/프롬프트 탈취 시도는 HCX 호출 없이 부적절 판정
+        return local
+
+    cached = verdict_cache.get(conversation, chatbot_name, user_nickname)
+    if cached:
+        # 자주 나오는 짧은 답변은 LLM 호출 없이 캐시된 판정 사용
+        print(f"\n=== 검증 및 점수 (캐시) ===\n{cached}")
+        return cached
+
+    prescored = empathy_scorer.gate(conversation)
+    if prescored:
+        # 로컬 채점 신뢰도가 충분히 높으면 HCX 호출 생략
+        print(f"\n=== 검증 및 점수 (로컬 채점) ===\n{prescored}")
+        return prescored
+
+    system_message_verification_score = _verification_and_score_prompt(conversation, chatbot_name, user_nickname)
+
+    print("\n=== 검증 및 점수 ===")
+    if HEDGE_ENABLED:
+        # 임계 경로 호출이므로 느린 응답은 헤지 요청으로 꼬리 지연을 줄인다
+        result = await hedger.run(
+            "verification",
+            lambda: async_execute_chat(system_message_verification_score, VERIFICAIION_AND_SCORE_PARAMS)
+        )
+    else:
+        result = await async_execute_chat(system_message_verification_score, VERIFICAIION_AND_SCORE_PARAMS)
+
+    if result:
+        print(f"{result['response_text']}")
+        verdict = _parse_verification_and_score(result['response_text'])
+        verdict_cache.put(conversation, chatbot_name, user_nickname, verdict)
+        empathy_scorer.observe(conversation, verdict)
+        return verdict
+    return True, 0, ""
+
+
+@metrics.timed_stage("react")
+async def async_generate_response(conversation, score, chatbot_name, user_nickname):
+    system_message_react_and_improved = _react_prompt(conversation, score, chatbot_name, user_nickname)
+
+    if LENGTH_GUARD:
+        print(f"\n=== {chatbot_name} 리액션 (길이 가드) ===")
+        react = await _async_generate_within(
+            lambda message: async_stream_react(message, conversation[-1], calibration.params("react", REACT_PARAMS, MAX_REACT_LENGTH)),
+            system_message_react_and_improved,
+            f"Generate the statement with {MAX_REACT_LENGTH*0.7} characters or less.\n",
+            MAX_REACT_LENGTH,
+            lambda text: _strip_speaker(text, chatbot_name).strip(),
+        )
+        print(react)
+        return react if react else "..."
+
     try:
-        attempt = 0
-        while True:
-            print(f"=== 피드백 ({attempt + 1})===")
+        attempts = retry_policy.attempts("react")
+        async for attempt in attempts:
+            print(f"\n=== {chatbot_name} 리액션 ({attempt + 1}) ===")
+            params = calibration.params("react", REACT_PARAMS, MAX_REACT_LENGTH)
+            hint = calibration.hint("react", MAX_REACT_LENGTH) if attempt == 0 else None
             if attempt > 0:
-                result = execute_chat(system_message_feedback + f"Generate 'text' with {MAX_FEEDBACK_LENGTH*0.7} characters or less.\n", FEEDBACK_PARAMS)
+                result = await async_execute_react(system_message_react_and_improved + f"Generate the statement with {MAX_REACT_LENGTH*0.7} characters or less.\n", conversation[-1], params)
+            elif hint:
+                result = await async_execute_react(system_message_react_and_improved + f"Generate the statement with {hint} characters or less.\n", conversation[-1], params)
             else:
-                result = execute_chat(system_message_feedback, FEEDBACK_PARAMS)
-            print(result)
-            if result:
-                json_str = result['response_text']
-                json_str = json.loads(json_str)
-                print(json_str)
+                result = await async_execute_react(system_message_react_and_improved, conversation[-1], params)
+            if not result:
+                attempts.fail()
+                continue
+            react = _strip_speaker(result['response_text'], chatbot_name)
+            print(react)
+            calibration.record("react", len(result['response_text']), len(react), MAX_REACT_LENGTH, attempt == 0, hint)
+            if len(react) <= MAX_REACT_LENGTH:
+                print(f"리액션 길이: {len(react)}")
+                return react
+            # 조금 넘친 정도면 다시 부르지 않고 문장/절 경계에서 자른다
+            fitted = try_fit(react, MAX_REACT_LENGTH)
+            if fitted:
+                return fitted
+
+        # 최대 시도 횟수(또는 요청 마감) 도달 시 가장 마지막 결과로 탈출
+        print("⚠️ 최대 시도 횟수 도달. 길이 조건을 충족하지 못했지만 진행합니다.")
+        print(f"리액션 길이: {len(react)}")
+        return react
+    except Exception as e:
+        print(f"Error generating reaction: {e}")
+        return "..."
 
-                first_greeting = json_str['first_greeting']
-                text = json_str['text']
-                last_greeting = json_str['last_greeting']
 
+async def async_stream_response(conversation, score, chatbot_name, user_nickname):
+    """
+    async_generate_response의 스트리밍 버전
+
+    Yields:
+        ("token", str): 리액션 토큰 (앞의 '{chatbot_name}:' 는 제거된 상태)
+        ("reset", None): 길이 초과로 다시 생성 - 지금까지 보낸 토큰은 버려야 함
+        ("result", dict): 마지막에 한 번, {"react", "ttft", "attempts"}
+            ttft는 첫 리액션 토큰을 내보내기까지 걸린 시간
+    """
+    system_message_react_and_improved = _react_prompt(conversation, score, chatbot_name, user_nickname)
+    prefix_len = len(chatbot_name) + 2  # "{chatbot_name}: " 판별에 필요한 길이
+
+    with metrics.stage("react"):
+        start_time = time.time()
+        react = "..."
+        ttft = None
+        attempts = retry_policy.attempts("react")
+        async for attempt in attempts:
+            print(f"\n=== {chatbot_name} 리액션 스트리밍 ({attempt + 1}) ===")
+            if attempt > 0:
+                system_message = system_message_react_and_improved + f"Generate the statement with {MAX_REACT_LENGTH*0.7} characters or less.\n"
+            else:
+                system_message = system_message_react_and_improved
+
+            pending = ""      # 화자 이름 판별 전까지 모아두는 버퍼
+            flushed = False
+            over = False
+            sent = []
+            result = None
+            params = calibration.params("react", REACT_PARAMS, MAX_REACT_LENGTH)
+            async with aclosing(async_stream_react(system_message, conversation[-1], params)) as stream:
+                async for event, value in stream:
+                    if event == "result":
+                        result = value
+                        continue
+                    if flushed:
+                        if ttft is None:
+                            ttft = time.time() - start_time
+                        sent.append(value)
+                        yield "token", value
+                    elif len(pending + value) >= prefix_len:
+                        head = _strip_speaker(pending + value, chatbot_name).lstrip()
+                        flushed = True
+                        if head:
+                            if ttft is None:
+                                ttft = time.time() - start_time
+                            sent.append(head)
+                            yield "token", head
+                    else:
+                        pending += value
+                        continue
+
+                    if LENGTH_GUARD and len("".join(sent).strip()) > MAX_REACT_LENGTH:
+                        over = True
+                        break  # 길이 초과가 확정되면 업스트림 생성을 바로 중단
+
+            if not flushed and pending:
+                head = _strip_speaker(pending, chatbot_name).strip()
+                if head:
+                    if ttft is None:
+                        ttft = time.time() - start_time
+                    sent.append(head)
+                    yield "token", head
+
+            if over:
+                # 마지막 시도라면 공백 경계까지 허용
+                cut = try_fit("".join(sent).strip(), MAX_REACT_LENGTH, loose=attempts.is_last())
+                if cut:
+                    react = cut
+                    yield "reset", None
+                    yield "token", cut
+                    break
+                print(f"✂️ 길이 초과 - 생성 중단 후 재생성 ({attempt + 1})")
+
+            elif result:
+                react = "".join(sent).strip()
+                print(react)
+                if len(react) <= MAX_REACT_LENGTH:
+                    print(f"리액션 길이: {len(react)}")
+                    break
+                fitted = try_fit(react, MAX_REACT_LENGTH)
+                if fitted:
+                    react = fitted
+                    yield "reset", None
+                    yield "token", fitted
+                    break
+            else:
+                attempts.fail()
+
+            if attempts.is_last():
+                # 최대 시도 횟수(또는 요청 마감) 도달 시 가장 마지막 결과로 탈출
+                print("⚠️ 최대 시도 횟수 도달. 길이 조건을 충족하지 못했지만 진행합니다.")
+                break
+            if sent:
+                yield "reset", None
+
+        yield "result", {"react": react, "ttft": ttft, "attempts": attempts.number + 1}
+
+
+@metrics.timed_stage("improve")
+async def async_improved_question(quiz_list, conversation, react, chatbot_name):
+    default_question = quiz_list[len(conversation) // 2]
+    system_message_improved = _improved_question_prompt(default_question, react, chatbot_name)
+
+    if LENGTH_GUARD:
+        print("\n=== 문제 개선 (길이 가드) ===")
+        improved_quiz = await _async_generate_within(
+            lambda message: async_stream_chat(message, calibration.params("improve", DEFAULT_PARAMS, MAX_REACT_LENGTH)),
+            system_message_improved,
+            f"Generate improved phrase with {MAX_REACT_LENGTH*0.7} characters or less.\n",
+            MAX_REACT_LENGTH,
+            str.strip,
+        )
+        if not improved_quiz:
+            return default_question
+        return _check_improved_quiz(improved_quiz, default_question, react)
+
+    try:
+        print(f"\n=== 기존 문제 ===\n{default_question}")
+        improved_quiz = default_question
+        attempts = retry_policy.attempts("improve")
+        async for attempt in attempts:
+            print(f"\n=== 문제 개선 ({attempt + 1}) ===")
+            params = calibration.params("improve", DEFAULT_PARAMS, MAX_REACT_LENGTH)
+            hint = calibration.hint("improve", MAX_REACT_LENGTH) if attempt == 0 else None
+            if attempt > 0:
+                result = await async_execute_chat(system_message_improved + f"Generate improved phrase with {MAX_REACT_LENGTH*0.7} characters or less.\n", params)
+            elif hint:
+                result = await async_execute_chat(system_message_improved + f"Generate improved phrase with {hint} characters or less.\n", params)
+            else:
+                result = await async_execute_chat(system_message_improved, params)
+            if not result:
+                attempts.fail()
+                continue
+            print(f"{result['response_text']}")
+            improved_quiz = _check_improved_quiz(result['response_text'], default_question, react)
+            calibration.record("improve", len(result['response_text']), len(improved_quiz), MAX_REACT_LENGTH, attempt == 0, hint)
+
+            if len(improved_quiz) <= MAX_REACT_LENGTH:
+                print(f"\n퀴즈 길이: {len(improved_quiz)}")
+                return improved_quiz
+            fitted = try_fit(improved_quiz, MAX_REACT_LENGTH)
+            if fitted:
+                return fitted
+
+        # 최대 시도 횟수(또는 요청 마감) 도달 시 기존 문제 사용
+        print("⚠️ 최대 시도 횟수 도달. 길이 조건을 충족하지 못했지만 진행합니다.")
+        print(f"개선된 퀴즈 길이: {len(improved_quiz)}")
+        print(f"기존 퀴즈 길이: {len(default_question)}")
+        return default_question
+    except Exception as e:
+        print(f"Error generating reaction: {e}")
+        return default_question
+
+
+@metrics.timed_stage("improve")
+async def async_improved_question_decoupled(quiz_list, conversation, chatbot_name, user_nickname):
+    """
+    REACT_MODE=decoupled: 리액션을 기다리지 않고 대화 기록만으로 다음 문제 개선
+    (리액션 생성과 동시에 실행, 결과는 join_react_and_quiz로 이어 붙인다)
+    """
+    default_question = quiz_list[len(conversation) // 2]
+    system_message_improved = _decoupled_question_prompt(default_question, conversation, chatbot_name, user_nickname)
+
+    try:
+        attempts = retry_policy.attempts("improve")
+        async for attempt in attempts:
+            print(f"\n=== 문제 개선 - 리액션 병렬 ({attempt + 1}) ===")
+            params = calibration.params("improve", DEFAULT_PARAMS, MAX_REACT_LENGTH)
+            hint = calibration.hint("improve", MAX_REACT_LENGTH) if attempt == 0 else None
+            if attempt > 0:
+                result = await async_execute_chat(system_message_improved + f"Generate improved phrase with {MAX_REACT_LENGTH*0.7} characters or less.\n", params)
+            elif hint:
+                result = await async_execute_chat(system_message_improved + f"Generate improved phrase with {hint} characters or less.\n", params)
+            else:
+                result = await async_execute_chat(system_message_improved, params)
+            if not result:
+                attempts.fail()
+                continue
+            improved_quiz = result['response_text'].strip()
+            calibration.record("improve", len(result['response_text']), len(improved_quiz), MAX_REACT_LENGTH, attempt == 0, hint)
+
+            if improved_quiz and len(improved_quiz) <= MAX_REACT_LENGTH:
+                print(f"{improved_quiz}\n퀴즈 길이: {len(improved_quiz)}")
+                return improved_quiz
+            fitted = try_fit(improved_quiz, MAX_REACT_LENGTH)
+            if fitted:
+                return fitted
+
+        print("⚠️ 최대 시도 횟수 도달. 기존 퀴즈를 사용합니다.")
+        return default_question
+    except Exception as e:
+        print(f"Error improving question: {e}")
+        return default_question
+
+
+async def async_generate_react_and_question_decoupled(quiz_list, conversation, score, chatbot_name, user_nickname,
+                                                      react_task=None, improve_task=None):
+    """
+    리액션과 문제 개선을 동시에 실행하고 로컬에서 이어 붙인다.
+    react_task / improve_task가 주어지면 (검증과 함께 미리 시작한 경우) 그 결과를 사용한다.
+
+    Returns:
+        (react, improved_quiz)
+    """
+    if react_task is None:
+        react_task = asyncio.ensure_future(async_generate_response(conversation, score, chatbot_name, user_nickname))
+    if improve_task is None:
+        improve_task = asyncio.ensure_future(
+            async_improved_question_decoupled(quiz_list, conversation, chatbot_name, user_nickname)
+        )
+    try:
+        react, improved_quiz = await asyncio.gather(react_task, improve_task)
+    finally:
+        react_task.cancel()
+        improve_task.cancel()
+    return join_react_and_quiz(react, improved_quiz)
+
+
+async def async_generate_response_and_question(quiz_list, conversation, score, chatbot_name, user_nickname):
+    """
+    REACT_MODE=combined: 리액션과 개선된 다음 문제를 한 번의 호출로 생성
+
+    필드별로 길이를 검사해서 넘긴 필드만 기존 경로로 다시 생성한다.
+    (리액션 -> async_generate_response, 문제 -> 확정된 리액션 기준 async_improved_question)
+    통합 응답이 두 번 모두 형식에 맞지 않으면 기존 2회 호출 방식으로 처리한다.
+
+    Returns:
+        (react, improved_quiz)
+    """
+    default_question = quiz_list[len(conversation) // 2]
+    system_message = _react_improved_prompt(conversation, score, chatbot_name, user_nickname, default_question)
+
+    react, improved_quiz = None, None
+    with metrics.stage("react_improve"):
+        attempts = retry_policy.attempts()
+        async for attempt in attempts:
+            print(f"\n=== {chatbot_name} 리액션 + 문제 개선 ({attempt + 1}) ===")
+            # 리액션 + 문제 두 필드가 들어가므로 글자 한도를 두 배로 잡는다
+            params = calibration.params("react_improve", REACT_IMPROVED_PARAMS, MAX_REACT_LENGTH * 2)
+            result = await async_execute_react(system_message, conversation[-1], params)
+            if not result:
+                attempts.fail()
+                continue
+            try:
+                react, improved_quiz = _parse_react_improved(result['response_text'], chatbot_name)
+                calibration.record("react_improve", len(result['response_text']),
+                                   len(react) + len(improved_quiz), MAX_REACT_LENGTH * 2, attempt == 0)
+                break
+            except Exception as e:
+                print(f"[에러] 통합 응답 파싱 실패: {e}")
+
+    if react is None:
+        print("⚠️ 통합 생성 실패 - 2회 호출 방식으로 전환")
+        metrics.registry.inc("natna_combined_react_total", result="fallback")
+        react = await async_generate_response(conversation, score, chatbot_name, user_nickname)
+        return react, await async_improved_question(quiz_list, conversation, react, chatbot_name)
+
+    improved_quiz = _check_improved_quiz(improved_quiz, default_question, react)
+    print(f"리액션: {react} ({len(react)})")
+    print(f"개선된 퀴즈: {improved_quiz} ({len(improved_quiz)})")
+
+    # 조금 넘친 필드는 잘라서 맞추고, 그래도 넘치는 필드만 다시 생성한다
+    react = try_fit(react, MAX_REACT_LENGTH, stage="react_improve") or react
+    improved_quiz = try_fit(improved_quiz, MAX_REACT_LENGTH, stage="react_improve") or improved_quiz
+    react_over = len(react) > MAX_REACT_LENGTH
+    quiz_over = len(improved_quiz) > MAX_REACT_LENGTH
+    if react_over:
+        react = await async_generate_response(conversation, score, chatbot_name, user_nickname)
+    if quiz_over:
+        # 리액션이 바뀌었으면 바뀐 리액션 기준으로 다듬는다
+        improved_quiz = await async_improved_question(quiz_list, conversation, react, chatbot_name)
+
+    if react_over and quiz_over:
+        outcome = "regen_both"
+    elif react_over:
+        outcome = "regen_react"
+    elif quiz_over:
+        outcome = "regen_improve"
+    else:
+        outcome = "ok"
+    metrics.registry.inc("natna_combined_react_total", result=outcome)
+    return react, improved_quiz
+
+
+@metrics.timed_stage("tts")
+async def async_generate_tts(text, segments=None):
+    """
+    generate_tts의 비동기 버전 (공용 AsyncClient로 CLOVA Voice 호출) -> mp3 바이트 또는 None
+
+    TTS_CHUNK_CHARS 보다 긴 글은 문장 단위 조각으로 나눠 TTS_CHUNK_CONCURRENCY 개씩 동시에 합성하고
+    (모든 조각이 같은 TTS_VOICE 파라미터) 프레임 경계에서 이어 붙인다.
+
+    Args:
+        segments: [(글, 캐시 여부)] 로 나눠 주면 캐시 여부가 True 인 조각(인사말, 서명 등)은 TTS 조각 캐시에서 꺼내고
+                  나머지만 합성한다 (text 는 조각을 이어 붙일 수 없을 때 한 번에 합성하는 데 쓴다)
+    """
+    pieces = []
+    for segment, cacheable in segments or [(text, False)]:
+        if cacheable:
+            pieces.append((segment.strip(), True))
+        elif TTS_CHUNK_CHARS > 0:
+            pieces.extend((chunk, False) for chunk in split_sentences(segment, TTS_CHUNK_CHARS))
+        else:
+            pieces.append((segment.strip(), False))
+    pieces = [(piece, cacheable) for piece, cacheable in pieces if piece]
+    if len(pieces) <= 1 and not any(cacheable for _, cacheable in pieces):
+        return await _async_tts_request(text)
+
+    voice = _tts_form("")
+    semaphore = asyncio.Semaphore(TTS_CHUNK_CONCURRENCY)
+
+    async def synthesize(piece, cacheable):
+        if cacheable:
+            audio = await asyncio.to_thread(tts_cache.get, piece, voice)
+            if audio:
+                return audio
+        async with semaphore:
+            audio = await _async_tts_request(piece)
+        if cacheable and audio:
+            await asyncio.to_thread(tts_cache.put, piece, voice, audio)
+        return audio
+
+    parts = await asyncio.gather(*[synthesize(piece, cacheable) for piece, cacheable in pieces])
+    for i, part in enumerate(parts):
+        if not part:
+            # 실패한 조각만 한 번 더
+            parts[i] = await synthesize(*pieces[i])
+            if not parts[i]:
+                metrics.registry.inc("natna_tts_chunks_total", result="failed")
+                return None
+
+    joined = mp3_frames.join(parts)
+    if joined is None:
+        metrics.registry.inc("natna_tts_chunks_total", result="fallback")
+        print("TTS 조각 형식이 달라 한 번에 다시 합성합니다")
+        return await _async_tts_request(text)
+    metrics.registry.inc("natna_tts_chunks_total", result="joined")
+    metrics.registry.observe("natna_tts_chunk_count", len(pieces), metrics.COUNT_BUCKETS)
+    return joined
+
+
+async def _async_tts_request(text):
+    """CLOVA Voice 호출 1건 -> mp3 바이트 또는 None"""
+    guard = upstream("tts")
+    start_time = time.perf_counter()
+    outcome = "error"
+    try:
+        async with guard.slot():
+            try:
+                response = await get_async_client().post(TTS_URL, headers=_tts_headers(), data=_tts_form(text))
+            except httpx.TransportError as e:
+                # 타임아웃, 연결 실패, 프로토콜 오류 모두 차단기/동시성 제한에 알린다
+                outcome = "timeout" if isinstance(e, httpx.TimeoutException) else "transport"
+                guard.overload()
+                raise
+            if response.status_code == 200:
+                outcome = "success"
+                guard.success()
+            elif is_overload_status(response.status_code):
+                outcome = "overload"
+                guard.overload()
+    except UpstreamUnavailable as e:
+        outcome = "unavailable"
+        print(f"TTS unavailable: {e}")
+        return None
+    except Exception as e:
+        print(f"TTS request failed: {e}")
+        return None
+    finally:
+        metrics.record_upstream(time.perf_counter() - start_time, outcome)
+
+    if response.status_code == 200:
+        return response.content
+    else:
+        print("Error Code:", response.status_code)
+        return None
+
+
+@metrics.timed_stage("feedback")
+async def async_generate_feedback_text(conversation, current_distance, chatbot_name, user_nickname):
+    """편지 글만 생성 -> (first_greeting, text, last_greeting), 실패 시 FEEDBACK_FALLBACK 의 글 부분"""
+    system_message_feedback = _feedback_prompt(conversation, current_distance, chatbot_name, user_nickname)
+
+    try:
+        attempts = retry_policy.attempts("feedback")
+        async for attempt in attempts:
+            print(f"=== 피드백 ({attempt + 1})===")
+            params = calibration.params("feedback", FEEDBACK_PARAMS, MAX_FEEDBACK_LENGTH)
+            hint = calibration.hint("feedback", MAX_FEEDBACK_LENGTH) if attempt == 0 else None
+            if attempt > 0:
+                result = await async_execute_chat(system_message_feedback + f"Generate 'text' with {MAX_FEEDBACK_LENGTH*0.7} characters or less.\n", params)
+            elif hint:
+                result = await async_execute_chat(system_message_feedback + f"Generate 'text' with {hint} characters or less.\n", params)
+            else:
+                result = await async_execute_chat(system_message_feedback, params)
+            print(result)
+            if not result:
+                attempts.fail()
+                continue
+            first_greeting, text, last_greeting = _parse_feedback(result['response_text'])
+            calibration.record("feedback", len(result['response_text']), len(text), MAX_FEEDBACK_LENGTH, attempt == 0, hint)
+            text = try_fit(text, MAX_FEEDBACK_LENGTH) or text
             if len(text) <= MAX_FEEDBACK_LENGTH:
-                letter = f"{first_greeting}\n\n{text}\n\n{last_greeting}\n\n{chatbot_name}가"
-                tts_path = generate_tts(letter, save_path="result.mp3")
+                break
+        else:
+            # 최대 시도 횟수(또는 요청 마감) 도달 시 가장 마지막 결과로 탈출
+            print("⚠️ 최대 시도 횟수 도달. 길이 조건을 충족하지 못했지만 진행합니다.")
 
-                # mp3 파일 base64 인코딩
-                audio_base64 = ""
-                if tts_path:
-                    with open(tts_path, "rb") as audio_file:
-                        audio_base64 = base64.b64encode(audio_file.read()).decode("utf-8")
+        return first_greeting, text, last_greeting
 
-                return first_greeting, text, last_greeting, audio_base64
+    except Exception as e:
+        print(f"Error generating feedback: {e}")
+        return FEEDBACK_FALLBACK[:3]
 
-            attempt += 1
-            if attempt >= attempt_limit:
-                # 최대 시도 횟수 도달 시 가장 마지막 결과로 탈출
-                print("⚠️ 최대 시도 횟수 도달. 길이 조건을 충족하지 못했지만 진행합니다.")
-                letter = f"{first_greeting}\n\n{text}\n\n{last_greeting}\n\n{chatbot_name}가"
-                tts_path = generate_tts(letter, save_path="result.mp3")
 
-                # mp3 파일 base64 인코딩
-                audio_base64 = ""
-                if tts_path:
-                    with open(tts_path, "rb") as audio_file:
-                        audio_base64 = base64.b64encode(audio_file.read()).decode("utf-8")
+async def async_generate_letter_audio(first_greeting, text, last_greeting, chatbot_name):
+    """편지 음성 mp3 바이트 (실패 시 b"", 메모리에서 바로 업로드하므로 파일/base64 변환 없음)"""
+    letter = _compose_letter(first_greeting, text, last_greeting, chatbot_name)
+    segments = _letter_segments(first_greeting, text, last_greeting, chatbot_name)
+    return await async_generate_tts(letter, segments=segments) or b""
+
 
-                return first_greeting, text, last_greeting, audio_base64
+async def async_generate_feedback(conversation, current_distance, chatbot_name, user_nickname):
+    try:
+        first_greeting, text, last_greeting = await async_generate_feedback_text(
+            conversation, current_distance, chatbot_name, user_nickname
+        )
+        audio = await async_generate_letter_audio(first_greeting, text, last_greeting, chatbot_name)
+        return first_greeting, text, last_greeting, audio
 
     except Exception as e:
-        print(f"Error generating feedback: {e}")       
-        return "", "", "힘들었던 하루 끝에,", ""
\ No newline at end of file
+        print(f"Error generating feedback: {e}")
+        return FEEDBACK_FALLBACK[:3] + (b"",)
@@ -0,0 +1,245 @@
+# content_filter.py
+"""
+검증(verification) 로컬 사전 필터 - 욕설 / 프롬프트 탈취 시도
+
+명백한 욕설이나 "시스템 프롬프트 알려줘" 같은 시도는 HCX 검증 호출 없이 바로 부적절로 판정한다.
+애매한 경우(신뢰도가 FILTER_REJECT_CONFIDENCE 미만)는 지금처럼 HCX 검증으로 넘긴다.
+
+- 사전: config/filter_lexicon.yaml (표현 -> 가중치, 예외 단어 목록)
+- 정규화: NFKC, 소문자, 한글 음절을 자모로 분해, 된소리/비슷한 모음 통일(ㅆ→ㅅ, ㅢ→ㅣ 등),
+  공백·문장부호·숫자·이모지 제거 → "씨1발", "ㅆㅣ발", "ㅅㅂ" 같은 변형도 같은 문자열로 본다
+  (띄어 쓴 "씨 1 발"도 찾지만 여러 단어에 걸친 검출이라 가중치가 낮아져 HCX 검증으로 넘어간다)
+- 매칭: 정규화한 사전 전체를 Aho-Corasick 오토마톤 하나로 만들어 입력 길이에 비례하는 시간에 검사.
+  검출은 음절 경계에서 시작하고 끝나야 한다 ("조절" 의 ㅈㅗ+ㅈ 가 "좆" 이 되지 않게).
+  따로 쓴 자모("ㅅㅂ")는 한 글자가 한 음절이므로 자모로 쓴 사전 표현은 자모로 쓴 입력에만 걸린다
+- 예외 단어(ALLOW)와 겹치는 검출은 버린다 ("다시 발표" 의 "시발", "시발점")
+- 신뢰도: 1 - Π(1 - 가중치). 다른 검출 안에 포함된 검출("씨발" 안의 "씹")은 빼고 계산하고,
+  사전 표현보다 더 여러 단어에 걸쳐 붙은 검출은 가중치를 낮춘다
+"""
+import os
+import sys
+import argparse
+import unicodedata
+from collections import deque
+from typing import Dict, List, NamedTuple, Tuple
+
+import yaml
+
+import metrics
+
+FILTER_ENABLED = os.getenv("FILTER_ENABLED", "true").lower() == "true"
+FILTER_LEXICON_PATH = os.getenv("FILTER_LEXICON_PATH", "config/filter_lexicon.yaml")
+FILTER_CHECKS_PATH = os.getenv("FILTER_CHECKS_PATH", "config/filter_checks.yaml")
+FILTER_REJECT_CONFIDENCE = float(os.getenv("FILTER_REJECT_CONFIDENCE", "0.9"))
+FILTER_CROSS_WORD_FACTOR = 0.8   # 띄어 쓴 글자를 이어 붙여서 나온 검출의 가중치 배수
+
+_CHOSEONG = "ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ"
+_JUNGSEONG = "ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ"
+_JONGSEONG = ["", "ㄱ", "ㄲ", "ㄳ", "ㄴ", "ㄵ", "ㄶ", "ㄷ", "ㄹ", "ㄺ", "ㄻ", "ㄼ", "ㄽ", "ㄾ", "ㄿ", "ㅀ",
+              "ㅁ", "ㅂ", "ㅄ", "ㅅ", "ㅆ", "ㅇ", "ㅈ", "ㅊ", "ㅋ", "ㅌ", "ㅍ", "ㅎ"]
+# NFKC 는 호환 자모(ㄱ U+3131)를 첫가끝 자모(U+1100)로 바꾸므로 다시 호환 자모로 돌린다
+_CONJOINING = {**{chr(0x1100 + i): c for i, c in enumerate(_CHOSEONG)},
+               **{chr(0x1161 + i): c for i, c in enumerate(_JUNGSEONG)},
+               **{chr(0x11A8 + i): c for i, c in enumerate(_JONGSEONG[1:])}}
+_FOLD = str.maketrans({"ㅆ": "ㅅ", "ㄲ": "ㄱ", "ㅃ": "ㅂ", "ㄸ": "ㄷ", "ㅉ": "ㅈ",
+                       "ㅢ": "ㅣ", "ㅟ": "ㅣ", "ㅐ": "ㅔ", "ㅒ": "ㅔ", "ㅖ": "ㅔ"})
+
+
+def normalize(text: str) -> Tuple[str, List[int], List[bool]]:
+    """
+    매칭용 정규화 문자열, 각 글자가 원문 몇 번째 단어(공백 기준)에서 왔는지 목록,
+    각 글자가 음절(따로 쓴 자모, 영문자는 글자 하나)의 첫 글자인지 목록
+    """
+    chars, words, starts = [], [], []
+    word = 0
+    for ch in unicodedata.normalize("NFKC", text or "").lower():
+        if ch.isspace():
+            word += 1
+            continue
+        ch = _CONJOINING.get(ch, ch)
+        cp = ord(ch)
+        if 0xAC00 <= cp <= 0xD7A3:
+            s = cp - 0xAC00
+            jamo = _CHOSEONG[s // 588] + _JUNGSEONG[(s % 588) // 28] + _JONGSEONG[s % 28]
+        elif 0x3131 <= cp <= 0x3163 or ("a" <= ch <= "z"):
+            jamo = ch
+        else:
+            continue  # 숫자, 문장부호, 이모지 등은 끼워 넣어도 무시
+        jamo = jamo.translate(_FOLD)
+        chars.append(jamo)
+        words.extend([word] * len(jamo))
+        starts.extend([True] + [False] * (len(jamo) - 1))
+    return "".join(chars), words, starts
+
+
+def _on_syllables(starts: List[bool], start: int, end: int) -> bool:
+    """[start, end) 가 음절 경계에서 시작하고 끝나는지"""
+    return starts[start] and (end == len(starts) or starts[end])
+
+
+class AhoCorasick:
+    """여러 패턴을 한 번에 찾는 오토마톤 (build() 후 search())"""
+
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[list] = [[]]
+
+    def add(self, pattern: str, payload):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            node = nxt
+        self.out[node].append(payload)
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def search(self, text: str):
+        """(끝 위치(포함 안 함), payload) 를 차례로 돌려준다"""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for payload in self.out[node]:
+                yield i + 1, payload
+
+
+class Hit(NamedTuple):
+    term: str
+    category: str
+    weight: float
+
+
+class Screening(NamedTuple):
+    confidence: float
+    category: str          # 가장 강한 검출 종류 (없으면 "")
+    hits: List[Hit]
+
+    @property
+    def reject(self) -> bool:
+        return bool(self.hits) and self.confidence >= FILTER_REJECT_CONFIDENCE
+
+
+CLEAN = Screening(0.0, "", [])
+
+
+def _outcome(result: Screening) -> str:
+    if result.reject:
+        return "reject"
+    return "borderline" if result.hits else "clean"
+
+
+class ContentFilter:
+    def __init__(self, path: str = FILTER_LEXICON_PATH):
+        self.automaton = AhoCorasick()
+        self.stats = {"screened": 0, "rejected": 0, "borderline": 0}
+        self.size = 0
+        try:
+            with open(path, encoding="utf-8") as f:
+                lexicon = yaml.safe_load(f) or {}
+        except OSError as e:
+            print(f"Filter lexicon load failed: {e}")
+            lexicon = {}
+        for category in ("PROFANITY", "INJECTION"):
+            for term, weight in (lexicon.get(category) or {}).items():
+                self._add(str(term), (category.lower(), float(weight)))
+        for term in lexicon.get("ALLOW") or []:
+            self._add(str(term), ("allow", 0.0))
+        self.automaton.build()
+
+    def _add(self, term: str, info: Tuple[str, float]):
+        pattern, _, _ = normalize(term)
+        if pattern:
+            self.automaton.add(pattern, (term, len(pattern), len(term.split())) + info)
+            self.size += 1
+
+    def screen(self, text: str) -> Screening:
+        """사용자 발화 하나를 검사한다"""
+        if not FILTER_ENABLED or self.size == 0:
+            return CLEAN
+        normalized, words, starts = normalize(text)
+        allowed, found = [], []
+        for end, (term, length, term_words, category, weight) in self.automaton.search(normalized):
+            start = end - length
+            if not _on_syllables(starts, start, end):
+                continue
+            if category == "allow":
+                allowed.append((start, end))
+                continue
+            if words[end - 1] - words[start] + 1 > term_words:
+                weight *= FILTER_CROSS_WORD_FACTOR
+            found.append((start, end, Hit(term, category, weight)))
+
+        found = [(start, end, hit) for start, end, hit in found
+                 if not any(a_start < end and start < a_end for a_start, a_end in allowed)]
+        # 같은 구간이면 가중치가 큰 검출만, 다른 검출 안에 포함된 검출은 버린다
+        hits, spans = [], []
+        for start, end, hit in sorted(found, key=lambda f: (f[0] - f[1], -f[2].weight)):
+            if not any(s_start <= start and end <= s_end for s_start, s_end in spans):
+                spans.append((start, end))
+                hits.append(hit)
+        if not hits:
+            return CLEAN
+        keep = 1.0
+        for hit in hits:
+            keep *= 1 - hit.weight
+        strongest = max(hits, key=lambda hit: hit.weight)
+        return Screening(1 - keep, strongest.category, hits)
+
+    def check(self, text: str) -> Screening:
+        """screen() + 통계/메트릭 기록 (검증 단계에서 호출)"""
+        result = self.screen(text)
+        outcome = _outcome(result)
+        self.stats["screened"] += 1
+        if outcome != "clean":
+            self.stats["rejected" if outcome == "reject" else outcome] += 1
+        metrics.registry.inc("natna_content_filter_total", result=outcome, category=result.category or "none")
+        return result
+
+    def snapshot(self) -> Dict:
+        return {"enabled": FILTER_ENABLED, "terms": self.size, **self.stats}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="로컬 검증 필터 점검")
+    parser.add_argument("command", choices=["check"])
+    parser.add_argument("--cases", default=FILTER_CHECKS_PATH, help="문장 -> 기대 결과 표 (yaml)")
+    args = parser.parse_args(argv)
+
+    with open(args.cases, encoding="utf-8") as f:
+        cases = yaml.safe_load(f) or {}
+    failed = 0
+    for text, expected in cases.items():
+        result = content_filter.screen(str(text))
+        actual = _outcome(result)
+        if actual != expected:
+            failed += 1
+            terms = ", ".join(hit.term for hit in result.hits)
+            print(f"FAIL {text!r}: {actual} ({result.confidence:.3f} {terms}), expected {expected}")
+    print(f"{len(cases) - failed}/{len(cases)} passed")
+    return 1 if failed else 0
+
+
+# 프로세스 공용 인스턴스
+content_filter = ContentFilter()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
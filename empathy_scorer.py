@@ -0,0 +1,291 @@
+# empathy_scorer.py
+"""
+공감 점수 로컬 사전 채점 (CPU만 사용, HCX 호출 없음)
+
+검증/점수 프롬프트의 채점 기준(감정 읽기, 정당화, 함께 아파함, 곁에 있음 / "왜?", 감정 무시, 조언, 맥락 없는 긍정,
+결론 재촉)을 사전 특징으로 뽑고 작은 로지스틱 회귀로 점수(0/1)와 신뢰도를 낸다.
+
+- 사전: config/empathy_lexicon.yaml (그룹별 표현과 기본 가중치)
+- 모델: config/empathy_model.json. conversation_logs 에 쌓인 지난 HCX 판정(score, reason_score)으로 오프라인 학습한다
+    python empathy_scorer.py train    # 학습 후 모델 저장 (세션의 EMPATHY_HOLDOUT 비율은 평가용으로 뺀다)
+    python empathy_scorer.py report   # 평가 세션에서 신뢰도 기준별 적용 비율 / HCX 판정 일치율
+- EMPATHY_SCORER 모드
+  off:    사용 안 함
+  shadow: HCX 판정과 비교만 해서 natna_empathy_prescore_total 로 남긴다 (기준값 조정용, 기본값)
+  gate:   학습한 모델의 신뢰도가 EMPATHY_GATE_CONFIDENCE 이상이고 로컬 필터(content_filter)에 걸린 표현이 없으면
+          HCX 검증/점수 호출을 생략한다
+"""
+import os
+import sys
+import json
+import math
+import zlib
+import argparse
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import yaml
+
+import metrics
+from content_filter import AhoCorasick, content_filter, normalize
+
+EMPATHY_SCORER = os.getenv("EMPATHY_SCORER", "shadow").lower()     # off | shadow | gate
+EMPATHY_LEXICON_PATH = os.getenv("EMPATHY_LEXICON_PATH", "config/empathy_lexicon.yaml")
+EMPATHY_MODEL_PATH = os.getenv("EMPATHY_MODEL_PATH", "config/empathy_model.json")
+EMPATHY_GATE_CONFIDENCE = float(os.getenv("EMPATHY_GATE_CONFIDENCE", "0.95"))
+EMPATHY_HOLDOUT = float(os.getenv("EMPATHY_HOLDOUT", "0.2"))         # 평가용으로 빼는 세션 비율
+
+LOCAL_REASON = "로컬 채점"   # 이 접두어의 reason_score 는 학습 데이터에서 뺀다 (자기 판정 재학습 방지)
+STRUCTURE = ("short", "question", "length")
+
+Verdict = Tuple[bool, int, str]
+
+
+class Prescore(NamedTuple):
+    score: int
+    confidence: float
+    groups: List[str]      # 걸린 사전 그룹
+
+
+def _sigmoid(z: float) -> float:
+    return 1 / (1 + math.exp(-max(-30.0, min(30.0, z))))
+
+
+class EmpathyScorer:
+    def __init__(self, lexicon_path: str = EMPATHY_LEXICON_PATH, model_path: str = EMPATHY_MODEL_PATH):
+        self.automaton = AhoCorasick()
+        self.groups: List[str] = []
+        self.weights: Dict[str, float] = {}
+        self.bias = 0.0
+        self.model: Dict = {}
+        self.stats = {"gated": 0, "agree": 0, "disagree": 0}
+        try:
+            with open(lexicon_path, encoding="utf-8") as f:
+                lexicon = yaml.safe_load(f) or {}
+        except OSError as e:
+            print(f"Empathy lexicon load failed: {e}")
+            lexicon = {}
+        for section in ("POSITIVE", "NEGATIVE"):
+            for group, spec in (lexicon.get(section) or {}).items():
+                self.groups.append(group)
+                self.weights[group] = float(spec.get("weight", 0))
+                for term in spec.get("terms") or []:
+                    pattern, _, _ = normalize(str(term))
+                    if pattern:
+                        self.automaton.add(pattern, group)
+        self.automaton.build()
+        structure = lexicon.get("STRUCTURE") or {}
+        self.bias = float(structure.get("bias", 0))
+        for name in STRUCTURE:
+            self.weights[name] = float(structure.get(name, 0))
+        self._load_model(model_path)
+
+    def _load_model(self, path: str):
+        """학습한 모델이 있으면 사전 기본 가중치를 덮어쓴다"""
+        try:
+            with open(path, encoding="utf-8") as f:
+                model = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Empathy model load failed: {e}")
+            return
+        self.model = model
+        self.bias = float(model.get("bias", self.bias))
+        self.weights.update({name: float(w) for name, w in (model.get("weights") or {}).items()})
+
+    @property
+    def trained(self) -> bool:
+        return bool(self.model)
+
+    def features(self, reply: str) -> Dict[str, float]:
+        normalized, _, _ = normalize(reply)
+        found = dict.fromkeys(self.weights, 0.0)
+        for _, group in self.automaton.search(normalized):
+            found[group] = 1.0
+        letters = sum(1 for ch in reply or "" if ch.isalnum())
+        found["short"] = float(letters <= 6)
+        found["question"] = float((reply or "").strip().endswith("?"))
+        found["length"] = min(letters, 60) / 60
+        return found
+
+    def predict(self, reply: str) -> Prescore:
+        x = self.features(reply)
+        p = _sigmoid(self.bias + sum(self.weights[name] * value for name, value in x.items()))
+        score = int(p >= 0.5)
+        groups = [group for group in self.groups if x.get(group)]
+        return Prescore(score, p if score else 1 - p, groups)
+
+    def confident(self, reply: str) -> Optional[Prescore]:
+        """gate 모드에서 HCX 호출을 생략해도 되는 예측이면 반환"""
+        if EMPATHY_SCORER != "gate" or not self.trained or not self.groups:
+            return None
+        if content_filter.screen(reply).hits:
+            return None  # 욕설/탈취 의심 표현은 HCX 검증을 거친다
+        prescore = self.predict(reply)
+        return prescore if prescore.confidence >= EMPATHY_GATE_CONFIDENCE else None
+
+    def gate(self, conversation) -> Optional[Verdict]:
+        """HCX 검증/점수 호출 대신 쓸 로컬 판정 (없으면 None)"""
+        prescore = self.confident(conversation[-1])
+        if prescore is None:
+            return None
+        self.stats["gated"] += 1
+        metrics.registry.inc("natna_empathy_prescore_total", result="gated", confident="true")
+        groups = ", ".join(prescore.groups) or "-"
+        return True, prescore.score, f"{LOCAL_REASON} ({groups}, 신뢰도 {prescore.confidence:.2f})"
+
+    def observe(self, conversation, verdict: Verdict):
+        """HCX 판정이 나온 뒤 로컬 예측과 비교해 기록 (shadow/gate 모드)"""
+        if EMPATHY_SCORER == "off" or not self.groups or not verdict or not verdict[0]:
+            return
+        prescore = self.predict(conversation[-1])
+        result = "agree" if prescore.score == verdict[1] else "disagree"
+        self.stats[result] += 1
+        metrics.registry.inc("natna_empathy_prescore_total", result=result,
+                             confident=str(prescore.confidence >= EMPATHY_GATE_CONFIDENCE).lower())
+
+    def snapshot(self) -> Dict:
+        return {"mode": EMPATHY_SCORER, "trained": self.trained, "threshold": EMPATHY_GATE_CONFIDENCE,
+                "samples": self.model.get("samples", 0), **self.stats}
+
+
+# =============================================================================
+# 오프라인 학습 / 일치율 리포트
+# =============================================================================
+def load_examples(log_dir: str) -> List[Tuple[str, str, int]]:
+    """conversation_logs 의 HCX 판정 (세션 ID, 사용자 응답, 점수) 목록"""
+    examples = []
+    for path in sorted(Path(log_dir).glob("*.json")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                session = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        session_id = str(session.get("session_id") or path.stem)
+        for turn in session.get("conversation_log") or []:
+            reason = turn.get("reason_score") or ""
+            # 부적절 판정, 실패 기본값(이유 없음), 로컬 판정은 학습에 쓰지 않는다
+            if not turn.get("verification") or turn.get("score") not in (0, 1) or not reason:
+                continue
+            if str(reason).startswith(LOCAL_REASON) or not turn.get("user_message"):
+                continue
+            examples.append((session_id, turn["user_message"], int(turn["score"])))
+    return examples
+
+
+def is_holdout(session_id: str) -> bool:
+    return zlib.crc32(session_id.encode("utf-8")) % 1000 < EMPATHY_HOLDOUT * 1000
+
+
+def train(scorer: EmpathyScorer, examples: List[Tuple[str, str, int]], epochs: int = 300,
+          rate: float = 0.5, l2: float = 0.01) -> Dict:
+    """사전 기본 가중치에서 시작하는 배치 경사 하강 (L2 규제)"""
+    rows = [(scorer.features(reply), score) for _, reply, score in examples]
+    names = list(scorer.weights)
+    weights = dict(scorer.weights)
+    bias = scorer.bias
+    n = len(rows)
+    for _ in range(epochs):
+        grad = dict.fromkeys(names, 0.0)
+        grad_bias = 0.0
+        for x, y in rows:
+            error = _sigmoid(bias + sum(weights[name] * x[name] for name in names)) - y
+            grad_bias += error
+            for name in names:
+                if x[name]:
+                    grad[name] += error * x[name]
+        bias -= rate * grad_bias / n
+        for name in names:
+            weights[name] -= rate * (grad[name] / n + l2 * weights[name])
+    return {"bias": round(bias, 4), "weights": {name: round(w, 4) for name, w in weights.items()}}
+
+
+def agreement_report(scorer: EmpathyScorer, examples: List[Tuple[str, str, int]],
+                     thresholds=(0.6, 0.7, 0.8, 0.85, 0.9, 0.93, 0.95, 0.97, 0.99)) -> List[Dict]:
+    """신뢰도 기준별 적용 비율(coverage)과 그중 HCX 판정과 일치한 비율(agreement)"""
+    predictions = [(scorer.predict(reply), score) for _, reply, score in examples]
+    rows = []
+    for threshold in thresholds:
+        covered = [(p, y) for p, y in predictions if p.confidence >= threshold]
+        agree = sum(1 for p, y in covered if p.score == y)
+        rows.append({
+            "threshold": threshold,
+            "coverage": round(len(covered) / len(predictions), 3) if predictions else 0.0,
+            "agreement": round(agree / len(covered), 3) if covered else None,
+            "covered": len(covered),
+        })
+    return rows
+
+
+def _print_report(rows: List[Dict], total: int, target: float):
+    print(f"\n평가 표본 {total}개")
+    print(f"{'threshold':>9} {'coverage':>9} {'agreement':>9} {'covered':>8}")
+    for row in rows:
+        agreement = "-" if row["agreement"] is None else f"{row['agreement']:.3f}"
+        print(f"{row['threshold']:>9.2f} {row['coverage']:>9.3f} {agreement:>9} {row['covered']:>8}")
+    passing = [row for row in rows if row["agreement"] is not None and row["agreement"] >= target]
+    if passing:
+        print(f"\n일치율 {target} 이상인 가장 낮은 기준: EMPATHY_GATE_CONFIDENCE={passing[0]['threshold']} "
+              f"(HCX 호출의 {passing[0]['coverage'] * 100:.1f}% 생략)")
+    else:
+        print(f"\n일치율 {target} 이상인 기준 없음 - gate 모드를 쓰지 않는 것을 권장")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="공감 점수 로컬 채점 모델 학습 / 리포트")
+    parser.add_argument("command", choices=["train", "report"])
+    parser.add_argument("--logs", default="conversation_logs", help="대화 기록 디렉토리")
+    parser.add_argument("--out", default=EMPATHY_MODEL_PATH, help="모델 저장 경로 (train)")
+    parser.add_argument("--target", type=float, default=0.97, help="권장 기준을 고를 목표 일치율")
+    parser.add_argument("--all", action="store_true", help="평가용 세션만이 아니라 전체로 리포트 (report)")
+    args = parser.parse_args(argv)
+
+    examples = load_examples(args.logs)
+    holdout = [e for e in examples if is_holdout(e[0])]
+    training = [e for e in examples if not is_holdout(e[0])]
+    print(f"HCX 판정 {len(examples)}개 (학습 {len(training)}, 평가 {len(holdout)})")
+
+    if args.command == "train":
+        if not training:
+            print("학습할 판정이 없습니다")
+            return 1
+        scorer = EmpathyScorer(model_path="")
+        model = train(scorer, training)
+        scorer.model = model
+        scorer.bias = model["bias"]
+        scorer.weights.update(model["weights"])
+        rows = agreement_report(scorer, holdout) if holdout else []
+        model.update({
+            "trained_at": datetime.now().isoformat(),
+            "samples": len(training),
+            "positive_rate": round(sum(score for _, _, score in training) / len(training), 3),
+            "holdout": rows,
+        })
+        tmp = f"{args.out}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(model, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, args.out)
+        print(f"모델 저장: {args.out}")
+        for name, weight in sorted(model["weights"].items(), key=lambda item: -abs(item[1])):
+            print(f"  {name:>14} {weight:+.3f}")
+        print(f"  {'bias':>14} {model['bias']:+.3f}")
+    else:
+        scorer = EmpathyScorer(model_path=args.out)
+        print(f"모델: {args.out if scorer.trained else '없음 (사전 기본 가중치)'}")
+        rows = agreement_report(scorer, examples if args.all else holdout)
+
+    evaluated = examples if args.command == "report" and args.all else holdout
+    if evaluated:
+        _print_report(rows, len(evaluated), args.target)
+    return 0
+
+
+# 프로세스 공용 인스턴스
+empathy_scorer = EmpathyScorer()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,7 +20,9 @@ import unicodedata
 import threading
 
 
-from chat import generate_situation_and_quiz, generate_verification_and_score, generate_response, improved_question, generate_feedback
+import base64
+
+from chat import async_generate_situation_and_quiz, async_generate_verification_and_score, async_generate_response, async_improved_question, async_generate_feedback
 
 # 로깅 설정 모듈
 from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
@@ -601,34 +603,6 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"detail": exc.errors()},
     )
 
-# =============================================================================
-# 비동기 래퍼 함수들
-# =============================================================================
-async def async_generate_situation_and_quiz():
-    """비동기로 상황 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, generate_situation_and_quiz)
-
-async def async_generate_verification_and_score(conversation, chatbot_name, user_nickname):
-    """비동기로 검증 및 점수 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, generate_verification_and_score, conversation, chatbot_name, user_nickname)
-
-async def async_generate_response(conversation, score, chatbot_name, user_nickname):
-    """비동기로 응답 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, generate_response, conversation, score, chatbot_name, user_nickname)
-
-async def async_improved_question(quiz_list, conversation, react, chatbot_name):
-    """비동기로 개선된 질문 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, improved_question, quiz_list, conversation, react, chatbot_name)
-
-async def async_generate_feedback(conversation, current_distance, chatbot_name, user_nickname):
-    """비동기로 피드백 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, generate_feedback, conversation, current_distance, chatbot_name, user_nickname)
-
 # =============================================================================
 # API 엔드포인트들
 # =============================================================================
@@ -799,9 +773,10 @@ async def feedback(request: Feedback):
 
         # 비동기로 피드백 생성
         try:
-            first_greeting, text, last_greeting, audio_base64 = await async_generate_feedback(
+            first_greeting, text, last_greeting, audio = await async_generate_feedback(
                 conversation, current_distance, chatbot_name, user_nickname
             )
+            audio_base64 = base64.b64encode(audio).decode("utf-8") if audio else ""
             logger.info(f"Feedback generated - First greeting: {first_greeting[:50]}...")
             logger.info(f"Feedback text length: {len(text)}")
         except Exception as e:
@@ -0,0 +1,240 @@
+# feedback_jobs.py
+"""
+피드백 편지 비동기 작업 (편지 글은 바로 응답, 음성 합성/업로드는 백그라운드)
+
+/feedback 한 요청 안에서 편지 생성 → TTS → S3 업로드까지 하면 nginx proxy_read_timeout(60s)에 걸리기 쉬워서
+편지 글이 나오면 바로 응답하고, 음성은 작업으로 넘겨 /feedback/{chatroom_id}/status 로 확인하게 한다.
+/feedback 응답 형식이 바뀌므로(audio_base64 가 비어 있을 수 있음) 상태를 폴링하는 클라이언트에서만 켠다 (FEEDBACK_JOBS_ENABLED).
+
+- 작업 상태: letter(편지 생성 중) → audio(음성 대기/합성 중) → done / failed
+- 작업은 파일 하나(FEEDBACK_JOB_PATH)에 fcntl 락으로 워커들이 같이 쓴다 → 워커가 재시작해도 남는다
+- 채팅방마다 작업 하나 (멱등): 같은 채팅방으로 다시 요청하면 편지를 다시 만들지 않고 저장된 결과를 돌려준다.
+  다른 요청이 편지를 만드는 중이면 끝날 때까지 기다린다
+- 음성 단계는 임대(lease) 방식: 작업을 잡은 워커가 FEEDBACK_JOB_LEASE 초 안에 끝내지 못하면(죽었으면)
+  다른 워커의 run_worker 루프가 가져가서 다시 한다. 실패하면 FEEDBACK_JOB_ATTEMPTS 번까지 백오프 후 재시도
+"""
+import os
+import json
+import time
+import fcntl
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import metrics
+from retry_policy import remaining
+
+FEEDBACK_JOBS_ENABLED = os.getenv("FEEDBACK_JOBS_ENABLED", "false").lower() == "true"
+FEEDBACK_JOB_PATH = os.getenv("FEEDBACK_JOB_PATH", "chat_data/feedback_jobs.json")
+FEEDBACK_JOB_LEASE = float(os.getenv("FEEDBACK_JOB_LEASE", "120"))          # 초
+FEEDBACK_JOB_ATTEMPTS = int(os.getenv("FEEDBACK_JOB_ATTEMPTS", "3"))
+FEEDBACK_JOB_TTL = float(os.getenv("FEEDBACK_JOB_TTL", "86400"))             # 끝난 작업 보관 시간 (초)
+FEEDBACK_JOB_INTERVAL = float(os.getenv("FEEDBACK_JOB_INTERVAL", "2"))       # 밀린 작업 확인 주기 (초)
+
+LETTER, AUDIO, DONE, FAILED = "letter", "audio", "done", "failed"
+_WAIT_INTERVAL = 0.5     # 다른 요청이 편지를 만드는 중일 때 확인 주기 (초)
+_BACKOFF_MAX = 30.0
+
+
+class FeedbackJobs:
+    def __init__(self, path: str = FEEDBACK_JOB_PATH):
+        self.path = path
+        self.stats = {"created": 0, "reused": 0, "done": 0, "failed": 0, "retried": 0, "recovered": 0}
+        self._tasks = set()
+
+    @contextmanager
+    def _state(self, write: bool = True):
+        """락을 잡고 작업 목록을 읽어서 넘겨주고, 블록이 끝나면 저장한다"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                jobs = self._read()
+                yield jobs
+                if write:
+                    tmp = f"{self.path}.{os.getpid()}.tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(jobs, f, ensure_ascii=False)
+                    os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict[str, Dict]:
+        jobs = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    jobs = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Feedback jobs load failed: {e}")
+        now = time.time()
+        return {chatroom_id: job for chatroom_id, job in jobs.items()
+                if job["status"] not in (DONE, FAILED) or job["updated"] + FEEDBACK_JOB_TTL > now}
+
+    def _event(self, event: str):
+        self.stats[event] += 1
+        metrics.registry.inc("natna_feedback_jobs_total", event=event)
+
+    # -------------------------------------------------------------------------
+    # 편지 단계 (요청 안에서)
+    # -------------------------------------------------------------------------
+    def claim(self, chatroom_id: str) -> Tuple[str, Optional[Dict]]:
+        """
+        채팅방 작업을 잡는다
+
+        Returns:
+            ("claimed", None): 이 요청이 편지를 만들어야 함
+            ("busy", None): 다른 요청이 편지를 만드는 중
+            ("ready", job): 편지가 이미 있음 (실패한 음성 작업은 다시 대기열에 넣는다)
+        """
+        now = time.time()
+        with self._state() as jobs:
+            job = jobs.get(chatroom_id)
+            if job and job["status"] != LETTER:
+                if job["status"] == FAILED:
+                    job.update(status=AUDIO, attempts=0, lease=0, error=None, updated=now)
+                self._event("reused")
+                return "ready", dict(job)
+            if job and job["lease"] > now:
+                return "busy", None
+            jobs[chatroom_id] = {
+                "chatroom_id": chatroom_id, "status": LETTER, "lease": now + FEEDBACK_JOB_LEASE,
+                "owner": os.getpid(), "attempts": 0, "created": now, "updated": now,
+            }
+        self._event("created")
+        return "claimed", None
+
+    async def acquire(self, chatroom_id: str) -> Tuple[str, Optional[Dict]]:
+        """claim()과 같지만, 다른 요청이 편지를 만드는 중이면 끝날 때까지 (요청 마감 전까지) 기다린다"""
+        while True:
+            state, job = await asyncio.to_thread(self.claim, chatroom_id)
+            if state != "busy":
+                return state, job
+            left = remaining()
+            if left is not None and left < _WAIT_INTERVAL:
+                raise TimeoutError(f"feedback for {chatroom_id} is still being generated")
+            await asyncio.sleep(_WAIT_INTERVAL)
+
+    def release(self, chatroom_id: str):
+        """편지 생성에 실패하면 작업을 지워서 다음 요청이 다시 만들게 한다"""
+        with self._state() as jobs:
+            job = jobs.get(chatroom_id)
+            if job and job["status"] == LETTER and job["owner"] == os.getpid():
+                del jobs[chatroom_id]
+
+    def set_letter(self, chatroom_id: str, letter: Dict) -> Dict:
+        """편지 글 저장 → 음성 대기 상태로"""
+        now = time.time()
+        with self._state() as jobs:
+            job = jobs.setdefault(chatroom_id, {"chatroom_id": chatroom_id, "attempts": 0, "created": now})
+            job.update(letter, status=AUDIO, lease=0, owner=None, updated=now)
+            return dict(job)
+
+    def get(self, chatroom_id: str) -> Optional[Dict]:
+        with self._state(write=False) as jobs:
+            job = jobs.get(chatroom_id)
+            return dict(job) if job else None
+
+    # -------------------------------------------------------------------------
+    # 음성 단계 (백그라운드)
+    # -------------------------------------------------------------------------
+    def _lease(self, chatroom_id: Optional[str] = None) -> Optional[Dict]:
+        """음성 대기 중이고 임대가 끝난 작업 하나를 잡는다 (chatroom_id 를 주면 그 작업만)"""
+        now = time.time()
+        with self._state() as jobs:
+            if chatroom_id is None:
+                candidates = list(jobs.values())
+            else:
+                candidates = [jobs[chatroom_id]] if chatroom_id in jobs else []
+            for job in candidates:
+                if job["status"] != AUDIO or job["lease"] > now:
+                    continue
+                if job.get("owner") not in (None, os.getpid()):
+                    self._event("recovered")   # 다른 워커가 잡았다가 끝내지 못한 작업
+                job.update(lease=now + FEEDBACK_JOB_LEASE, owner=os.getpid(), attempts=job["attempts"] + 1, updated=now)
+                return dict(job)
+        return None
+
+    def _finish(self, chatroom_id: str, audio: Optional[Dict], error: Optional[str]) -> str:
+        now = time.time()
+        with self._state() as jobs:
+            job = jobs.get(chatroom_id)
+            if job is None or job["owner"] != os.getpid():
+                return "lost"   # 임대가 끝나 다른 워커가 가져감
+            if audio:
+                job.update(audio, status=DONE, error=None, lease=0, updated=now)
+                event = "done"
+            elif job["attempts"] >= FEEDBACK_JOB_ATTEMPTS:
+                job.update(status=FAILED, error=error, lease=0, updated=now)
+                event = "failed"
+            else:
+                # 백오프 후 run_worker 루프가 다시 잡는다
+                job.update(error=error, lease=now + min(_BACKOFF_MAX, 2 ** job["attempts"]), owner=None, updated=now)
+                event = "retried"
+        self._event(event)
+        return event
+
+    async def _process(self, job: Dict, synthesize):
+        start = time.perf_counter()
+        audio, error = None, None
+        try:
+            audio = await synthesize(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            print(f"Feedback audio failed ({job['chatroom_id']}, attempt {job['attempts']}): {error}")
+        event = await asyncio.to_thread(self._finish, job["chatroom_id"], audio, error)
+        metrics.registry.observe("natna_feedback_audio_seconds", time.perf_counter() - start,
+                                 metrics.LATENCY_BUCKETS, result=event)
+
+    async def _run(self, chatroom_id: Optional[str], synthesize) -> bool:
+        job = await asyncio.to_thread(self._lease, chatroom_id)
+        if job is None:
+            return False
+        await self._process(job, synthesize)
+        return True
+
+    def start(self, chatroom_id: str, synthesize):
+        """
+        음성 작업을 이 워커에서 바로 시작한다 (응답을 기다리지 않음)
+
+        요청의 컨텍스트(마감 시각, metrics stage)를 물려받지 않도록 빈 컨텍스트에서 실행한다.
+        """
+        task = asyncio.get_running_loop().create_task(self._run(chatroom_id, synthesize), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run_worker(self, synthesize):
+        """
+        밀린 음성 작업(재시도 대기, 죽은 워커가 남긴 작업)을 처리하는 백그라운드 루프 (lifespan에서 태스크로 실행)
+
+        Args:
+            synthesize: 음성 합성/업로드 코루틴 함수 (job) -> {"audio_key": ..., "audio_url": ...}
+        """
+        if not FEEDBACK_JOBS_ENABLED:
+            return
+        while True:
+            try:
+                if await self._run(None, synthesize):
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Feedback job worker error: {e}")
+            await asyncio.sleep(FEEDBACK_JOB_INTERVAL)
+
+    def snapshot(self) -> Dict:
+        counts = {}
+        try:
+            with self._state(write=False) as jobs:
+                for job in jobs.values():
+                    counts[job["status"]] = counts.get(job["status"], 0) + 1
+        except OSError as e:
+            print(f"Feedback jobs snapshot failed: {e}")
+        return {"enabled": FEEDBACK_JOBS_ENABLED, "jobs": counts, "running": len(self._tasks), **self.stats}
+
+
+# 프로세스 공용 인스턴스
+feedback_jobs = FeedbackJobs()
@@ -0,0 +1,355 @@
+# hcx_client.py
+"""
+HyperCLOVA X (HCX-007) 비동기 클라이언트
+
+프로세스당 하나의 httpx.AsyncClient(연결 풀)를 공유해서 이벤트 루프 위에서 바로 호출한다.
+스레드풀로 blocking 호출을 감싸지 않으므로 워커 하나가 수백 개의 요청을 동시에 처리할 수 있다.
+"""
+import os
+import time
+import json
+import asyncio
+import httpx
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+
+from resilience import upstream, is_overload_status, UpstreamUnavailable
+from quota import quota
+import metrics
+from singleflight import singleflight, should_coalesce, request_key
+from retry_policy import call_timeout
+from token_calibration import calibration
+
+from dotenv import load_dotenv
+load_dotenv()
+
+host = os.environ.get("HOST")
+api_key = os.environ.get("CLOVASTUDIO_API_KEY")
+request_id = os.environ.get("REQUEST_ID")
+
+API_CONFIG = {
+    'host': host,
+    'api_key': api_key,
+    'request_id': request_id
+}
+
+CHAT_COMPLETIONS_PATH = '/v3/chat-completions/HCX-007'
+
+# 연결 풀 설정
+HCX_TIMEOUT = float(os.getenv("HCX_TIMEOUT", "30"))
+HCX_MAX_CONNECTIONS = int(os.getenv("HCX_MAX_CONNECTIONS", "100"))
+HCX_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HCX_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HCX_KEEPALIVE_EXPIRY = float(os.getenv("HCX_KEEPALIVE_EXPIRY", "30"))
+
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """프로세스 공용 AsyncClient 반환 (없거나 닫혔으면 새로 생성)"""
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            timeout=HCX_TIMEOUT,
+            limits=httpx.Limits(
+                max_keepalive_connections=HCX_MAX_KEEPALIVE_CONNECTIONS,
+                max_connections=HCX_MAX_CONNECTIONS,
+                keepalive_expiry=HCX_KEEPALIVE_EXPIRY
+            )
+        )
+    return _async_client
+
+
+async def close_async_client():
+    """공용 AsyncClient 종료 (앱 종료 시 호출)"""
+    global _async_client
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    _async_client = None
+
+
+def build_headers(accept: str = 'application/json') -> Dict[str, str]:
+    """CLOVA Studio 요청 헤더 (requests와 동일하게 값이 None인 헤더는 생략)"""
+    headers = {
+        'Authorization': f"Bearer {API_CONFIG['api_key']}",
+        'X-NCP-CLOVASTUDIO-REQUEST-ID': API_CONFIG['request_id'],
+        'Content-Type': 'application/json; charset=utf-8',
+        'Accept': accept
+    }
+    return {k: v for k, v in headers.items() if v is not None}
+
+
+def build_completion_request(messages: List[Dict[str, str]], parameter: dict, **kwargs) -> Dict[str, Any]:
+    """messages와 파라미터(+추가 파라미터)로 요청 바디 구성"""
+    params = parameter.copy()
+    params.update(kwargs)  # 추가 파라미터가 있으면 업데이트
+
+    return {
+        "messages": messages,
+        **params
+    }
+
+
+async def async_execute(messages: List[Dict[str, str]], parameter: dict, **kwargs) -> Optional[Dict[str, Any]]:
+    """
+    HCX-007 chat completions 비동기 호출
+
+    Args:
+        messages: 대화 메시지 리스트
+        parameter: 기본 파라미터 (config/params.yaml)
+        **kwargs: 추가 파라미터 (temperature, topP 등)
+
+    Returns:
+        API 응답 결과 딕셔너리 또는 None (실패시)
+    """
+    completion_request = build_completion_request(messages, parameter, **kwargs)
+
+    if should_coalesce(metrics.current_stage()):
+        # 같은 요청이 이미 진행 중이면 그 응답을 같이 받는다
+        return await singleflight.do(request_key(completion_request), lambda: _async_execute(completion_request))
+    return await _async_execute(completion_request)
+
+
+async def _async_execute(completion_request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """요청 바디 하나를 실제로 업스트림에 보낸다"""
+    # 성능 측정 시작
+    start_time = time.perf_counter()
+
+    guard = upstream("chat")
+    reserved = 0
+    tokens_used = 0   # 실패한 호출은 예약한 토큰을 전부 돌려준다
+    generated_tokens = total_tokens = 0
+    outcome = "error"
+    # 요청 마감(retry_policy.deadline)이 있으면 남은 시간까지만 기다린다
+    timeout = call_timeout(HCX_TIMEOUT)
+    try:
+        if timeout <= 0:
+            outcome = "deadline"
+            print("Request skipped: request deadline exceeded")
+            return None
+        reserved = await quota.acquire(completion_request)
+        async with guard.slot():
+            try:
+                response = await get_async_client().post(
+                    API_CONFIG['host'] + CHAT_COMPLETIONS_PATH,
+                    headers=build_headers(),
+                    json=completion_request,
+                    timeout=timeout
+                )
+            except httpx.TransportError as e:
+                # 타임아웃, 연결 실패, 프로토콜 오류(연결이 중간에 끊김 등) 모두 과부하 신호로 본다
+                if isinstance(e, httpx.TimeoutException) and timeout < HCX_TIMEOUT:
+                    outcome = "deadline"  # 마감에 맞춰 줄인 타임아웃이므로 업스트림 과부하로 보지 않는다
+                else:
+                    outcome = "timeout" if isinstance(e, httpx.TimeoutException) else "transport"
+                    guard.overload()
+                raise
+
+            if response.status_code == 200:
+                # 바디가 깨졌거나 형식이 다르면 아래 except Exception 에서 error 로 기록하고 None
+                result = response.json()
+                response_text = result.get('result', {}).get('message', {}).get('content', '')
+                generated_tokens = result.get('result', {}).get('usage', {}).get('completionTokens', 0)
+                total_tokens = result.get('result', {}).get('usage', {}).get('totalTokens', 0)
+                guard.success()
+                outcome = "success"
+                tokens_used = total_tokens
+                calibration.observe_tokens(metrics.current_stage(), len(response_text), generated_tokens,
+                                           completion_request.get("maxCompletionTokens"))
+            else:
+                if is_overload_status(response.status_code):
+                    outcome = "overload"
+                    guard.overload()
+                print(f"API Error: {response.status_code}, {response.text}")
+                return None
+
+    except UpstreamUnavailable as e:
+        outcome = "unavailable"
+        print(f"Upstream unavailable: {e}")
+        return None
+    except asyncio.CancelledError:
+        outcome = "cancelled"   # 헤지/추측 실행에서 진 쪽
+        raise
+    except Exception as e:
+        print(f"Request failed: {e}")
+        return None
+    finally:
+        quota.settle(reserved, tokens_used)
+        total_time = time.perf_counter() - start_time
+        if outcome == "success":
+            metrics.record_upstream(total_time, outcome, ttft=total_time,
+                                    completion_tokens=generated_tokens, total_tokens=total_tokens)
+        else:
+            metrics.record_upstream(total_time, outcome)
+
+    # 성능 측정 종료
+    first_token_time = total_time  # 비스트리밍이므로 전체시간과 동일
+    tps = generated_tokens / total_time if total_time > 0 else 0
+
+    return {
+        'response_text': response_text,
+        'total_time': total_time,
+        'ttft': first_token_time,
+        'generated_tokens': generated_tokens,
+        'total_tokens': total_tokens,
+        'tps': tps,
+    }
+
+
+async def async_execute_chat(system_message: str, parameter: dict, **kwargs) -> Optional[Dict[str, Any]]:
+    """execute_chat의 비동기 버전 (시스템 메시지만 전달)"""
+    messages = [{"role": "system", "content": system_message}]
+    return await async_execute(messages, parameter, **kwargs)
+
+
+async def async_execute_react(system_message: str, user_message: str, parameter: dict, **kwargs) -> Optional[Dict[str, Any]]:
+    """execute_react의 비동기 버전 (시스템 + 사용자 메시지 전달)"""
+    messages = [{"role": "system", "content": system_message}, {"role": "user", "content": user_message}]
+    return await async_execute(messages, parameter, **kwargs)
+
+
+def _parse_sse_event(lines: List[str]):
+    """SSE 이벤트 한 블록(event/data 줄들)을 (event, data) 로 변환"""
+    event, data = "message", []
+    for line in lines:
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+    return event, "\n".join(data)
+
+
+async def async_stream(messages: List[Dict[str, str]], parameter: dict, **kwargs) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    HCX-007 chat completions 스트리밍 호출
+
+    Yields:
+        ("token", str): 생성된 토큰 조각
+        ("result", dict | None): 마지막에 한 번, async_execute와 같은 형식의 결과 (실패 시 None)
+            ttft는 첫 토큰 도착까지의 실제 시간
+    """
+    completion_request = build_completion_request(messages, parameter, **kwargs)
+
+    start_time = time.perf_counter()
+    first_token_time = None
+    chunks = []
+    generated_tokens = 0
+    total_tokens = 0
+
+    guard = upstream("chat")
+    reserved = 0
+    tokens_used = None  # 중간에 끊긴 스트림은 사용량을 알 수 없으므로 예약분 유지
+    outcome = "aborted"  # 호출자가 중간에 닫으면 그대로 aborted로 기록
+    timeout = call_timeout(HCX_TIMEOUT)
+    try:
+        if timeout <= 0:
+            tokens_used = 0
+            outcome = "deadline"
+            print("Request skipped: request deadline exceeded")
+            yield "result", None
+            return
+        reserved = await quota.acquire(completion_request)
+        async with guard.slot(), get_async_client().stream(
+            "POST",
+            API_CONFIG['host'] + CHAT_COMPLETIONS_PATH,
+            headers=build_headers('text/event-stream'),
+            json=completion_request,
+            timeout=timeout
+        ) as response:
+            if response.status_code != 200:
+                tokens_used = 0
+                outcome = "error"
+                if is_overload_status(response.status_code):
+                    outcome = "overload"
+                    guard.overload()
+                body = await response.aread()
+                print(f"API Error: {response.status_code}, {body.decode('utf-8', 'replace')}")
+                yield "result", None
+                return
+
+            block = []
+            async for line in response.aiter_lines():
+                if line:
+                    block.append(line)
+                    continue
+                if not block:
+                    continue
+                event, data = _parse_sse_event(block)
+                block = []
+                if not data or data == "[DONE]":
+                    continue
+
+                payload = json.loads(data)
+                if event == "token":
+                    content = payload.get('message', {}).get('content', '')
+                    if content:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter() - start_time
+                        chunks.append(content)
+                        yield "token", content
+                elif event == "result":
+                    guard.success()
+                    outcome = "success"
+                    usage = payload.get('usage') or {}
+                    generated_tokens = usage.get('completionTokens', 0)
+                    total_tokens = usage.get('totalTokens', 0)
+                    tokens_used = total_tokens
+                    calibration.observe_tokens(metrics.current_stage(), len("".join(chunks)), generated_tokens,
+                                               completion_request.get("maxCompletionTokens"))
+                elif event == "error":
+                    outcome = "error"
+                    print(f"API Error (stream): {payload}")
+                    yield "result", None
+                    return
+
+    except UpstreamUnavailable as e:
+        tokens_used = 0
+        outcome = "unavailable"
+        print(f"Upstream unavailable: {e}")
+        yield "result", None
+        return
+    except httpx.TransportError as e:
+        # 스트리밍 중 연결이 끊긴 경우(RemoteProtocolError, ReadError)도 포함
+        tokens_used = 0
+        if isinstance(e, httpx.TimeoutException) and timeout < HCX_TIMEOUT:
+            outcome = "deadline"
+        else:
+            outcome = "timeout" if isinstance(e, httpx.TimeoutException) else "transport"
+            guard.overload()
+        print(f"Request failed: {e}")
+        yield "result", None
+        return
+    except Exception as e:
+        outcome = "error"
+        print(f"Request failed: {e}")
+        yield "result", None
+        return
+    finally:
+        quota.settle(reserved, tokens_used)
+        total_time = time.perf_counter() - start_time
+        if outcome == "success":
+            metrics.record_upstream(total_time, outcome, ttft=first_token_time,
+                                    completion_tokens=generated_tokens, total_tokens=total_tokens)
+        else:
+            metrics.record_upstream(total_time, outcome, ttft=first_token_time)
+
+    tps = generated_tokens / total_time if total_time > 0 else 0
+
+    yield "result", {
+        'response_text': "".join(chunks),
+        'total_time': total_time,
+        'ttft': first_token_time if first_token_time is not None else total_time,
+        'generated_tokens': generated_tokens,
+        'total_tokens': total_tokens,
+        'tps': tps,
+    }
+
+
+def async_stream_react(system_message: str, user_message: str, parameter: dict, **kwargs) -> AsyncIterator[Tuple[str, Any]]:
+    """execute_react의 스트리밍 버전"""
+    messages = [{"role": "system", "content": system_message}, {"role": "user", "content": user_message}]
+    return async_stream(messages, parameter, **kwargs)
+
+
+def async_stream_chat(system_message: str, parameter: dict, **kwargs) -> AsyncIterator[Tuple[str, Any]]:
+    """execute_chat의 스트리밍 버전"""
+    messages = [{"role": "system", "content": system_message}]
+    return async_stream(messages, parameter, **kwargs)
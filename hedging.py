@@ -0,0 +1,166 @@
+# hedging.py
+"""
+지연 시간 꼬리(p99)를 줄이기 위한 요청 헤징
+
+첫 요청이 관측된 지연 시간의 특정 백분위수 안에 끝나지 않으면 같은 요청을 한 번 더 보내고,
+먼저 도착한 응답을 사용하고 나머지는 취소한다. 추가 요청 수는 예산(전체 요청 대비 비율)으로 제한한다.
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from singleflight import bypass
+from retry_policy import remaining, RETRY_MIN_ATTEMPT_TIME
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))    # 이 백분위수를 넘기면 헤지 요청 발사
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))           # 요청 1건당 쌓이는 헤지 예산 (0.1 = 최대 10%)
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "1.0"))     # 헤지 대기 시간 하한 (초)
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))    # 이보다 관측이 적으면 HEDGE_DEFAULT_DELAY 사용
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "3.0"))
+
+
+class LatencyTracker:
+    """최근 N개의 지연 시간으로 백분위수 계산"""
+
+    def __init__(self, window: int = 500):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self.lock:
+            if not self.samples:
+                return None
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class HedgeBudget:
+    """요청마다 ratio 만큼 쌓이고 헤지 1회마다 1씩 쓰는 예산 (최대 max_tokens)"""
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = 0.0
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class Hedger:
+    """호출 종류별 지연 시간을 관측하면서 헤지 요청을 관리"""
+
+    def __init__(self, percentile: float = HEDGE_PERCENTILE, budget: float = HEDGE_BUDGET):
+        self.percentile = percentile
+        self.budget = HedgeBudget(budget)
+        self.trackers: Dict[str, LatencyTracker] = {}
+        self.stats = {"requests": 0, "hedged": 0, "hedge_won": 0, "budget_exhausted": 0, "no_time": 0}
+
+    def tracker(self, name: str) -> LatencyTracker:
+        if name not in self.trackers:
+            self.trackers[name] = LatencyTracker()
+        return self.trackers[name]
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """
+        헤지 요청을 보내기 전까지 기다릴 시간
+
+        요청 마감까지 남은 시간에서 이만큼 기다린 뒤 RETRY_MIN_ATTEMPT_TIME 도 남지 않으면
+        헤지 요청이 이길 수 없으므로 None (헤지하지 않음)
+        """
+        tracker = self.tracker(name)
+        if len(tracker) < HEDGE_MIN_SAMPLES:
+            delay = HEDGE_DEFAULT_DELAY
+        else:
+            delay = max(HEDGE_MIN_DELAY, tracker.percentile(self.percentile))
+        left = remaining()
+        if left is not None and left - delay < RETRY_MIN_ATTEMPT_TIME:
+            return None
+        return delay
+
+    async def _timed(self, name: str, call: Callable[[], Awaitable[Any]]):
+        start = time.time()
+        result = await call()
+        if result is not None:
+            self.tracker(name).record(time.time() - start)
+        return result
+
+    async def run(self, name: str, call: Callable[[], Awaitable[Any]]):
+        """
+        call()을 실행하고, hedge_delay 안에 끝나지 않으면 같은 call()을 한 번 더 실행한다.
+        먼저 성공(None이 아닌 결과)한 쪽을 반환하고 나머지는 취소한다.
+        호출한 쪽이 취소되면(마감, 클라이언트 연결 끊김) 진행 중인 요청도 모두 취소한다.
+        """
+        self.stats["requests"] += 1
+        self.budget.deposit()
+
+        primary = asyncio.ensure_future(self._timed(name, call))
+        started = {primary: time.time()}
+        pending = {primary}
+        won = False
+        try:
+            delay = self.hedge_delay(name)
+            if delay is None:
+                self.stats["no_time"] += 1
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            if not self.budget.withdraw():
+                self.stats["budget_exhausted"] += 1
+                return await primary
+
+            self.stats["hedged"] += 1
+            print(f"🔀 [{name}] 응답 지연 - 헤지 요청 발사")
+            with bypass():
+                # 헤지 요청은 진행 중인 첫 요청과 합쳐지면 안 된다
+                hedge = asyncio.ensure_future(self._timed(name, call))
+            started[hedge] = time.time()
+            pending = {primary, hedge}
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result() is not None:
+                        if task is hedge:
+                            self.stats["hedge_won"] += 1
+                        won = True
+                        return task.result()
+                    if task.exception() is None:
+                        result = task.result()
+            if primary.exception() is not None and hedge.exception() is not None:
+                raise primary.exception()
+            return result
+        finally:
+            now = time.time()
+            for task in pending:
+                task.cancel()
+                if won:
+                    # 진 쪽은 끝나지 않았으므로 지금까지 걸린 시간(실제 지연의 하한)으로 기록한다.
+                    # 빠뜨리면 느린 응답이 관측에서 빠져 백분위수가 낮아지고 헤지가 점점 잦아진다
+                    self.tracker(name).record(now - started[task])
+
+
+# 프로세스 공용 인스턴스
+hedger = Hedger()
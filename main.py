@@ -1,7 +1,7 @@
 from fastapi import FastAPI, HTTPException, Request, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, FileResponse, Response
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
@@ -17,15 +17,30 @@ from concurrent.futures import ThreadPoolExecutor
 import contextlib
 import uuid
 import unicodedata
-import base64, boto3
 import traceback
 # from botocore.exceptions import ClientError
 
 import threading
 
-from s3_utils import upload_audio_base64, create_presigned_url
-
-from chat import generate_situation_and_quiz, generate_verification_and_score, generate_response, improved_question, generate_feedback
+from audio_storage import audio_storage, AUDIO_ROUTE, AUDIO_LOCAL_ACCEL
+
+from chat import async_generate_situation_and_quiz, async_generate_verification_and_score, async_generate_response, async_improved_question, async_generate_feedback, async_stream_response
+from chat import async_generate_feedback_text, async_generate_letter_audio
+from chat import async_generate_response_and_question, async_generate_react_and_question_decoupled, async_improved_question_decoupled, join_react_and_quiz, REACT_MODE
+from chat import DEFAULT_SITUATION, MAX_REACT_LENGTH
+from hcx_client import close_async_client
+from resilience import upstream, upstream_snapshot
+from quota import quota
+from singleflight import singleflight
+from verdict_cache import verdict_cache
+from situation_pool import situation_pool
+from retry_policy import retry_policy, with_deadline
+from token_calibration import calibration
+from content_filter import content_filter
+from empathy_scorer import empathy_scorer
+from feedback_jobs import feedback_jobs, FEEDBACK_JOBS_ENABLED
+from tts_cache import tts_cache
+import metrics
 # from chat_tudak import generate_situation_and_quiz, generate_verification_and_score, generate_response, improved_question, generate_feedback
 
 # 로깅 설정 모듈
@@ -38,15 +53,14 @@ AWS_SECRET_ACCESS_KEY=os.environ.get("AWS_SECRET_ACCESS_KEY")
 S3_URL = os.environ.get("S3_URL")
 S3_BUCKET = os.environ.get("S3_BUCKET")
 S3_PUBLIC = os.getenv("S3_PUBLIC", "true").lower() == "true"
-# s3 = boto3.client("s3", region_name="ap-northeast-2")  # EC2면 IAM Role로 자동 인증
-
-# S3 클라이언트 초기화
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+
+# 점수 산정과 두 가지 톤의 리액션을 동시에 생성 (업스트림 사용률이 SPECULATIVE_MAX_UTILIZATION 이상이면 끔)
+SPECULATIVE_REACT = os.getenv("SPECULATIVE_REACT", "false").lower() == "true"
+SPECULATIVE_MAX_UTILIZATION = float(os.getenv("SPECULATIVE_MAX_UTILIZATION", "0.5"))
+if SPECULATIVE_REACT and REACT_MODE == "combined":
+    # 추측 실행은 리액션과 문제 개선을 따로 호출하므로 한 번에 생성하는 combined 와 같이 쓰지 않는다
+    print("SPECULATIVE_REACT is ignored with REACT_MODE=combined")
+# 음성 저장소(S3 / 로컬 디스크)는 audio_storage 의 것 하나를 공유한다 (AUDIO_STORAGE)
 
 # =============================================================================
 # JSON 대화 기록 관리 클래스
@@ -541,15 +555,42 @@ executor = ThreadPoolExecutor(max_workers=os.cpu_count() * 2)
 # =============================================================================
 # 미들웨어 추가
 # =============================================================================
+async def flush_metrics_periodically():
+    """다른 워커의 /metrics 요청에서도 보이도록 이 워커의 메트릭을 주기적으로 내보낸다"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(metrics.METRICS_FLUSH_INTERVAL)
+        try:
+            await loop.run_in_executor(executor, metrics.flush)
+        except Exception as e:
+            logger.warning(f"Metrics flush failed: {e}")
+
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI):
     # 시작 시 실행
     logger.info("Application startup")
     # print(f"ConversationLogger debug info: {conversation_logger.debug_info()}")  # 디버깅
+    metrics_task = asyncio.create_task(flush_metrics_periodically())
+    # 상황/퀴즈 미리 만들어두기 (생산자 락을 잡은 워커 하나만 실제로 생성)
+    pool_task = asyncio.create_task(situation_pool.run_producer(
+        async_generate_situation_and_quiz,
+        lambda: upstream("chat").utilization(),
+        DEFAULT_SITUATION,
+        int(MAX_REACT_LENGTH * 1.3),
+    ))
+    # 밀린 피드백 음성 작업 (재시도 대기, 재시작 전에 끝나지 못한 작업)
+    feedback_task = asyncio.create_task(feedback_jobs.run_worker(synthesize_feedback_audio))
     yield
     # 종료 시 실행
     logger.info("Application shutdown")
+    metrics_task.cancel()
+    pool_task.cancel()
+    feedback_task.cancel()
+    metrics.flush()
+    verdict_cache.save()
+    await close_async_client()
     executor.shutdown(wait=True)
+    audio_storage.shutdown()
 
 # =============================================================================
 # Pydantic 모델들
@@ -660,6 +701,28 @@ async def debug_logger():
     """ConversationLogger 디버깅 정보"""
     return conversation_logger.debug_info()
 
+@app.get("/debug/upstream")
+async def debug_upstream():
+    """업스트림별 동시 요청 한도 / 회로 차단 / 공유 쿼터 / 중복 요청 합치기 상태"""
+    return {**upstream_snapshot(), "quota": quota.snapshot(), "singleflight": singleflight.snapshot(),
+            "verdict_cache": verdict_cache.snapshot(), "situation_pool": situation_pool.snapshot(),
+            "retry": retry_policy.snapshot(), "calibration": calibration.snapshot(),
+            "content_filter": content_filter.snapshot(),
+            "empathy_scorer": empathy_scorer.snapshot(),
+            "feedback_jobs": feedback_jobs.snapshot(),
+            "tts_cache": tts_cache.snapshot(), "audio_storage": audio_storage.snapshot()}
+
+@app.get("/metrics")
+async def get_metrics(format: str = "prometheus"):
+    """
+    모든 워커의 메트릭 합계 (Prometheus 텍스트 형식)
+    format=json 이면 히스토그램별 count/avg/p50/p95/p99 요약
+    """
+    merged = await asyncio.get_running_loop().run_in_executor(executor, metrics.collect)
+    if format == "json":
+        return metrics.summarize(merged)
+    return PlainTextResponse(metrics.render_prometheus(merged), media_type="text/plain; version=0.0.4")
+
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -668,40 +731,89 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"detail": exc.errors()},
     )
 
-# =============================================================================
-# 비동기 래퍼 함수들
-# =============================================================================
-async def async_generate_situation_and_quiz():
-    """비동기로 상황 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, generate_situation_and_quiz)
-
-async def async_generate_verification_and_score(conversation, chatbot_name, user_nickname):
-    """비동기로 검증 및 점수 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, generate_verification_and_score, conversation, chatbot_name, user_nickname)
-
-async def async_generate_response(conversation, score, chatbot_name, user_nickname):
-    """비동기로 응답 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, generate_response, conversation, score, chatbot_name, user_nickname)
-
-async def async_improved_question(quiz_list, conversation, react, chatbot_name):
-    """비동기로 개선된 질문 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, improved_question, quiz_list, conversation, react, chatbot_name)
-
-async def async_generate_feedback(conversation, current_distance, chatbot_name, user_nickname):
-    """비동기로 피드백 생성"""
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(executor, generate_feedback, conversation, current_distance, chatbot_name, user_nickname)
-
 # =============================================================================
 # API 엔드포인트들
 # =============================================================================
+async def verify_and_score(conversation, chatbot_name, user_nickname):
+    """검증 및 점수 생성 (실패 시 재시도 정책에 따라 재시도, 끝내 실패하면 500)"""
+    attempts = retry_policy.attempts("verification")
+    async for attempt in attempts:
+        if attempt > 0:
+            print("🔄 Retrying verification and score generation...")
+        try:
+            verification, score, reason_score = await async_generate_verification_and_score(
+                conversation, chatbot_name, user_nickname
+            )
+            print(f"✅ Verification result: {verification}, Score: {score}")
+            return verification, score, reason_score
+        except Exception as e:
+            print(f"❌ Attempt {attempt + 1} failed: {str(e)}")
+            logger.error(f"Error generating verification and score: {str(e)}", exc_info=True)
+            attempts.fail()
+    raise HTTPException(status_code=500, detail="Internal server error")
+
+
+def speculation_allowed(conversation, chatbot_name):
+    """추측 실행을 할지 결정 (마지막 턴, 캐시된 판정, 업스트림 부하가 높을 때는 하지 않음)"""
+    if not SPECULATIVE_REACT or REACT_MODE == "combined" or len(conversation) == 10:
+        return False
+    if verdict_cache.contains(conversation, chatbot_name):
+        return False
+    if content_filter.screen(conversation[-1]).hits:
+        # 로컬 필터에 걸린 발화는 부적절 판정 가능성이 높아 리액션을 미리 만들지 않는다
+        return False
+    if empathy_scorer.confident(conversation[-1]):
+        return False  # 로컬 채점으로 바로 점수가 나온다
+    if upstream("chat").utilization() >= SPECULATIVE_MAX_UTILIZATION:
+        metrics.registry.inc("natna_speculation_total", result="skipped_load")
+        return False
+    return True
+
+
+async def speculative_verify_and_react(conversation, quiz_list, chatbot_name, user_nickname):
+    """
+    검증/점수와 두 가지 톤(score 0: 서운함, score 1: 기본)의 리액션을 동시에 시작하고,
+    점수가 나오면 맞는 리액션만 남기고 나머지는 취소한다. 검증 실패면 둘 다 취소.
+    REACT_MODE=decoupled면 리액션과 무관한 문제 개선도 함께 시작한다.
+
+    Returns:
+        (verification, score, reason_score, statement, improved_quiz)
+        statement는 검증 실패 시 None, improved_quiz는 decoupled가 아니면 None
+    """
+    variants = {
+        tone_score: asyncio.create_task(async_generate_response(conversation, tone_score, chatbot_name, user_nickname))
+        for tone_score in (0, 1)
+    }
+    improve_task = None
+    if REACT_MODE == "decoupled":
+        improve_task = asyncio.create_task(
+            async_improved_question_decoupled(quiz_list, conversation, chatbot_name, user_nickname)
+        )
+    keep = None
+    try:
+        verification, score, reason_score = await verify_and_score(conversation, chatbot_name, user_nickname)
+        keep = variants.pop(score) if verification else None
+    finally:
+        for task in variants.values():
+            task.cancel()
+        if keep is None and improve_task is not None:
+            improve_task.cancel()
+
+    if keep is None:
+        metrics.registry.inc("natna_speculation_total", result="discarded")
+        return verification, score, reason_score, None, None
+    metrics.registry.inc("natna_speculation_total", result="used")
+    if improve_task is not None:
+        statement, improved_quiz = await async_generate_react_and_question_decoupled(
+            quiz_list, conversation, score, chatbot_name, user_nickname, react_task=keep, improve_task=improve_task
+        )
+        return verification, score, reason_score, statement, improved_quiz
+    return verification, score, reason_score, await keep, None
+
 
 # 1. situation
 @app.post("/situation", response_class=JSONResponse)
+@with_deadline()
 async def situation(request: Situation, background_tasks: BackgroundTasks):
     try:
         nickname = request.user_nickname
@@ -719,8 +831,12 @@ async def situation(request: Situation, background_tasks: BackgroundTasks):
         session_id = conversation_logger.create_session(nickname, chatbot_name, chatroom_id)
         print(f"Session ID: {session_id}")
         
-        # 비동기로 퀴즈 생성
-        situation, quiz_list = await async_generate_situation_and_quiz()
+        # 미리 만들어둔 세트가 있으면 바로 쓰고, 없으면 비동기로 퀴즈 생성
+        pooled = await asyncio.get_running_loop().run_in_executor(executor, situation_pool.pop, nickname)
+        if pooled:
+            situation, quiz_list = pooled
+        else:
+            situation, quiz_list = await async_generate_situation_and_quiz()
         print(f"\nSituation generated: {situation}")
         print(f"\nQuiz list generated: {quiz_list}")
 
@@ -745,6 +861,7 @@ async def situation(request: Situation, background_tasks: BackgroundTasks):
 
 # 2. Conversation (타임아웃 적용된 버전)
 @app.post("/conversation", response_class=JSONResponse)
+@with_deadline()
 async def conversation(request: Conversation):
     try:
         user_nickname = request.user_nickname
@@ -765,24 +882,16 @@ async def conversation(request: Conversation):
 
 
         # 비동기로 응답 생성
-        try:
-            verification, score, reason_score = await async_generate_verification_and_score(
-                conversation, chatbot_name, user_nickname
+        turn_start = time.perf_counter()
+        statement = None
+        improved_quiz = None
+        speculative = speculation_allowed(conversation, chatbot_name)
+        if speculative:
+            verification, score, reason_score, statement, improved_quiz = await speculative_verify_and_react(
+                conversation, quiz_list, chatbot_name, user_nickname
             )
-            print(f"✅ Verification result: {verification}, Score: {score}")
-        except Exception as e:
-            print(f"❌ First attempt failed: {str(e)}")
-            logger.error(f"Error generating verification and score: {str(e)}", exc_info=True)
-            try:
-                print("🔄 Retrying verification and score generation...")
-                verification, score, reason_score = await async_generate_verification_and_score(
-                    conversation, chatbot_name, user_nickname
-                )
-                print(f"✅ Retry result: {verification}, Score: {score}")
-            except Exception as e:
-                print(f"❌ Retry also failed: {str(e)}")
-                logger.error(f"Retry failed: {str(e)}", exc_info=True)
-                raise HTTPException(status_code=500, detail="Internal server error")
+        else:
+            verification, score, reason_score = await verify_and_score(conversation, chatbot_name, user_nickname)
             
         if verification == False:
             print(f"Verification failed, saving with score 0")  # 디버깅용
@@ -811,8 +920,24 @@ async def conversation(request: Conversation):
 
             print(f"✅ Verification successful! Generating responses...")
 
-            statement = await async_generate_response(conversation, score, chatbot_name, user_nickname)
-            improved_quiz = await async_improved_question(quiz_list, conversation, statement, chatbot_name)
+            if improved_quiz is not None:
+                pass  # 추측 실행에서 리액션과 문제까지 모두 생성됨
+            elif statement is None and REACT_MODE == "combined":
+                statement, improved_quiz = await async_generate_response_and_question(
+                    quiz_list, conversation, score, chatbot_name, user_nickname
+                )
+            elif statement is None and REACT_MODE == "decoupled":
+                statement, improved_quiz = await async_generate_react_and_question_decoupled(
+                    quiz_list, conversation, score, chatbot_name, user_nickname
+                )
+            else:
+                if statement is None:
+                    statement = await async_generate_response(conversation, score, chatbot_name, user_nickname)
+                improved_quiz = await async_improved_question(quiz_list, conversation, statement, chatbot_name)
+            metrics.registry.observe(
+                "natna_turn_duration_seconds", time.perf_counter() - turn_start, metrics.LATENCY_BUCKETS,
+                endpoint="conversation", mode=REACT_MODE, speculative=str(speculative).lower()
+            )
 
             # 성공한 경우 기록
             user_message = conversation[-1] if conversation else ""
@@ -845,8 +970,223 @@ async def conversation(request: Conversation):
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
+# 2-1. Conversation (SSE 스트리밍 버전)
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Server-Sent Events 포맷 문자열"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/conversation/stream")
+async def conversation_stream(request: Conversation):
+    """
+    /conversation과 같은 입력으로 챗봇 리액션을 토큰 단위로 스트리밍
+
+    events:
+        token  {"content": str}        리액션 토큰
+        reset  {}                      길이 초과로 재생성 - 지금까지 받은 토큰 폐기
+        done   /conversation 응답 + ttft  마지막 이벤트
+        error  {"detail": str}
+    """
+    start_time = time.time()
+    user_nickname = unicodedata.normalize("NFC", request.user_nickname.strip())
+    chatbot_name = unicodedata.normalize("NFC", request.chatbot_name.strip())
+    conversation = request.conversation
+    quiz_list = request.quiz_list
+    chatroom_id = request.chatroom_id
+
+    session_id = conversation_logger.get_or_create_session(user_nickname, chatbot_name, chatroom_id)
+    logger.info(f"Processing conversation stream for user: {user_nickname} with chatbot: {chatbot_name}, distance: {request.current_distance}")
+
+    @with_deadline()
+    async def event_stream():
+        improve_task = None
+        try:
+            verification, score, reason_score = await verify_and_score(conversation, chatbot_name, user_nickname)
+
+            if verification == False:
+                yield sse_event("done", {"react": "", "score": 0, "improved_quiz": "", "verification": False})
+                return
+            if len(conversation) == 10:
+                yield sse_event("done", {"react": "", "score": score, "improved_quiz": "", "verification": True})
+                return
+
+            if REACT_MODE == "decoupled":
+                # 리액션을 스트리밍하는 동안 다음 문제를 미리 다듬는다
+                improve_task = asyncio.create_task(
+                    async_improved_question_decoupled(quiz_list, conversation, chatbot_name, user_nickname)
+                )
+
+            ttft = None
+            statement = "..."
+            async for event, value in async_stream_response(conversation, score, chatbot_name, user_nickname):
+                if event == "token":
+                    if ttft is None:
+                        ttft = time.time() - start_time
+                    yield sse_event("token", {"content": value})
+                elif event == "reset":
+                    yield sse_event("reset", {})
+                else:
+                    statement = value["react"]
+                    logger.info(f"React stream: upstream ttft={value['ttft']}, client ttft={ttft}, attempts={value['attempts']}")
+
+            if improve_task is not None:
+                # 스트리밍으로 이미 보낸 리액션은 그대로 두고 문제만 이어 붙임 규칙 적용
+                _, improved_quiz = join_react_and_quiz(statement, await improve_task)
+            else:
+                improved_quiz = await async_improved_question(quiz_list, conversation, statement, chatbot_name)
+            metrics.registry.observe(
+                "natna_turn_duration_seconds", time.time() - start_time, metrics.LATENCY_BUCKETS,
+                endpoint="conversation_stream", mode="decoupled" if improve_task is not None else "two_call",
+                speculative="false"
+            )
+
+            conversation_logger.add_conversation(
+                user_nickname = user_nickname,
+                chatbot_name = chatbot_name,
+                chatroom_id = chatroom_id,
+                session_id=session_id,
+                user_message=conversation[-1] if conversation else "",
+                bot_message=f"{statement} {improved_quiz}".strip(),
+                score=score,
+                reason_score= reason_score,
+                react=statement,
+                improved_quiz=improved_quiz,
+                verification=verification
+            )
+
+            yield sse_event("done", {
+                "react": statement,
+                "score": score,
+                "improved_quiz": improved_quiz,
+                "verification": True,
+                "ttft": ttft
+            })
+
+        except Exception as e:
+            logger.error(f"Error in conversation stream: {str(e)}", exc_info=True)
+            yield sse_event("error", {"detail": "Internal server error"})
+        finally:
+            if improve_task is not None:
+                improve_task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # 3. Feedback
+def feedback_audio_key(chatroom_id: str) -> str:
+    return f"chatrooms/results/{chatroom_id}/letter_voice.mp3"
+
+
+async def synthesize_feedback_audio(job):
+    """피드백 작업의 음성 단계: TTS → 저장소 업로드 (실패 시 예외 → 작업 재시도)"""
+    audio = await async_generate_letter_audio(
+        job["first_greeting"], job["feedback"], job["last_greeting"], job["chatbot_name"]
+    )
+    if not audio:
+        raise RuntimeError("TTS failed")
+    key = feedback_audio_key(job["chatroom_id"])
+    url = await audio_storage.upload(audio, key)
+    return {"audio_key": key, "audio_url": url}
+
+
+def feedback_job_status(job) -> Dict:
+    """작업 상태 응답 (비공개 버킷이면 presigned URL 을 이때 발급)"""
+    return {
+        "chatroom_id": job["chatroom_id"],
+        "status": job["status"],
+        "audio_url": audio_storage.url(job["audio_key"]) if job["status"] == "done" else "",
+        "attempts": job["attempts"],
+        "updated_at": datetime.fromtimestamp(job["updated"]).isoformat(),
+    }
+
+
+async def feedback_with_job(conversation, current_distance, chatbot_name, user_nickname, chatroom_id, session_id):
+    """
+    편지 글만 만들어 바로 응답하고 음성은 작업으로 넘긴다 (채팅방마다 한 번만 생성)
+
+    audio_base64 에는 음성이 이미 준비된 경우에만 URL이 들어가고, 아니면 status_url 로 확인한다.
+    """
+    try:
+        state, job = await feedback_jobs.acquire(chatroom_id)
+    except TimeoutError as e:
+        print(f"Feedback job busy: {e}")
+        raise HTTPException(status_code=503, detail="Feedback is being generated")
+
+    if state == "claimed":
+        try:
+            first_greeting, text, last_greeting = await async_generate_feedback_text(
+                conversation, current_distance, chatbot_name, user_nickname
+            )
+        except BaseException:
+            # 차단기 열림, 마감 초과, 클라이언트 연결 끊김(취소) 등: 작업을 놓아야 재요청이 503 에 막히지 않는다
+            await asyncio.to_thread(feedback_jobs.release, chatroom_id)
+            raise
+        if not text:
+            await asyncio.to_thread(feedback_jobs.release, chatroom_id)
+            raise HTTPException(status_code=500, detail="Internal server error")
+        logger.info(f"{first_greeting}\n\n{text}\n\n{last_greeting}")
+        logger.info(f"본문 길이: {len(text)}")
+        job = await asyncio.to_thread(feedback_jobs.set_letter, chatroom_id, {
+            "first_greeting": first_greeting, "feedback": text, "last_greeting": last_greeting,
+            "chatbot_name": chatbot_name,
+        })
+        conversation_logger.add_feedback(
+            user_nickname = user_nickname,
+            chatbot_name = chatbot_name,
+            chatroom_id = chatroom_id,
+            session_id=session_id,
+            first_greeting=first_greeting,
+            feedback=text,
+            last_greeting=last_greeting
+        )
+    else:
+        print(f"Reusing feedback job for {chatroom_id}: {job['status']}")
+
+    if job["status"] == "audio":
+        feedback_jobs.start(chatroom_id, synthesize_feedback_audio)
+    status = feedback_job_status(job)
+    return {
+        "feedback": job["feedback"],
+        "last_greeting": job["last_greeting"],
+        "audio_base64": status["audio_url"],
+        "status": status["status"],
+        "status_url": f"/feedback/{chatroom_id}/status",
+    }
+
+
+@app.get("/feedback/{chatroom_id}/status")
+async def feedback_status(chatroom_id: str):
+    """피드백 음성 작업 상태 (letter → audio → done / failed)"""
+    job = await asyncio.to_thread(feedback_jobs.get, chatroom_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Feedback job not found")
+    return feedback_job_status(job)
+
+
+@app.get(AUDIO_ROUTE + "/{shard1}/{shard2}/{name}")
+async def local_audio(shard1: str, shard2: str, name: str):
+    """
+    로컬 저장소 음성 (AUDIO_STORAGE=local)
+
+    파일 확인만 하고 전송은 nginx 가 X-Accel-Redirect 로 sendfile (Range 포함). AUDIO_LOCAL_ACCEL=false 면 직접 보낸다.
+    """
+    if audio_storage.name != "local":
+        raise HTTPException(status_code=404, detail="Not Found")
+    path = await asyncio.to_thread(audio_storage.resolve, shard1, shard2, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Audio not found")
+    if AUDIO_LOCAL_ACCEL:
+        return Response(media_type="audio/mpeg",
+                        headers={"X-Accel-Redirect": audio_storage.accel_path(shard1, shard2, name)})
+    return FileResponse(path, media_type="audio/mpeg")
+
+
 @app.post("/feedback", response_class = JSONResponse)
+@with_deadline()
 async def feedback(request: Feedback):
     try:
         user_nickname = request.user_nickname
@@ -866,16 +1206,17 @@ async def feedback(request: Feedback):
         session_id = conversation_logger.get_or_create_session(user_nickname, chatbot_name, chatroom_id)
         print(f"Session ID: {session_id}")  # 디버깅용
 
+        if FEEDBACK_JOBS_ENABLED:
+            return await feedback_with_job(conversation, current_distance, chatbot_name, user_nickname, chatroom_id, session_id)
+
         # 비동기로 피드백 생성
-        first_greeting, text, last_greeting, audio_base64 = await async_generate_feedback(conversation, current_distance, chatbot_name, user_nickname)
+        first_greeting, text, last_greeting, audio = await async_generate_feedback(conversation, current_distance, chatbot_name, user_nickname)
         logger.info(f"{first_greeting}\n\n{text}\n\n{last_greeting}")
         logger.info(f"본문 길이: {len(text)}")
 
-        key = f"chatrooms/results/{chatroom_id}/letter_voice.mp3"
-
-        public_url = upload_audio_base64(audio_base64, key)
+        key = feedback_audio_key(chatroom_id)
 
-        presigned_url = create_presigned_url(key, expires=3600)
+        await audio_storage.upload(audio, key)
 
         conversation_logger.add_feedback(
             user_nickname = user_nickname,
@@ -889,9 +1230,11 @@ async def feedback(request: Feedback):
         return {
                 "feedback": text,
                 "last_greeting": last_greeting,
-                "audio_base64": public_url
+                "audio_base64": audio_storage.url(key)
                 }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in feedback endpoint: {str(e)}", exc_info=True)
         print(f"Error in feedback endpoint: {str(e)}")  # 디버깅용
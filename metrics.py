@@ -0,0 +1,343 @@
+# metrics.py
+"""
+프로세스 내 메트릭 레지스트리 (카운터, 히스토그램)
+
+- 업스트림 호출마다 지연 시간/TTFT/토큰/TPS를 호출 종류(situation, verification, react, improve, feedback, tts)별로 기록
+- 생성 단계(stage)마다 소요 시간과 업스트림 호출 횟수(재시도 포함)를 기록
+- 워커마다 METRICS_DIR/{pid}.json 으로 주기적으로 내보내고, /metrics 에서 모든 워커 값을 합쳐 Prometheus 형식으로 노출
+  종료된 워커의 파일은 archive.json 에 합쳐서 카운터가 줄어들지 않게 한다.
+
+호출 종류 라벨은 contextvar(stage)로 전달되므로 hcx_client 함수 시그니처를 바꿀 필요가 없다.
+"""
+import os
+import json
+import time
+import fcntl
+import bisect
+import functools
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+METRICS_DIR = os.getenv(
+    "METRICS_DIR",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "natna_metrics")
+)
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 1.5, 2, 3, 5, 7.5, 10, 15, 20, 30, 60]
+TOKEN_BUCKETS = [16, 32, 64, 128, 256, 512, 1024, 2048]
+TPS_BUCKETS = [5, 10, 20, 40, 60, 80, 100, 150, 200]
+COUNT_BUCKETS = [1, 2, 3, 4, 5, 10, 20, 60]
+
+HELP = {
+    "natna_upstream_requests_total": ("counter", "Upstream calls by call type and outcome"),
+    "natna_upstream_latency_seconds": ("histogram", "Upstream call latency"),
+    "natna_upstream_ttft_seconds": ("histogram", "Upstream time to first token"),
+    "natna_upstream_completion_tokens": ("histogram", "Completion tokens per upstream call"),
+    "natna_upstream_tokens_total": ("counter", "Total tokens (prompt + completion) used"),
+    "natna_upstream_tps": ("histogram", "Completion tokens per second"),
+    "natna_upstream_coalesced_total": ("counter", "Calls served by an identical in-flight upstream call"),
+    "natna_verdict_cache_total": ("counter", "Verification/score cache lookups by result and key type"),
+    "natna_situation_pool_total": ("counter", "Situation/quiz warm pool events (hit, miss, produced, duplicate, failed)"),
+    "natna_speculation_total": ("counter", "Speculative reaction turns by result"),
+    "natna_combined_react_total": ("counter", "Combined react + improved question calls by result"),
+    "natna_turn_duration_seconds": ("histogram", "Conversation turn latency by react mode"),
+    "natna_stage_duration_seconds": ("histogram", "Generation stage duration including retries"),
+    "natna_stage_upstream_calls": ("histogram", "Upstream calls per stage execution"),
+    "natna_length_fit_total": ("counter", "Over-length outputs fitted locally (fit = LLM call saved) or not (miss)"),
+    "natna_calibration_first_try_total": ("counter", "First generation attempts within the length limit (ok) or over it"),
+    "natna_calibration_truncated_total": ("counter", "Responses that hit the calibrated maxCompletionTokens cap"),
+    "natna_content_filter_total": ("counter", "Local verification pre-filter results (reject skips the HCX call)"),
+    "natna_empathy_prescore_total": ("counter", "Local empathy pre-score: gated (HCX call skipped) or agreement with the HCX score"),
+    "natna_feedback_jobs_total": ("counter", "Feedback audio job events (created, reused, done, retried, failed, recovered)"),
+    "natna_feedback_audio_seconds": ("histogram", "Background feedback audio (TTS + upload) duration"),
+    "natna_tts_chunks_total": ("counter", "Sentence-chunked TTS results (joined, fallback to one call, failed)"),
+    "natna_tts_chunk_count": ("histogram", "Chunks per chunked TTS synthesis"),
+    "natna_tts_cache_total": ("counter", "TTS segment cache lookups (hit, miss) and evictions"),
+    "natna_audio_upload_total": ("counter", "Letter audio uploads (ok, retry, failed)"),
+    "natna_audio_upload_seconds": ("histogram", "Letter audio upload duration including retries"),
+    "natna_retry_stopped_total": ("counter", "Retry loops stopped early by attempt cap, request deadline or retry budget"),
+    "natna_stage_retries_total": ("counter", "Extra upstream calls (retries) per stage"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Registry:
+    """카운터와 히스토그램 (누적 버킷 아닌 구간별 카운트로 저장, 출력 시 누적)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Dict]] = {}
+        self.buckets: Dict[str, List[float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _labels(**labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: List[float], **labels):
+        key = _labels(**labels)
+        with self.lock:
+            self.buckets.setdefault(name, buckets)
+            series = self.histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {"counts": [0] * (len(buckets) + 1), "sum": 0.0, "count": 0}
+            hist["counts"][bisect.bisect_left(buckets, value)] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def dump(self) -> Dict:
+        """JSON 직렬화 가능한 스냅샷"""
+        with self.lock:
+            return {
+                "counters": {n: [[list(k), v] for k, v in s.items()] for n, s in self.counters.items()},
+                "histograms": {n: [[list(k), dict(h, counts=list(h["counts"]))] for k, h in s.items()]
+                               for n, s in self.histograms.items()},
+                "buckets": dict(self.buckets),
+            }
+
+
+def merge(dumps: List[Dict]) -> Dict:
+    """여러 워커의 dump를 합친다"""
+    counters: Dict[str, Dict[Labels, float]] = {}
+    histograms: Dict[str, Dict[Labels, Dict]] = {}
+    buckets: Dict[str, List[float]] = {}
+    for dump in dumps:
+        buckets.update(dump.get("buckets", {}))
+        for name, series in dump.get("counters", {}).items():
+            target = counters.setdefault(name, {})
+            for key, value in series:
+                key = tuple(tuple(pair) for pair in key)
+                target[key] = target.get(key, 0) + value
+        for name, series in dump.get("histograms", {}).items():
+            target = histograms.setdefault(name, {})
+            for key, hist in series:
+                key = tuple(tuple(pair) for pair in key)
+                if key not in target:
+                    target[key] = {"counts": list(hist["counts"]), "sum": hist["sum"], "count": hist["count"]}
+                else:
+                    merged = target[key]
+                    merged["counts"] = [a + b for a, b in zip(merged["counts"], hist["counts"])]
+                    merged["sum"] += hist["sum"]
+                    merged["count"] += hist["count"]
+    return {
+        "counters": {n: [[list(k), v] for k, v in s.items()] for n, s in counters.items()},
+        "histograms": {n: [[list(k), h] for k, h in s.items()] for n, s in histograms.items()},
+        "buckets": buckets,
+    }
+
+
+def quantile(hist: Dict, bucket_bounds: List[float], q: float) -> Optional[float]:
+    """히스토그램 구간 내 선형 보간으로 분위수 추정"""
+    if not hist["count"]:
+        return None
+    rank = q * hist["count"]
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(bucket_bounds + [float("inf")], hist["counts"]):
+        if seen + count >= rank and count:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound
+    return lower
+
+
+def _format_labels(key, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_prometheus(dump: Dict) -> str:
+    lines = []
+    for name, series in sorted(dump["counters"].items()):
+        kind, text = HELP.get(name, ("counter", name))
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} counter"]
+        for key, value in series:
+            lines.append(f"{name}{_format_labels(key)} {value}")
+    for name, series in sorted(dump["histograms"].items()):
+        kind, text = HELP.get(name, ("histogram", name))
+        bounds = dump["buckets"][name]
+        lines += [f"# HELP {name} {text}", f"# TYPE {name} histogram"]
+        for key, hist in series:
+            cumulative = 0
+            for bound, count in zip(bounds + ["+Inf"], hist["counts"]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {hist['sum']}")
+            lines.append(f"{name}_count{_format_labels(key)} {hist['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def summarize(dump: Dict) -> Dict:
+    """사람이 보기 위한 요약 (히스토그램별 count, 평균, p50/p95/p99)"""
+    summary = {}
+    for name, series in dump["histograms"].items():
+        bounds = dump["buckets"][name]
+        for key, hist in series:
+            label = ",".join(f"{k}={v}" for k, v in key)
+            summary[f"{name}{{{label}}}"] = {
+                "count": hist["count"],
+                "avg": hist["sum"] / hist["count"] if hist["count"] else None,
+                "p50": quantile(hist, bounds, 0.50),
+                "p95": quantile(hist, bounds, 0.95),
+                "p99": quantile(hist, bounds, 0.99),
+            }
+    for name, series in dump["counters"].items():
+        for key, value in series:
+            label = ",".join(f"{k}={v}" for k, v in key)
+            summary[f"{name}{{{label}}}"] = value
+    return summary
+
+
+# =============================================================================
+# 워커 간 집계
+# =============================================================================
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _write_json(path: str, data: Dict):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def flush():
+    """현재 워커의 메트릭을 METRICS_DIR/{pid}.json 으로 내보낸다"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_json(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), registry.dump())
+
+
+def collect() -> Dict:
+    """모든 워커(종료된 워커 포함)의 메트릭을 합친다"""
+    flush()
+    archive_path = os.path.join(METRICS_DIR, "archive.json")
+    with open(os.path.join(METRICS_DIR, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            dumps, dead = [], []
+            for file_name in os.listdir(METRICS_DIR):
+                if not file_name.endswith(".json") or file_name == "archive.json":
+                    continue
+                path = os.path.join(METRICS_DIR, file_name)
+                try:
+                    with open(path) as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                pid = file_name[:-len(".json")]
+                if pid.isdigit() and not _pid_alive(int(pid)):
+                    dead.append((path, data))
+                else:
+                    dumps.append(data)
+
+            archive = {}
+            if os.path.exists(archive_path):
+                with open(archive_path) as f:
+                    archive = json.load(f)
+            if dead:
+                # 종료된 워커는 archive에 합치고 파일 삭제
+                archive = merge([archive] + [data for _, data in dead])
+                _write_json(archive_path, archive)
+                for path, _ in dead:
+                    os.remove(path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return merge([archive] + dumps)
+
+
+# =============================================================================
+# 기록 헬퍼
+# =============================================================================
+registry = Registry()
+
+_stage: contextvars.ContextVar = contextvars.ContextVar("natna_stage", default=None)
+
+
+class _StageState:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+
+
+def current_stage() -> str:
+    state = _stage.get()
+    return state.name if state else "unknown"
+
+
+@contextmanager
+def stage(name: str):
+    """
+    생성 단계 하나를 감싼다. 안에서 일어난 업스트림 호출은 이 단계 이름으로 라벨링되고,
+    끝나면 단계 소요 시간과 업스트림 호출 횟수(재시도 포함)가 기록된다.
+    """
+    state = _StageState(name)
+    token = _stage.set(state)
+    start = time.perf_counter()
+    try:
+        yield state
+    finally:
+        try:
+            _stage.reset(token)
+        except ValueError:
+            pass  # 스트리밍 제너레이터가 다른 컨텍스트에서 정리되는 경우
+        registry.observe("natna_stage_duration_seconds", time.perf_counter() - start, LATENCY_BUCKETS, stage=name)
+        registry.observe("natna_stage_upstream_calls", state.calls, COUNT_BUCKETS, stage=name)
+        if state.calls > 1:
+            registry.inc("natna_stage_retries_total", state.calls - 1, stage=name)
+
+
+def timed_stage(name: str):
+    """async 함수 전체를 stage(name)으로 감싸는 데코레이터"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_upstream(latency: float, outcome: str, ttft: Optional[float] = None,
+                    completion_tokens: int = 0, total_tokens: int = 0, call_type: Optional[str] = None):
+    """업스트림 호출 1건 기록 (call_type을 주지 않으면 현재 stage 이름 사용)"""
+    state = _stage.get()
+    if state is not None:
+        state.calls += 1
+    call_type = call_type or current_stage()
+
+    registry.inc("natna_upstream_requests_total", call_type=call_type, outcome=outcome)
+    registry.observe("natna_upstream_latency_seconds", latency, LATENCY_BUCKETS, call_type=call_type, outcome=outcome)
+    if outcome != "success":
+        return
+    if ttft is not None:
+        registry.observe("natna_upstream_ttft_seconds", ttft, LATENCY_BUCKETS, call_type=call_type)
+    if completion_tokens:
+        registry.observe("natna_upstream_completion_tokens", completion_tokens, TOKEN_BUCKETS, call_type=call_type)
+        if latency > 0:
+            registry.observe("natna_upstream_tps", completion_tokens / latency, TPS_BUCKETS, call_type=call_type)
+    if total_tokens:
+        registry.inc("natna_upstream_tokens_total", total_tokens, call_type=call_type)
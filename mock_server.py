@@ -0,0 +1,377 @@
+# mock_server.py
+"""
+오프라인 부하 테스트용 모의 서버 (HCX-007 / CLOVA Voice / S3)
+
+실제 CLOVA 한도를 쓰지 않고 노트북에서 main.py 전체 흐름과 성능 옵션을 돌려보기 위한 서버.
+
+- POST /v3/chat-completions/HCX-007
+  요청의 responseFormat.schema(config/params.yaml)에 맞는 JSON 또는 짧은 한국어 문장을 돌려준다.
+  usage(promptTokens, completionTokens, totalTokens) 포함, Accept: text/event-stream 이면 SSE 스트리밍
+- POST /tts-premium/v1/tts : 텍스트 길이에 비례하는 무음 MP3 (MPEG1 Layer3 프레임)
+- PUT/GET/HEAD/DELETE /{bucket}/{key} : path-style S3 (멀티파트 업로드 포함, 메모리 저장)
+- GET /mock/stats : 엔드포인트별 호출/오류 수
+
+실행:
+    python mock_server.py            # 0.0.0.0:9000
+
+앱 설정 (.env):
+    HOST=http://localhost:9000
+    TTS_URL=http://localhost:9000/tts-premium/v1/tts
+    S3_ENDPOINT_URL=http://localhost:9000
+    S3_BUCKET=natna-mock
+
+지연/오류 설정은 MOCK_* 환경 변수 참고
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import urllib.parse
+from typing import Any, Dict, Optional
+from collections import Counter
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_PORT = int(os.getenv("MOCK_PORT", "9000"))
+MOCK_SEED = os.getenv("MOCK_SEED")
+
+# 지연 시간: TTFT ~ lognormal(중앙값 MOCK_TTFT_MEDIAN, MOCK_TTFT_SIGMA), 생성 시간 = completionTokens / MOCK_TPS
+MOCK_TTFT_MEDIAN = float(os.getenv("MOCK_TTFT_MEDIAN", "0.6"))
+MOCK_TTFT_SIGMA = float(os.getenv("MOCK_TTFT_SIGMA", "0.5"))
+MOCK_TPS = float(os.getenv("MOCK_TPS", "60"))
+MOCK_LATENCY_SCALE = float(os.getenv("MOCK_LATENCY_SCALE", "1.0"))   # 0이면 지연 없음
+MOCK_TTS_LATENCY = float(os.getenv("MOCK_TTS_LATENCY", "0.8"))       # TTS 기본 지연 (초), 글자 수에 비례해 증가
+
+# 오류 주입
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))           # 500 비율
+MOCK_RATE_LIMIT_RATE = float(os.getenv("MOCK_RATE_LIMIT_RATE", "0")) # 429 비율
+MOCK_TIMEOUT_RATE = float(os.getenv("MOCK_TIMEOUT_RATE", "0"))       # MOCK_TIMEOUT_SECONDS 동안 응답 없음
+MOCK_TIMEOUT_SECONDS = float(os.getenv("MOCK_TIMEOUT_SECONDS", "60"))
+MOCK_MAX_CONCURRENCY = int(os.getenv("MOCK_MAX_CONCURRENCY", "0"))   # 초과하면 429 (0이면 무제한)
+
+# 생성 내용
+MOCK_OVERLONG_RATE = float(os.getenv("MOCK_OVERLONG_RATE", "0.2"))   # 길이 제한을 넘는 응답 비율 (재시도 경로 확인용)
+MOCK_SCORE_RATE = float(os.getenv("MOCK_SCORE_RATE", "0.5"))         # score=1 비율
+MOCK_CHARS_PER_TOKEN = 1.5
+
+rng = random.Random(MOCK_SEED)
+stats: Counter = Counter()
+in_flight = 0
+
+app = FastAPI(title="natna mock upstream")
+
+
+# =============================================================================
+# 생성 내용
+# =============================================================================
+PHRASES = [
+    "그 말 들으니까 마음이 조금 놓여...", "진짜 서운했거든 😢", "너라면 알아줄 줄 알았어",
+    "나만 이상한 건 아닐까 계속 생각했어", "괜히 말했나 싶기도 하고...", "그래도 털어놓으니까 좀 낫다",
+    "친구들이 아무 말도 안 해줘서 속상했어", "단톡방에서 나만 빼고 약속을 잡았더라구",
+    "다들 바빠서 그런 거겠지?", "조금만 더 내 얘기 들어줄래?", "고마워, 진심이야 🥹",
+    "사실 아직도 좀 신경 쓰여", "이런 얘기 해도 되나 모르겠어", "내가 너무 예민한 걸까...",
+]
+SITUATIONS = [
+    "친구들 단톡방에서 나만 빼고 주말 약속을 잡은 걸 알게 됐어.",
+    "생일인데 제일 친한 친구가 연락이 없었어.",
+    "같이 준비한 발표인데 친구가 혼자 한 것처럼 말했어.",
+]
+
+
+def _sentence(min_len: int, max_len: int) -> str:
+    """min_len~max_len 글자 정도의 문장"""
+    target = rng.randint(min_len, max_len)
+    text = ""
+    while len(text) < target:
+        text = (text + " " + rng.choice(PHRASES)).strip()
+    return text
+
+
+def _short_text(limit: int = 60) -> str:
+    """길이 제한이 있는 짧은 응답 (가끔 일부러 초과)"""
+    if rng.random() < MOCK_OVERLONG_RATE:
+        return _sentence(limit + 5, limit * 2)
+    return _sentence(15, int(limit * 0.8))
+
+
+FIELD_GENERATORS = {
+    "situation": lambda: rng.choice(SITUATIONS),
+    "verification": lambda: rng.random() > 0.03,
+    "score": lambda: int(rng.random() < MOCK_SCORE_RATE),
+    "reason_score": lambda: rng.choice(["감정을 읽어주고 공감했음", "문제 해결에만 집중함", "짧고 성의 없는 답변"]),
+    "first_greeting": lambda: "안녕, 오늘 얘기 들어줘서 고마웠어!",
+    "text": lambda: _sentence(330, 420) if rng.random() < MOCK_OVERLONG_RATE else _sentence(150, 280),
+    "last_greeting": lambda: "다음에 또 얘기하자 💌",
+    "respond": _short_text,
+    "improved_sentence": _short_text,
+    "react": _short_text,
+    "next_statement": _short_text,
+}
+
+
+def _from_schema(schema: Dict[str, Any], name: str = "") -> Any:
+    """JSON schema(type/properties/items/minItems)에 맞는 값 생성"""
+    kind = schema.get("type")
+    if kind == "object":
+        return {key: _from_schema(sub, key) for key, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        count = schema.get("minItems", 3)
+        if name == "sentences":
+            return [f"{i + 1}. {_sentence(40, 100)}" for i in range(count)]
+        return [_from_schema(schema.get("items", {"type": "string"}), name) for _ in range(count)]
+    if name in FIELD_GENERATORS:
+        return FIELD_GENERATORS[name]()
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if kind == "integer":
+        return rng.randint(0, 1)
+    return _sentence(10, 60)
+
+
+def generate_content(body: Dict[str, Any]) -> str:
+    schema = (body.get("responseFormat") or {}).get("schema")
+    if schema:
+        return json.dumps(_from_schema(schema), ensure_ascii=False)
+    system = next((m["content"] for m in body.get("messages", []) if m.get("role") == "system"), "")
+    name = re.search(r"Your name is ([^.\n]+)\.", system)
+    text = _short_text()
+    if name and any(m.get("role") == "user" for m in body.get("messages", [])):
+        return f"{name.group(1).strip()}: {text}"   # 리액션은 "{챗봇 이름}: ..." 형태로 올 때가 있다
+    return text
+
+
+def usage_for(body: Dict[str, Any], content: str) -> Dict[str, int]:
+    prompt_chars = sum(len(m.get("content", "")) for m in body.get("messages", []))
+    prompt_tokens = int(prompt_chars / 2.5)
+    completion_tokens = max(1, int(len(content) / MOCK_CHARS_PER_TOKEN))
+    completion_tokens = min(completion_tokens, int(body.get("maxCompletionTokens", 4096)))
+    return {"promptTokens": prompt_tokens, "completionTokens": completion_tokens,
+            "totalTokens": prompt_tokens + completion_tokens}
+
+
+def _ttft() -> float:
+    return rng.lognormvariate(0, MOCK_TTFT_SIGMA) * MOCK_TTFT_MEDIAN * MOCK_LATENCY_SCALE
+
+
+def _error(status_code: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"status": {"code": code, "message": message}})
+
+
+async def _inject_failure(endpoint: str) -> Optional[Response]:
+    """설정한 비율로 429/500/무응답을 흉내낸다"""
+    if MOCK_MAX_CONCURRENCY and in_flight > MOCK_MAX_CONCURRENCY:
+        stats[f"{endpoint}.429"] += 1
+        return _error(429, "42901", "Too many requests - concurrency exceeded")
+    roll = rng.random()
+    if roll < MOCK_RATE_LIMIT_RATE:
+        stats[f"{endpoint}.429"] += 1
+        return _error(429, "42901", "Too many requests - rate exceeded")
+    roll -= MOCK_RATE_LIMIT_RATE
+    if roll < MOCK_ERROR_RATE:
+        stats[f"{endpoint}.500"] += 1
+        return _error(500, "50000", "Internal server error")
+    roll -= MOCK_ERROR_RATE
+    if roll < MOCK_TIMEOUT_RATE:
+        stats[f"{endpoint}.timeout"] += 1
+        await asyncio.sleep(MOCK_TIMEOUT_SECONDS)
+        return _error(504, "50400", "Gateway timeout")
+    return None
+
+
+# =============================================================================
+# HCX-007
+# =============================================================================
+@app.post("/v3/chat-completions/HCX-007")
+async def chat_completions(request: Request):
+    global in_flight
+    body = await request.json()
+    stats["chat.requests"] += 1
+    in_flight += 1
+    streaming = False
+    try:
+        failure = await _inject_failure("chat")
+        if failure is not None:
+            return failure
+
+        content = generate_content(body)
+        usage = usage_for(body, content)
+        message = {"role": "assistant", "content": content}
+        if "text/event-stream" in request.headers.get("accept", ""):
+            stats["chat.stream"] += 1
+            streaming = True   # 스트림이 끝날 때 in_flight 감소
+            return StreamingResponse(_stream(content, usage), media_type="text/event-stream")
+
+        await asyncio.sleep(_ttft() + usage["completionTokens"] / MOCK_TPS * MOCK_LATENCY_SCALE)
+        return {
+            "status": {"code": "20000", "message": "OK"},
+            "result": {"message": message, "finishReason": "stop", "created": int(time.time() * 1000),
+                       "seed": body.get("seed", 0), "usage": usage},
+        }
+    finally:
+        if not streaming:
+            in_flight -= 1
+
+
+def _sse(event: str, data: Dict[str, Any], event_id: str) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _stream(content: str, usage: Dict[str, int]):
+    """토큰 1~3 글자씩 MOCK_TPS 속도로 보내고 마지막에 result 이벤트"""
+    global in_flight
+    event_id = str(uuid.uuid4())
+    created = int(time.time() * 1000)
+    try:
+        await asyncio.sleep(_ttft())
+        pos = 0
+        while pos < len(content):
+            size = rng.randint(1, 3)
+            token = content[pos:pos + size]
+            pos += size
+            yield _sse("token", {"message": {"role": "assistant", "content": token}, "finishReason": None,
+                                 "created": created, "seed": 0, "usage": None}, event_id)
+            await asyncio.sleep(MOCK_LATENCY_SCALE / MOCK_TPS)
+        yield _sse("result", {"message": {"role": "assistant", "content": content}, "finishReason": "stop",
+                              "created": created, "seed": 0, "usage": usage}, event_id)
+    finally:
+        in_flight -= 1
+
+
+# =============================================================================
+# CLOVA Voice
+# =============================================================================
+# MPEG1 Layer3 128kbps 44.1kHz 무음 프레임 (417 바이트, 약 26ms)
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0x64]) + bytes(413)
+MP3_FRAME_SECONDS = 1152 / 44100
+
+
+def silent_mp3(seconds: float) -> bytes:
+    return MP3_FRAME * max(1, int(seconds / MP3_FRAME_SECONDS))
+
+
+@app.post("/tts-premium/v1/tts")
+async def tts(request: Request):
+    # application/x-www-form-urlencoded (python-multipart 없이 파싱)
+    form = urllib.parse.parse_qs((await request.body()).decode("utf-8"))
+    text = form.get("text", [""])[0]
+    stats["tts.requests"] += 1
+    failure = await _inject_failure("tts")
+    if failure is not None:
+        return failure
+    if not text:
+        return _error(400, "VE002", "Invalid text")
+    # 실제 CLOVA Voice처럼 글자 수에 비례해 느려진다 (1글자 약 0.15초 분량 음성)
+    await asyncio.sleep((MOCK_TTS_LATENCY + len(text) * 0.004) * MOCK_LATENCY_SCALE)
+    return Response(content=silent_mp3(len(text) * 0.15), media_type="audio/mpeg")
+
+
+# =============================================================================
+# 상태 (S3 catch-all 경로보다 먼저 등록)
+# =============================================================================
+@app.get("/mock/stats")
+async def mock_stats():
+    return {"in_flight": in_flight, "objects": len(objects), **stats}
+
+
+@app.post("/mock/reset")
+async def mock_reset():
+    stats.clear()
+    objects.clear()
+    uploads.clear()
+    return {"status": "reset"}
+
+
+# =============================================================================
+# S3 (path-style, 메모리 저장)
+# =============================================================================
+objects: Dict[str, Dict[str, Any]] = {}
+uploads: Dict[str, Dict[int, bytes]] = {}
+
+
+def _etag(data: bytes) -> str:
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+def _xml(tag: str, fields: Dict[str, str]) -> Response:
+    inner = "".join(f"<{k}>{v}</{k}>" for k, v in fields.items())
+    return Response(
+        content=f'<?xml version="1.0" encoding="UTF-8"?><{tag} xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{inner}</{tag}>',
+        media_type="application/xml",
+    )
+
+
+def _no_such_key(key: str) -> Response:
+    return Response(
+        status_code=404, media_type="application/xml",
+        content=f"<Error><Code>NoSuchKey</Code><Message>The specified key does not exist.</Message><Key>{key}</Key></Error>",
+    )
+
+
+@app.put("/{bucket}/{key:path}")
+async def s3_put(bucket: str, key: str, request: Request):
+    data = await request.body()
+    params = request.query_params
+    if "uploadId" in params:
+        # UploadPart
+        stats["s3.upload_part"] += 1
+        uploads.setdefault(params["uploadId"], {})[int(params["partNumber"])] = data
+        return Response(headers={"ETag": _etag(data)})
+    stats["s3.put"] += 1
+    objects[f"{bucket}/{key}"] = {"body": data, "content_type": request.headers.get("content-type", "binary/octet-stream")}
+    return Response(headers={"ETag": _etag(data)})
+
+
+@app.post("/{bucket}/{key:path}")
+async def s3_post(bucket: str, key: str, request: Request):
+    params = request.query_params
+    if "uploads" in params:
+        # CreateMultipartUpload
+        upload_id = uuid.uuid4().hex
+        uploads[upload_id] = {}
+        stats["s3.multipart"] += 1
+        return _xml("InitiateMultipartUploadResult", {"Bucket": bucket, "Key": key, "UploadId": upload_id})
+    if "uploadId" in params:
+        # CompleteMultipartUpload
+        parts = uploads.pop(params["uploadId"], {})
+        data = b"".join(parts[n] for n in sorted(parts))
+        objects[f"{bucket}/{key}"] = {"body": data, "content_type": "audio/mpeg"}
+        return _xml("CompleteMultipartUploadResult", {"Bucket": bucket, "Key": key, "ETag": _etag(data)})
+    return _error(400, "InvalidRequest", "unsupported S3 operation")
+
+
+@app.get("/{bucket}/{key:path}")
+async def s3_get(bucket: str, key: str):
+    obj = objects.get(f"{bucket}/{key}")
+    stats["s3.get"] += 1
+    if obj is None:
+        return _no_such_key(key)
+    return Response(content=obj["body"], media_type=obj["content_type"], headers={"ETag": _etag(obj["body"])})
+
+
+@app.head("/{bucket}/{key:path}")
+async def s3_head(bucket: str, key: str):
+    obj = objects.get(f"{bucket}/{key}")
+    if obj is None:
+        return Response(status_code=404)
+    return Response(headers={"Content-Length": str(len(obj["body"])), "Content-Type": obj["content_type"],
+                             "ETag": _etag(obj["body"])})
+
+
+@app.delete("/{bucket}/{key:path}")
+async def s3_delete(bucket: str, key: str, request: Request):
+    if "uploadId" in request.query_params:
+        uploads.pop(request.query_params["uploadId"], None)   # AbortMultipartUpload
+    else:
+        objects.pop(f"{bucket}/{key}", None)
+    return Response(status_code=204)
+
+
+if __name__ == "__main__":
+    # 상태(stats, S3 객체)를 메모리에 두므로 워커는 1개
+    uvicorn.run(app, host="0.0.0.0", port=MOCK_PORT, log_level="warning")
@@ -0,0 +1,122 @@
+# mp3_frames.py
+"""
+MP3 프레임 단위 이어 붙이기 (문장별로 나눠 합성한 TTS 음성을 한 파일로)
+
+- 조각마다 앞의 ID3v2 태그, 끝의 ID3v1 태그(TAG), 첫 프레임의 Xing/Info/VBRI 헤더 프레임을 빼고
+  오디오 프레임만 이어 붙인다 (첫 조각의 Xing 헤더가 남으면 플레이어가 전체 재생 시간을 첫 조각 길이로 계산한다)
+- 프레임 헤더가 깨진 구간은 다음 동기 패턴까지 건너뛴다
+- 모든 조각의 MPEG 버전/레이어/샘플레이트/채널 수가 같아야 한다 (다르면 None → 호출 측이 한 번에 합성)
+"""
+from typing import List, NamedTuple, Optional, Tuple
+
+# 비트레이트 (kbps): (MPEG1 여부, 레이어) -> 인덱스별 값
+_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+_LAYERS = {3: 1, 2: 2, 1: 3}
+
+
+class Format(NamedTuple):
+    version: int        # 헤더의 버전 비트 (3: MPEG1, 2: MPEG2, 0: MPEG2.5)
+    layer: int
+    sample_rate: int
+    channels: int
+
+
+def _frame(data: bytes, pos: int) -> Optional[Tuple[Format, int]]:
+    """pos 위치의 프레임 헤더 → (형식, 프레임 길이), 헤더가 아니면 None"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+    version = (b1 >> 3) & 3
+    layer = _LAYERS.get((b1 >> 1) & 3)
+    bitrate_index = b2 >> 4
+    rate_index = (b2 >> 2) & 3
+    if version == 1 or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None  # 예약 값 / free format 은 다루지 않는다
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and not mpeg1:
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        length = 144 * bitrate // sample_rate + padding
+    channels = 1 if b3 >> 6 == 3 else 2
+    return Format(version, layer, sample_rate, channels), length
+
+
+def _skip_id3v2(data: bytes) -> int:
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        return 10 + size + (10 if data[5] & 0x10 else 0)
+    return 0
+
+
+def _is_info_frame(frame: bytes) -> bool:
+    """LAME/Xing(VBR 정보) 또는 VBRI 헤더만 담은 첫 프레임"""
+    head = frame[:64]
+    return b"Xing" in head or b"Info" in head or b"VBRI" in head
+
+
+def frames(data: bytes) -> Tuple[Optional[Format], List[bytes]]:
+    """태그와 VBR 정보 프레임을 뺀 오디오 프레임 목록"""
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    pos = _skip_id3v2(data)
+    fmt, result = None, []
+    while pos + 4 <= end:
+        header = _frame(data, pos)
+        if header is None or pos + header[1] > end:
+            pos += 1   # 다음 동기 패턴 찾기
+            continue
+        frame_fmt, length = header
+        frame = data[pos:pos + length]
+        if fmt is None:
+            fmt = frame_fmt
+            if _is_info_frame(frame):
+                pos += length
+                continue
+        if frame_fmt == fmt:
+            result.append(frame)
+        pos += length
+    return fmt, result
+
+
+def duration(data: bytes) -> float:
+    """재생 시간 (초)"""
+    fmt, audio = frames(data)
+    if fmt is None:
+        return 0.0
+    samples = 384 if fmt.layer == 1 else 1152 if fmt.layer == 2 or fmt.version == 3 else 576
+    return len(audio) * samples / fmt.sample_rate
+
+
+def join(chunks: List[bytes]) -> Optional[bytes]:
+    """
+    MP3 조각들을 프레임 경계에서 이어 붙인다
+
+    Returns:
+        하나로 이은 MP3, 형식이 서로 다르거나 오디오 프레임이 없는 조각이 있으면 None
+    """
+    fmt, joined = None, []
+    for chunk in chunks:
+        chunk_fmt, audio = frames(chunk)
+        if chunk_fmt is None or not audio:
+            return None
+        if fmt is None:
+            fmt = chunk_fmt
+        elif chunk_fmt != fmt:
+            print(f"MP3 join: format mismatch {chunk_fmt} != {fmt}")
+            return None
+        joined.extend(audio)
+    return b"".join(joined) if joined else None
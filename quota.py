@@ -0,0 +1,171 @@
+# quota.py
+"""
+CLOVA Studio 계정 한도(QPS, TPM)를 워커들이 함께 쓰는 클라이언트 측 토큰 버킷
+
+uvicorn 워커(프로세스)마다 따로 호출하면 한도를 나눠 보지 못해서 동시에 업스트림 한도에 걸린다.
+같은 호스트의 워커들은 공유 메모리 파일(/dev/shm) 하나에 버킷 상태를 두고 fcntl 락으로 갱신한다.
+
+- 요청 버킷: 초당 CLOVA_QPS 개 충전
+- 토큰 버킷: 분당 CLOVA_TPM 개 충전. 호출 전 (프롬프트 추정치 + maxCompletionTokens) 를 예약하고,
+  응답의 usage.totalTokens 로 정산해서 남는 만큼 돌려준다.
+
+로컬 예산이 부족하면 QUOTA_MAX_WAIT 초까지 기다리거나(QUOTA_MODE=wait) 바로 실패한다(QUOTA_MODE=fail).
+"""
+import os
+import mmap
+import time
+import fcntl
+import struct
+import asyncio
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from resilience import UpstreamUnavailable
+
+CLOVA_QPS = float(os.getenv("CLOVA_QPS", "0"))        # 0이면 요청 수 제한 안 함
+CLOVA_TPM = float(os.getenv("CLOVA_TPM", "0"))        # 0이면 토큰 수 제한 안 함
+QUOTA_BURST = float(os.getenv("QUOTA_BURST", "1"))    # 요청 버킷 크기 = CLOVA_QPS * QUOTA_BURST
+QUOTA_MODE = os.getenv("QUOTA_MODE", "wait")          # wait | fail
+QUOTA_MAX_WAIT = float(os.getenv("QUOTA_MAX_WAIT", "5"))
+QUOTA_CHARS_PER_TOKEN = float(os.getenv("QUOTA_CHARS_PER_TOKEN", "2.5"))  # 프롬프트 토큰 추정용
+QUOTA_SHM_PATH = os.getenv(
+    "QUOTA_SHM_PATH",
+    os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "natna_clova_quota")
+)
+
+# 요청 버킷 잔량, 갱신 시각, 토큰 버킷 잔량, 갱신 시각
+_STATE = struct.Struct("dddd")
+
+
+class QuotaExceeded(UpstreamUnavailable):
+    """로컬 QPS/TPM 예산 부족"""
+
+
+class SharedTokenBuckets:
+    """공유 메모리 파일 위의 요청/토큰 버킷 두 개"""
+
+    def __init__(self, path: str, qps: float, tpm: float, burst: float = QUOTA_BURST):
+        self.qps = qps
+        self.tpm = tpm
+        self.req_capacity = max(1.0, qps * burst)
+        self.tok_capacity = tpm
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self._locked(init=True):
+            pass
+        self.mm = mmap.mmap(self.fd, _STATE.size)
+
+    @contextmanager
+    def _locked(self, init: bool = False):
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if init and os.fstat(self.fd).st_size < _STATE.size:
+                # 처음 만든 워커가 가득 찬 버킷으로 초기화
+                now = time.time()
+                os.pwrite(self.fd, _STATE.pack(self.req_capacity, now, self.tok_capacity, now), 0)
+            yield
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _refill(self, now: float):
+        req, req_ts, tok, tok_ts = _STATE.unpack_from(self.mm, 0)
+        req = min(self.req_capacity, req + (now - req_ts) * self.qps)
+        tok = min(self.tok_capacity, tok + (now - tok_ts) * self.tpm / 60)
+        return req, tok
+
+    def try_take(self, requests: float, tokens: float) -> float:
+        """
+        예산이 있으면 차감하고 0 반환, 없으면 차감 없이 기다려야 할 시간(초) 반환
+        """
+        tokens = min(tokens, self.tok_capacity) if self.tpm else 0
+        requests = requests if self.qps else 0
+        with self._locked():
+            now = time.time()
+            req, tok = self._refill(now)
+            if req >= requests and tok >= tokens:
+                req -= requests
+                tok -= tokens
+                wait = 0.0
+            else:
+                wait = max(
+                    (requests - req) / self.qps if req < requests else 0.0,
+                    (tokens - tok) / (self.tpm / 60) if tok < tokens else 0.0,
+                )
+            _STATE.pack_into(self.mm, 0, req, now, tok, now)
+        return wait
+
+    def give_back(self, tokens: float):
+        """예약보다 적게 쓴 토큰 반환 (음수면 추가 차감)"""
+        if not self.tpm or not tokens:
+            return
+        with self._locked():
+            now = time.time()
+            req, tok = self._refill(now)
+            tok = min(self.tok_capacity, tok + tokens)
+            _STATE.pack_into(self.mm, 0, req, now, tok, now)
+
+    def levels(self) -> Dict[str, float]:
+        with self._locked():
+            req, tok = self._refill(time.time())
+        return {"requests": round(req, 2), "tokens": round(tok, 1)}
+
+
+class QuotaManager:
+    def __init__(self, qps: float = CLOVA_QPS, tpm: float = CLOVA_TPM):
+        self.enabled = qps > 0 or tpm > 0
+        self.buckets: Optional[SharedTokenBuckets] = None
+        self.qps = qps
+        self.tpm = tpm
+        self.stats = {"acquired": 0, "waited": 0, "rejected": 0}
+
+    def _buckets(self) -> SharedTokenBuckets:
+        if self.buckets is None:
+            self.buckets = SharedTokenBuckets(QUOTA_SHM_PATH, self.qps, self.tpm)
+        return self.buckets
+
+    @staticmethod
+    def estimate_tokens(completion_request: Dict) -> int:
+        """프롬프트 글자 수 기반 추정치 + 최대 생성 토큰"""
+        prompt_chars = sum(len(m.get("content", "")) for m in completion_request.get("messages", []))
+        return int(prompt_chars / QUOTA_CHARS_PER_TOKEN) + int(completion_request.get("maxCompletionTokens", 512))
+
+    async def acquire(self, completion_request: Dict) -> int:
+        """
+        요청 1건 + 추정 토큰을 예약하고 예약한 토큰 수를 반환한다.
+        예산이 모자라면 QUOTA_MODE에 따라 기다리거나 QuotaExceeded.
+        """
+        if not self.enabled:
+            return 0
+        reserved = self.estimate_tokens(completion_request)
+        deadline = time.time() + QUOTA_MAX_WAIT
+        waited = False
+        while True:
+            wait = self._buckets().try_take(1, reserved)
+            if wait == 0:
+                self.stats["acquired"] += 1
+                if waited:
+                    self.stats["waited"] += 1
+                return reserved
+            if QUOTA_MODE == "fail" or time.time() + wait > deadline:
+                self.stats["rejected"] += 1
+                raise QuotaExceeded(f"local CLOVA quota exhausted (retry in {wait:.2f}s)")
+            waited = True
+            await asyncio.sleep(wait)
+
+    def settle(self, reserved: int, total_tokens: Optional[int]):
+        """
+        실제 사용량으로 정산. total_tokens가 None이면(사용량을 모름) 예약분을 그대로 둔다.
+        """
+        if not self.enabled or not reserved or total_tokens is None:
+            return
+        self._buckets().give_back(reserved - total_tokens)
+
+    def snapshot(self) -> Dict:
+        if not self.enabled:
+            return {"enabled": False}
+        return {"enabled": True, "qps": self.qps, "tpm": self.tpm, **self._buckets().levels(), **self.stats}
+
+
+# 프로세스 공용 인스턴스 (버킷 상태는 호스트의 모든 워커가 공유)
+quota = QuotaManager()
@@ -0,0 +1,201 @@
+# resilience.py
+"""
+업스트림(CLOVA Studio, CLOVA Voice) 보호 장치
+
+- AdaptiveLimiter: AIMD 방식의 동시 요청 수 제한
+  성공하면 한도를 조금씩 늘리고(additive increase), 429/5xx/타임아웃이면 절반으로 줄인다(multiplicative decrease).
+- CircuitBreaker: 연속 과부하 실패 시 일정 시간 요청을 차단하고, 이후 소수의 probe 요청으로 복구 여부 확인 (half-open)
+
+chat.py / hcx_client.py의 모든 호출이 엔드포인트별 UpstreamGuard 하나를 공유한다.
+"""
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+
+UPSTREAM_INITIAL_LIMIT = float(os.getenv("UPSTREAM_INITIAL_LIMIT", "20"))
+UPSTREAM_MIN_LIMIT = float(os.getenv("UPSTREAM_MIN_LIMIT", "1"))
+UPSTREAM_MAX_LIMIT = float(os.getenv("UPSTREAM_MAX_LIMIT", "100"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "10"))     # 슬롯 대기 최대 시간 (초)
+UPSTREAM_DECREASE_COOLDOWN = float(os.getenv("UPSTREAM_DECREASE_COOLDOWN", "1"))  # 연속 감소 방지 간격 (초)
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "10"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))
+
+
+class UpstreamUnavailable(Exception):
+    """회로 차단 중이거나 동시 요청 슬롯을 얻지 못한 경우"""
+
+
+def is_overload_status(status_code: int) -> bool:
+    """업스트림 과부하로 볼 응답 코드 (429, 5xx)"""
+    return status_code == 429 or status_code >= 500
+
+
+class AdaptiveLimiter:
+    """AIMD 동시 요청 제한"""
+
+    def __init__(self, initial: float = UPSTREAM_INITIAL_LIMIT, min_limit: float = UPSTREAM_MIN_LIMIT,
+                 max_limit: float = UPSTREAM_MAX_LIMIT, backoff: float = 0.5):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self._condition = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, timeout: float = UPSTREAM_QUEUE_TIMEOUT) -> bool:
+        async with self.condition:
+            try:
+                await asyncio.wait_for(
+                    self.condition.wait_for(lambda: self.in_flight < int(self.limit)),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                return False
+            self.in_flight += 1
+            return True
+
+    async def release(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        # 한도를 실제로 쓰고 있을 때만 늘린다 (한가할 때 한도가 부풀지 않도록)
+        if self.in_flight >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        now = time.time()
+        if now - self.last_decrease < UPSTREAM_DECREASE_COOLDOWN:
+            return
+        self.last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+
+
+class CircuitBreaker:
+    """closed -> (연속 실패) -> open -> (reset_timeout) -> half_open -> (probe 성공) -> closed"""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT, half_open_calls: int = BREAKER_HALF_OPEN_CALLS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.time() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self.probes = 0
+        if self.state == "half_open":
+            if self.probes >= self.half_open_calls:
+                return False
+            self.probes += 1
+        return True
+
+    def on_success(self):
+        self.failures = 0
+        if self.state != "closed":
+            print("✅ Circuit closed")
+        self.state = "closed"
+
+    def on_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                print(f"🚫 Circuit open ({self.failures} consecutive failures)")
+            self.state = "open"
+            self.opened_at = time.time()
+
+    def on_release(self):
+        """half-open probe가 성공/실패 판정 없이 끝난 경우 슬롯 반환"""
+        if self.state == "half_open" and self.probes > 0:
+            self.probes -= 1
+
+
+class UpstreamGuard:
+    """엔드포인트 하나에 대한 limiter + breaker"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.limiter = AdaptiveLimiter()
+        self.breaker = CircuitBreaker()
+        self.stats = {"success": 0, "overload": 0, "rejected": 0}
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        동시 요청 슬롯 하나를 잡는다. 차단 중이거나 대기 시간 초과면 UpstreamUnavailable.
+        블록 안에서 success()/overload() 중 하나로 결과를 알려준다.
+        """
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise UpstreamUnavailable(f"{self.name}: circuit open")
+        if not await self.limiter.acquire():
+            self.breaker.on_release()
+            self.stats["rejected"] += 1
+            raise UpstreamUnavailable(f"{self.name}: concurrency limit ({int(self.limiter.limit)}) wait timeout")
+        if self.breaker.state == "open":
+            # 슬롯을 기다리는 사이 회로가 열렸으면 보내지 않는다
+            await self.limiter.release()
+            self.stats["rejected"] += 1
+            raise UpstreamUnavailable(f"{self.name}: circuit open")
+        try:
+            yield self
+        finally:
+            self.breaker.on_release()
+            await self.limiter.release()
+
+    def success(self):
+        self.stats["success"] += 1
+        self.limiter.on_success()
+        self.breaker.on_success()
+
+    def overload(self):
+        self.stats["overload"] += 1
+        self.limiter.on_overload()
+        self.breaker.on_failure()
+
+    def utilization(self) -> float:
+        """동시 요청 한도 사용률 (회로가 닫혀 있지 않으면 1.0)"""
+        if self.breaker.state != "closed":
+            return 1.0
+        return self.limiter.in_flight / max(1, int(self.limiter.limit))
+
+    def snapshot(self) -> Dict:
+        return {
+            "limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            **self.stats,
+        }
+
+
+_guards: Dict[str, UpstreamGuard] = {}
+
+
+def upstream(name: str) -> UpstreamGuard:
+    """엔드포인트별 공용 UpstreamGuard ("chat", "tts")"""
+    if name not in _guards:
+        _guards[name] = UpstreamGuard(name)
+    return _guards[name]
+
+
+def upstream_snapshot() -> Dict[str, Dict]:
+    return {name: guard.snapshot() for name, guard in _guards.items()}
@@ -0,0 +1,229 @@
+# retry_policy.py
+"""
+생성 단계 공용 재시도 정책
+
+chat.py의 생성 함수들이 제각각 돌리던 재시도 루프(상황 생성 60회, attempt_limit, 엔드포인트 재시도)를
+한 곳에서 관리한다.
+
+- 단계별 최대 시도 횟수 (RETRY_MAX_ATTEMPTS, 예: "situation:5,react:5")
+- 업스트림 실패 후 재시도는 지수 백오프 + full jitter 로 기다린다
+  (길이 초과처럼 응답은 왔지만 다시 생성해야 하는 경우는 기다리지 않는다)
+- 요청 마감 시각: 엔드포인트에서 deadline()으로 정하면 남은 시간이 RETRY_MIN_ATTEMPT_TIME 보다 적을 때
+  재시도하지 않고, 업스트림 호출 타임아웃도 남은 시간으로 줄인다 (nginx proxy_read_timeout 60s 보다 먼저 끝내기)
+- 재시도 예산: 업스트림 실패 재시도는 워커 전체 첫 시도의 RETRY_BUDGET_RATIO 배 (+ 초당 RETRY_BUDGET_MIN_PER_SEC)
+  까지만 허용해서 장애 시 재시도 폭주를 막는다
+"""
+import os
+import time
+import random
+import asyncio
+import inspect
+import functools
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import metrics
+
+RETRY_REQUEST_DEADLINE = float(os.getenv("RETRY_REQUEST_DEADLINE", "55"))    # 초, nginx 60s 보다 짧게
+RETRY_DEFAULT_ATTEMPTS = int(os.getenv("RETRY_DEFAULT_ATTEMPTS", "5"))
+RETRY_MAX_ATTEMPTS = os.getenv(
+    "RETRY_MAX_ATTEMPTS",
+    "situation:5,verification:2,react:5,improve:5,react_improve:2,feedback:5"
+)
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.2"))            # 초
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "2"))                # 초
+RETRY_MIN_ATTEMPT_TIME = float(os.getenv("RETRY_MIN_ATTEMPT_TIME", "2"))      # 재시도에 필요한 최소 남은 시간 (초)
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SEC = float(os.getenv("RETRY_BUDGET_MIN_PER_SEC", "1"))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", "20"))
+
+
+def _parse_attempts(spec: str) -> Dict[str, int]:
+    caps = {}
+    for item in spec.split(","):
+        if ":" in item:
+            stage, count = item.split(":", 1)
+            caps[stage.strip()] = max(1, int(count))
+    return caps
+
+
+STAGE_ATTEMPTS = _parse_attempts(RETRY_MAX_ATTEMPTS)
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("natna_request_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: float = RETRY_REQUEST_DEADLINE):
+    """이 블록(과 안에서 만든 태스크)의 마감 시각을 지금부터 seconds 초 뒤로 정한다 (바깥 마감이 더 이르면 유지)"""
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(at if outer is None else min(at, outer))
+    try:
+        yield
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            pass  # 스트리밍 제너레이터가 다른 컨텍스트에서 정리되는 경우
+
+
+def with_deadline(seconds: float = RETRY_REQUEST_DEADLINE):
+    """async 함수(또는 async 제너레이터) 전체를 deadline(seconds)으로 감싸는 데코레이터 (엔드포인트용)"""
+    def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def generator_wrapper(*args, **kwargs):
+                with deadline(seconds):
+                    async for item in func(*args, **kwargs):
+                        yield item
+            return generator_wrapper
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with deadline(seconds):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def remaining() -> Optional[float]:
+    """마감까지 남은 시간 (초), 마감이 없으면 None"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def call_timeout(default: float) -> float:
+    """업스트림 호출 1건에 쓸 타임아웃 (남은 시간과 default 중 작은 값)"""
+    left = remaining()
+    return default if left is None else max(0.0, min(default, left))
+
+
+class RetryBudget:
+    """첫 시도마다 ratio 만큼 쌓이고 (시간당 최소 충전 포함) 실패 재시도마다 1씩 쓰는 예산"""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_sec: float = RETRY_BUDGET_MIN_PER_SEC,
+                 max_balance: float = RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.min_per_sec = min_per_sec
+        self.max_balance = max_balance
+        self.balance = max_balance
+        self.updated = time.monotonic()
+        self.stats = {"deposits": 0, "withdrawn": 0, "rejected": 0}
+
+    def _refill(self):
+        now = time.monotonic()
+        self.balance = min(self.max_balance, self.balance + (now - self.updated) * self.min_per_sec)
+        self.updated = now
+
+    def deposit(self):
+        self._refill()
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+        self.stats["deposits"] += 1
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.balance < 1:
+            self.stats["rejected"] += 1
+            return False
+        self.balance -= 1
+        self.stats["withdrawn"] += 1
+        return True
+
+
+class Attempts:
+    """
+    시도 번호(0부터)를 돌려주는 반복자 (for / async for 모두 지원)
+
+    루프 안에서 업스트림 호출이 실패했으면 fail()을 부르고 넘어간다 → 백오프 후 재시도, 재시도 예산 사용.
+    fail() 없이 넘어가면 (길이 초과 등) 바로 재시도한다.
+    더 시도할 수 없으면 루프가 끝나고 stopped에 이유(attempts, deadline, budget)가 남는다.
+    """
+
+    def __init__(self, budget: RetryBudget, stage: str, max_attempts: int):
+        self.budget = budget
+        self.stage = stage
+        self.max_attempts = max_attempts
+        self.number = -1
+        self.failed = False
+        self.stopped: Optional[str] = None
+
+    def fail(self):
+        self.failed = True
+
+    def is_last(self) -> bool:
+        """지금 시도가 마지막인지 (횟수 또는 남은 시간 기준)"""
+        if self.number + 1 >= self.max_attempts:
+            return True
+        left = remaining()
+        return left is not None and left < RETRY_MIN_ATTEMPT_TIME
+
+    def _delay(self) -> Optional[float]:
+        """다음 시도 전 대기 시간, 더 시도하면 안 되면 None"""
+        reason = None
+        delay = 0.0
+        if self.failed:
+            delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** self.number))
+        left = remaining()
+        if self.number + 1 >= self.max_attempts:
+            reason = "attempts"
+        elif left is not None and left - delay < RETRY_MIN_ATTEMPT_TIME:
+            reason = "deadline"
+        elif self.failed and not self.budget.withdraw():
+            reason = "budget"
+        if reason:
+            self.stopped = reason
+            metrics.registry.inc("natna_retry_stopped_total", stage=self.stage, reason=reason)
+            print(f"⚠️ 재시도 중단 ({self.stage}): {reason}")
+            return None
+        return delay
+
+    def _advance(self) -> int:
+        self.number += 1
+        self.failed = False
+        return self.number
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> int:
+        if self.number < 0:
+            self.budget.deposit()
+        else:
+            delay = self._delay()
+            if delay is None:
+                raise StopIteration
+            time.sleep(delay)
+        return self._advance()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> int:
+        if self.number < 0:
+            self.budget.deposit()
+        else:
+            delay = self._delay()
+            if delay is None:
+                raise StopAsyncIteration
+            await asyncio.sleep(delay)
+        return self._advance()
+
+
+class RetryPolicy:
+    def __init__(self, budget: Optional[RetryBudget] = None):
+        self.budget = budget or RetryBudget()
+
+    def attempts(self, stage: Optional[str] = None, max_attempts: Optional[int] = None) -> Attempts:
+        """stage를 주지 않으면 현재 metrics stage 이름 사용"""
+        stage = stage or metrics.current_stage()
+        if max_attempts is None:
+            max_attempts = STAGE_ATTEMPTS.get(stage, RETRY_DEFAULT_ATTEMPTS)
+        return Attempts(self.budget, stage, max_attempts)
+
+    def snapshot(self) -> Dict:
+        return {"budget": round(self.budget.balance, 2), "attempts": STAGE_ATTEMPTS, **self.budget.stats}
+
+
+# 프로세스 공용 인스턴스
+retry_policy = RetryPolicy()
@@ -1,6 +1,28 @@
 # s3_utils.py
+"""
+편지 음성 S3 업로드
+
+- 업로드는 전용 스레드 풀(S3_UPLOAD_WORKERS)에서 실행한다 → async 핸들러에서 upload_audio_async 로 부르면
+  업로드 동안 이벤트 루프(같은 워커의 다른 요청)가 멈추지 않는다
+- 클라이언트 하나를 공유하고 연결 풀 크기를 업로드 동시성에 맞춘다 (요청마다 연결을 새로 맺지 않음)
+- 실패하면 S3_UPLOAD_ATTEMPTS 번까지 지수 백오프 + jitter 후 재시도 (botocore 표준 재시도와 별개로 연결 오류까지 포함)
+- S3_MULTIPART_THRESHOLD_MB 보다 큰 객체는 멀티파트 업로드
+- presigned URL 은 비공개 버킷(S3_PUBLIC=false)일 때만, URL 이 필요할 때(audio_url) 만들고 만료 전까지 재사용한다
+"""
 import base64, boto3, os
-from botocore.exceptions import ClientError
+import io
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+import metrics
 
 AWS_REGION=os.environ.get("AWS_REGION")
 AWS_ACCESS_KEY_ID=os.environ.get("AWS_ACCESS_KEY_ID")
@@ -8,32 +30,85 @@ AWS_SECRET_ACCESS_KEY=os.environ.get("AWS_SECRET_ACCESS_KEY")
 S3_URL = os.environ.get("S3_URL")
 S3_BUCKET = os.environ.get("S3_BUCKET")
 S3_PUBLIC = os.getenv("S3_PUBLIC", "true").lower() == "true"
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")  # 모의 서버 등 S3 호환 엔드포인트 (path-style)
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "4"))
+S3_UPLOAD_ATTEMPTS = int(os.getenv("S3_UPLOAD_ATTEMPTS", "3"))
+S3_UPLOAD_BACKOFF = float(os.getenv("S3_UPLOAD_BACKOFF", "0.3"))                 # 초, 첫 재시도 대기 상한
+S3_MULTIPART_THRESHOLD_MB = float(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8"))
+S3_PRESIGN_EXPIRES = int(os.getenv("S3_PRESIGN_EXPIRES", "3600"))               # 초
+
+_MB = 1024 * 1024
+_PART_CONCURRENCY = 4
 
 s3 = boto3.client(
     "s3",
     aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
     aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
     region_name=os.getenv("AWS_DEFAULT_REGION", "ap-northeast-2"),
+    endpoint_url=S3_ENDPOINT_URL,
+    config=Config(
+        s3={"addressing_style": "path"} if S3_ENDPOINT_URL else None,
+        max_pool_connections=S3_UPLOAD_WORKERS * _PART_CONCURRENCY,
+        retries={"mode": "standard", "max_attempts": 2},
+    ),
+)
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(S3_MULTIPART_THRESHOLD_MB * _MB),
+    multipart_chunksize=max(5 * _MB, int(S3_MULTIPART_THRESHOLD_MB * _MB)),   # S3 최소 파트 크기 5MB
+    max_concurrency=_PART_CONCURRENCY,
 )
 
+_upload_pool = ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+_presigned: Dict[str, Tuple[str, float]] = {}
+_presigned_lock = threading.Lock()
+
+
+def public_url(key: str) -> str:
+    """정적 URL 형식 (버킷이 퍼블릭 읽기이면 바로 접근 가능)"""
+    if S3_ENDPOINT_URL:
+        return f"{S3_ENDPOINT_URL.rstrip('/')}/{S3_BUCKET}/{key}"
+    return f"https://{S3_BUCKET}.s3.ap-northeast-2.amazonaws.com/{key}"
+
+
 def upload_audio_base64(base64_str: str, key: str) -> str:
     """
     base64 mp3를 S3에 업로드. 성공 시 s3:// 경로(또는 정적 URL 경로) 반환
     """
-    try:
-        audio_bytes = base64.b64decode(base64_str)
-        s3.put_object(
-            Bucket=S3_BUCKET,
-            Key=key,                   # 예: f"chatrooms/results/{chatroom_id}/letter_voice.mp3"
-            Body=audio_bytes,
-            ContentType="audio/mpeg",  # 중요: 브라우저 재생용
-            ACL="public-read",       # 퍼블릭로 만들려면 주석 해제 (버킷 정책 허용 필요)
-            # ServerSideEncryption="AES256",  # 원하면 서버측 암호화
-        )
-        # 정적 URL 형식 (버킷이 퍼블릭 읽기이면 바로 접근 가능)
-        return f"https://{S3_BUCKET}.s3.ap-northeast-2.amazonaws.com/{key}"
-    except ClientError as e:
-        raise RuntimeError(f"S3 upload failed: {e}")
+    return upload_audio(base64.b64decode(base64_str), key)
+
+def upload_audio(audio_bytes: bytes, key: str) -> str:
+    """
+    mp3 바이트를 그대로 S3에 업로드 (TTS 응답을 base64로 바꾸지 않고 올릴 때). 반환값은 upload_audio_base64와 같다
+
+    호출한 스레드를 업로드가 끝날 때까지 막는다. async 코드에서는 upload_audio_async 를 쓴다.
+    """
+    extra = {"ContentType": "audio/mpeg"}  # 중요: 브라우저 재생용
+    if S3_PUBLIC:
+        extra["ACL"] = "public-read"       # 퍼블릭 버킷일 때만 (버킷 정책 허용 필요)
+    # extra["ServerSideEncryption"] = "AES256"  # 원하면 서버측 암호화
+    start = time.perf_counter()
+    for attempt in range(S3_UPLOAD_ATTEMPTS):
+        try:
+            # key 예: f"chatrooms/results/{chatroom_id}/letter_voice.mp3"
+            s3.upload_fileobj(io.BytesIO(audio_bytes), S3_BUCKET, key, ExtraArgs=extra, Config=TRANSFER_CONFIG)
+            break
+        except (ClientError, BotoCoreError) as e:
+            if attempt + 1 >= S3_UPLOAD_ATTEMPTS:
+                metrics.registry.inc("natna_audio_upload_total", result="failed")
+                raise RuntimeError(f"S3 upload failed: {e}")
+            metrics.registry.inc("natna_audio_upload_total", result="retry")
+            print(f"S3 upload retry ({attempt + 1}): {e}")
+            time.sleep(random.uniform(0, S3_UPLOAD_BACKOFF * 2 ** attempt))
+    metrics.registry.inc("natna_audio_upload_total", result="ok")
+    metrics.registry.observe("natna_audio_upload_seconds", time.perf_counter() - start, metrics.LATENCY_BUCKETS)
+    with _presigned_lock:
+        _presigned.pop(key, None)   # 같은 키에 새로 올렸으면 캐시된 URL 은 버린다
+    return public_url(key)
+
+async def upload_audio_async(audio_bytes: bytes, key: str) -> str:
+    """upload_audio 를 업로드 전용 스레드 풀에서 실행 (이벤트 루프를 막지 않음)"""
+    return await asyncio.get_running_loop().run_in_executor(_upload_pool, upload_audio, audio_bytes, key)
 
 def create_presigned_url(key: str, expires: int = 3600) -> str:
     """
@@ -44,3 +119,26 @@ def create_presigned_url(key: str, expires: int = 3600) -> str:
         Params={"Bucket": S3_BUCKET, "Key": key},
         ExpiresIn=expires,
     )
+
+def audio_url(key: str) -> str:
+    """
+    클라이언트에 줄 음성 URL
+
+    퍼블릭 버킷이면 정적 URL, 비공개 버킷이면 presigned URL (남은 유효 시간이 10% 미만일 때만 새로 발급)
+    """
+    if S3_PUBLIC:
+        return public_url(key)
+    now = time.time()
+    with _presigned_lock:
+        cached = _presigned.get(key)
+        if cached and cached[1] - now > S3_PRESIGN_EXPIRES * 0.1:
+            return cached[0]
+    url = create_presigned_url(key, expires=S3_PRESIGN_EXPIRES)
+    with _presigned_lock:
+        _presigned[key] = (url, now + S3_PRESIGN_EXPIRES)
+        if len(_presigned) > 10000:
+            _presigned.clear()
+    return url
+
+def shutdown():
+    _upload_pool.shutdown(wait=True)
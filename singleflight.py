@@ -0,0 +1,98 @@
+# singleflight.py
+"""
+동일한 요청 중복 제거 (singleflight)
+
+Streamlit UI 재실행, 클라이언트 재시도 등으로 같은 프롬프트가 동시에 여러 번 들어오면
+업스트림 호출은 한 번만 하고 결과를 기다리는 모든 호출자에게 나눠준다.
+
+- 키: 요청 바디(messages + 파라미터)를 정렬된 JSON으로 직렬화한 sha256
+- 이미 끝난 요청은 캐시하지 않는다 (진행 중인 요청끼리만 합친다)
+- 호출자 하나가 취소되어도 나머지가 기다리는 업스트림 호출은 계속 진행하고,
+  모든 호출자가 취소되면 업스트림 호출도 취소한다
+- bypass() 블록 안에서 만든 태스크는 합치지 않는다 (헤지 요청은 일부러 중복 호출하므로)
+"""
+import os
+import json
+import asyncio
+import hashlib
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import metrics
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true"
+# 합칠 호출 종류 (metrics stage 이름). 상황/퀴즈 생성은 사용자마다 달라야 하므로 기본 제외
+SINGLEFLIGHT_STAGES = {s.strip() for s in os.getenv("SINGLEFLIGHT_STAGES", "verification,react,improve,react_improve,feedback").split(",") if s.strip()}
+
+_bypass: contextvars.ContextVar = contextvars.ContextVar("natna_singleflight_bypass", default=False)
+
+
+@contextmanager
+def bypass():
+    """이 블록 안에서 호출(또는 생성한 태스크)은 합치지 않는다"""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def request_key(completion_request: Dict) -> str:
+    body = json.dumps(completion_request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self.flights: Dict[str, _Flight] = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        key가 같은 call이 진행 중이면 그 결과를 같이 기다리고, 없으면 새로 실행한다.
+        결과가 dict면 호출자마다 얕은 복사본을 돌려준다.
+        """
+        self.stats["calls"] += 1
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = _Flight(asyncio.ensure_future(call()))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.stats["coalesced"] += 1
+            metrics.registry.inc("natna_upstream_coalesced_total", call_type=metrics.current_stage())
+
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+        return dict(result) if isinstance(result, dict) else result
+
+    def _forget(self, key: str, flight: _Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    def in_flight(self) -> int:
+        return len(self.flights)
+
+    def snapshot(self) -> Dict:
+        return {"enabled": SINGLEFLIGHT_ENABLED, "in_flight": self.in_flight(), **self.stats}
+
+
+def should_coalesce(stage: Optional[str]) -> bool:
+    return SINGLEFLIGHT_ENABLED and not _bypass.get() and stage in SINGLEFLIGHT_STAGES
+
+
+# 프로세스 공용 인스턴스
+singleflight = SingleFlight()
@@ -0,0 +1,230 @@
+# situation_pool.py
+"""
+상황/퀴즈 미리 만들어두기 (warm pool)
+
+/situation은 상황+퀴즈 생성(긴 첫 문장 축약 호출, 재시도 포함)을 기다려야 해서 가장 느린 단계다.
+백그라운드에서 검증된 (상황, 퀴즈 5문장) 세트를 미리 만들어 두고 /situation은 하나 꺼내 쓴다.
+
+- 풀은 파일 하나(SITUATION_POOL_PATH)에 두고 fcntl 락으로 워커들이 같이 쓴다 → 재시작해도 유지
+- 생산자는 워커 중 하나만 맡는다 (생산자 락을 잡은 워커, 그 워커가 죽으면 다른 워커가 이어받음)
+- 목표 개수 = 최근 SITUATION_POOL_DEMAND_WINDOW 초 동안의 수요(분당 꺼낸 횟수) x SITUATION_POOL_HORIZON 분,
+  SITUATION_POOL_MIN ~ SITUATION_POOL_MAX 사이로 제한
+- 업스트림 사용률이 SITUATION_POOL_MAX_UTILIZATION 이상이면 채우지 않는다 (실시간 요청 우선)
+- 중복 방지: 풀에 있거나 최근 SITUATION_POOL_DEDUP 개 안에 나간 상황과 같은 세트는 버리고,
+  같은 사용자에게 최근 나간 상황은 건너뛰고 다른 세트를 꺼낸다
+- 상황 프롬프트는 챗봇 이름과 무관하므로 모든 챗봇이 풀 하나를 같이 쓴다
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import asyncio
+import hashlib
+import unicodedata
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+SITUATION_POOL_ENABLED = os.getenv("SITUATION_POOL_ENABLED", "false").lower() == "true"
+SITUATION_POOL_PATH = os.getenv("SITUATION_POOL_PATH", "chat_data/situation_pool.json")
+SITUATION_POOL_MIN = int(os.getenv("SITUATION_POOL_MIN", "3"))
+SITUATION_POOL_MAX = int(os.getenv("SITUATION_POOL_MAX", "50"))
+SITUATION_POOL_HORIZON = float(os.getenv("SITUATION_POOL_HORIZON", "5"))             # 분
+SITUATION_POOL_DEMAND_WINDOW = float(os.getenv("SITUATION_POOL_DEMAND_WINDOW", "600"))  # 초
+SITUATION_POOL_MAX_AGE = float(os.getenv("SITUATION_POOL_MAX_AGE", "86400"))         # 초
+SITUATION_POOL_DEDUP = int(os.getenv("SITUATION_POOL_DEDUP", "100"))
+SITUATION_POOL_CONCURRENCY = int(os.getenv("SITUATION_POOL_CONCURRENCY", "2"))
+SITUATION_POOL_INTERVAL = float(os.getenv("SITUATION_POOL_INTERVAL", "2"))           # 초
+SITUATION_POOL_MAX_UTILIZATION = float(os.getenv("SITUATION_POOL_MAX_UTILIZATION", "0.5"))
+
+_USER_HISTORY = 5        # 사용자별로 기억하는 최근 상황 수
+_MAX_USERS = 1000
+
+
+def fingerprint(situation: str) -> str:
+    """공백/문장부호를 뺀 상황 문장의 해시"""
+    text = unicodedata.normalize("NFKC", situation or "").lower()
+    text = re.sub(r"[\s\W_]+", "", text)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def is_valid(situation: str, quiz_list: List[str], max_first_length: int) -> bool:
+    return (bool(situation and situation.strip())
+            and isinstance(quiz_list, list) and len(quiz_list) == 5
+            and all(isinstance(q, str) and q.strip() for q in quiz_list)
+            and len(quiz_list[0]) <= max_first_length)
+
+
+class SituationPool:
+    def __init__(self, path: str = SITUATION_POOL_PATH):
+        self.path = path
+        self.stats = {"hits": 0, "misses": 0, "produced": 0, "duplicates": 0, "failed": 0}
+        self._producer_lock = None
+
+    # -------------------------------------------------------------------------
+    # 파일 상태
+    # -------------------------------------------------------------------------
+    @contextmanager
+    def _state(self):
+        """락을 잡고 상태를 읽어서 넘겨주고, 블록이 끝나면 저장한다"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                state = self._read()
+                yield state
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(state, f, ensure_ascii=False)
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self) -> Dict:
+        state = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Situation pool load failed: {e}")
+        now = time.time()
+        state["items"] = [item for item in state.get("items", []) if item["created"] + SITUATION_POOL_MAX_AGE > now]
+        state["pops"] = [t for t in state.get("pops", []) if t + SITUATION_POOL_DEMAND_WINDOW > now]
+        state.setdefault("served", [])
+        state.setdefault("users", {})
+        return state
+
+    # -------------------------------------------------------------------------
+    # 소비자 (/situation)
+    # -------------------------------------------------------------------------
+    def pop(self, user_nickname: str = "") -> Optional[Tuple[str, List[str]]]:
+        """
+        미리 만든 세트 하나를 꺼낸다. 없으면 None (호출한 쪽에서 바로 생성)
+        같은 사용자에게 최근 나간 상황은 건너뛴다
+        """
+        if not SITUATION_POOL_ENABLED:
+            return None
+        try:
+            with self._state() as state:
+                state["pops"].append(time.time())
+                recent = state["users"].get(user_nickname, [])
+                index = next((i for i, item in enumerate(state["items"]) if item["fp"] not in recent), None)
+                item = state["items"].pop(index) if index is not None else None
+                if item is not None:
+                    state["served"] = (state["served"] + [item["fp"]])[-SITUATION_POOL_DEDUP:]
+                    if user_nickname:
+                        state["users"].pop(user_nickname, None)
+                        state["users"][user_nickname] = (recent + [item["fp"]])[-_USER_HISTORY:]
+                        while len(state["users"]) > _MAX_USERS:
+                            state["users"].pop(next(iter(state["users"])))
+        except OSError as e:
+            print(f"Situation pool pop failed: {e}")
+            item = None
+
+        self.stats["hits" if item else "misses"] += 1
+        metrics.registry.inc("natna_situation_pool_total", result="hit" if item else "miss")
+        if item is None:
+            return None
+        return item["situation"], item["quiz_list"]
+
+    # -------------------------------------------------------------------------
+    # 생산자
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def target_size(state: Dict) -> int:
+        """최근 수요(분당 꺼낸 횟수)로 SITUATION_POOL_HORIZON 분을 버틸 개수"""
+        per_minute = len(state["pops"]) / (SITUATION_POOL_DEMAND_WINDOW / 60)
+        target = int(per_minute * SITUATION_POOL_HORIZON + 0.999)
+        return max(SITUATION_POOL_MIN, min(SITUATION_POOL_MAX, target))
+
+    def deficit(self) -> int:
+        with self._state() as state:
+            return self.target_size(state) - len(state["items"])
+
+    def add(self, situation: str, quiz_list: List[str]) -> bool:
+        """중복이 아니면 풀에 넣는다"""
+        fp = fingerprint(situation)
+        with self._state() as state:
+            if fp in state["served"] or any(item["fp"] == fp for item in state["items"]):
+                self.stats["duplicates"] += 1
+                metrics.registry.inc("natna_situation_pool_total", result="duplicate")
+                return False
+            state["items"].append({"situation": situation, "quiz_list": quiz_list, "fp": fp, "created": time.time()})
+        self.stats["produced"] += 1
+        metrics.registry.inc("natna_situation_pool_total", result="produced")
+        return True
+
+    def _acquire_producer(self) -> bool:
+        """생산자 락 (프로세스가 살아있는 동안 유지, 죽으면 OS가 풀어준다)"""
+        if self._producer_lock is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        lock = open(f"{self.path}.producer", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        self._producer_lock = lock
+        print(f"Situation pool producer started (pid {os.getpid()})")
+        return True
+
+    async def _produce_one(self, generate, default_situation: str, max_first_length: int):
+        try:
+            situation, quiz_list = await generate()
+        except Exception as e:
+            print(f"Situation pool generation failed: {e}")
+            situation, quiz_list = default_situation, []
+        if situation == default_situation or not is_valid(situation, quiz_list, max_first_length):
+            # 생성 실패 시의 기본 세트는 넣지 않는다
+            self.stats["failed"] += 1
+            metrics.registry.inc("natna_situation_pool_total", result="failed")
+            return
+        await asyncio.to_thread(self.add, situation, quiz_list)
+
+    async def run_producer(self, generate, utilization, default_situation: str, max_first_length: int):
+        """
+        풀을 목표 개수까지 채우는 백그라운드 루프 (lifespan에서 태스크로 실행)
+
+        Args:
+            generate: 상황/퀴즈 생성 코루틴 함수 () -> (situation, quiz_list)
+            utilization: 업스트림 사용률 함수 () -> float
+        """
+        if not SITUATION_POOL_ENABLED:
+            return
+        while True:
+            try:
+                if self._acquire_producer() and utilization() < SITUATION_POOL_MAX_UTILIZATION:
+                    missing = await asyncio.to_thread(self.deficit)
+                    if missing > 0:
+                        produced = self.stats["produced"]
+                        await asyncio.gather(*[
+                            self._produce_one(generate, default_situation, max_first_length)
+                            for _ in range(min(missing, SITUATION_POOL_CONCURRENCY))
+                        ])
+                        if self.stats["produced"] > produced:
+                            # 하나라도 채웠으면 쉬지 않고 다음 묶음 (전부 실패/중복이면 잠깐 쉰다)
+                            continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Situation pool producer error: {e}")
+            await asyncio.sleep(SITUATION_POOL_INTERVAL)
+
+    def snapshot(self) -> Dict:
+        size, target = 0, 0
+        if SITUATION_POOL_ENABLED:
+            try:
+                state = self._read()
+                size, target = len(state["items"]), self.target_size(state)
+            except OSError:
+                pass
+        return {"enabled": SITUATION_POOL_ENABLED, "size": size, "target": target,
+                "producer": self._producer_lock is not None, **self.stats}
+
+
+# 프로세스 공용 인스턴스
+situation_pool = SituationPool()
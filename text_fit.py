@@ -0,0 +1,172 @@
+# text_fit.py
+"""
+한국어 채팅 문장 길이 맞추기 (로컬 후처리)
+
+리액션(60자), 피드백(300자)이 몇 글자 넘었다는 이유만으로 HCX를 다시 부르지 않도록
+길이 안에서 자연스러운 경계를 찾아 자른다. 자를 곳이 없을 때만 재생성한다.
+
+- 경계 우선순위: 문장 끝(. ! ? ~ … / 이모지 / ㅠㅠ·ㅋㅋ) > 절(쉼표, "~는데 ", "~지만 " 등) > 공백(loose)
+  절에서 자르면 "..."을 붙여 말줄임으로 끝낸다
+- 원문 끝의 이모지/감정 표현(ㅠㅠ, 😢, ~)은 잘린 뒤에도 다시 붙인다
+- 자소/이모지 조합(ZWJ, 피부색, 국기, 이체자 선택자, 첫가끝 자모)은 중간에서 끊지 않는다
+- 길이는 기존 검사와 같이 len() (코드 포인트) 기준
+"""
+import unicodedata
+from typing import List, Optional, Tuple
+
+import metrics
+
+SENTENCE_END = ".!?~…"
+TONE_MARKS = "~^;"
+ELLIPSIS = "..."
+# 절 경계로 볼 연결 어미 (뒤에 공백이 올 때)
+CLAUSE_ENDINGS = ("는데", "은데", "ㄴ데", "지만", "는데도", "니까", "라서", "어서", "아서", "해서", "고", "며", "면서", "거든")
+
+_SENTENCE, _CLAUSE, _WORD = 3, 2, 1
+
+
+def is_emoji(ch: str) -> bool:
+    cp = ord(ch)
+    return cp >= 0x1F000 or 0x2600 <= cp <= 0x27BF or cp in (0xFE0F, 0x200D)
+
+
+def _is_jamo(ch: str) -> bool:
+    """ㅠㅠ, ㅋㅋ 같은 호환 자모"""
+    return 0x3131 <= ord(ch) <= 0x318E
+
+
+def _extends(cluster: str, ch: str) -> bool:
+    """ch가 앞 글자 묶음(grapheme cluster)에 붙는 문자인지"""
+    cp = ord(ch)
+    prev = ord(cluster[-1])
+    if unicodedata.category(ch) in ("Mn", "Mc", "Me"):
+        return True
+    if 0xFE00 <= cp <= 0xFE0F or 0x1F3FB <= cp <= 0x1F3FF or 0xE0020 <= cp <= 0xE007F or cp in (0x200D, 0x20E3):
+        return True
+    if prev == 0x200D:
+        return True
+    if 0x1F1E6 <= cp <= 0x1F1FF and len(cluster) == 1 and 0x1F1E6 <= prev <= 0x1F1FF:
+        return True  # 국기 (지역 표시 문자 2개)
+    if 0x1160 <= cp <= 0x11FF and (0x1100 <= prev <= 0x11FF or 0xAC00 <= prev <= 0xD7A3):
+        return True  # 첫가끝 중성/종성
+    return False
+
+
+def graphemes(text: str) -> List[str]:
+    clusters = []
+    for ch in text:
+        if clusters and _extends(clusters[-1], ch):
+            clusters[-1] += ch
+        else:
+            clusters.append(ch)
+    return clusters
+
+
+def _is_terminal(cluster: str) -> bool:
+    """문장을 끝낼 수 있는 글자 묶음 (문장부호, 이모지, ㅠㅠ 등)"""
+    ch = cluster[0]
+    return ch in SENTENCE_END or ch in TONE_MARKS or is_emoji(ch) or _is_jamo(ch)
+
+
+def _tail(clusters: List[str]) -> str:
+    """원문 끝의 이모지/감정 표현 (문장부호만 있는 꼬리는 제외)"""
+    i = len(clusters)
+    while i > 0 and (_is_terminal(clusters[i - 1]) or clusters[i - 1] == " "):
+        i -= 1
+    tail = "".join(clusters[i:]).strip()
+    if not any(is_emoji(c[0]) or _is_jamo(c[0]) or c[0] in TONE_MARKS for c in clusters[i:]):
+        return ""
+    return tail
+
+
+def _boundaries(clusters: List[str]) -> List[Tuple[int, int, str]]:
+    """(끝 위치(코드 포인트), 경계 강도, 붙일 접미사) 목록"""
+    result = []
+    offset = 0
+    for i, cluster in enumerate(clusters):
+        start = offset
+        offset += len(cluster)
+        nxt = clusters[i + 1] if i + 1 < len(clusters) else ""
+        if _is_terminal(cluster):
+            if not (nxt and _is_terminal(nxt)):
+                result.append((offset, _SENTENCE, ""))
+        elif cluster == ",":
+            result.append((start, _CLAUSE, ELLIPSIS))
+        elif nxt == " ":
+            word = "".join(clusters[max(0, i - 2):i + 1])
+            if word.endswith(CLAUSE_ENDINGS):
+                result.append((offset, _CLAUSE, ELLIPSIS))
+            else:
+                result.append((offset, _WORD, ""))
+    return result
+
+
+def fit(text: str, limit: int, loose: bool = False, min_ratio: float = 0.5) -> Optional[str]:
+    """
+    text를 limit 글자 이내로 자연스럽게 자른다.
+
+    Args:
+        loose: True면 공백(단어) 경계도 허용하고 최소 길이 제한을 두지 않는다 (마지막 시도용)
+        min_ratio: 잘린 결과가 limit * min_ratio 보다 짧으면 실패로 본다
+
+    Returns:
+        limit 이내 텍스트 (이미 짧으면 그대로) 또는 None (적당한 경계 없음)
+    """
+    text = (text or "").strip()
+    if len(text) <= limit:
+        return text
+    clusters = graphemes(text)
+    tail = _tail(clusters)
+    floor = 0 if loose else limit * min_ratio
+    min_strength = _WORD if loose else _CLAUSE
+    candidates = [b for b in _boundaries(clusters) if b[1] >= min_strength]
+
+    # 끝 이모지/감정 표현 자리를 남겨두고 먼저 찾고, 안 되면 꼬리 없이 찾는다
+    for keep_tail in ((True, False) if tail else (False,)):
+        for strength in (_SENTENCE, _CLAUSE, _WORD):
+            best = None
+            for end, s, suffix in candidates:
+                if s != strength:
+                    continue
+                cut = text[:end].rstrip(" ,") + suffix
+                if keep_tail and tail not in cut:
+                    cut = f"{cut} {tail}"
+                if floor <= len(cut) <= limit and cut.strip():
+                    best = cut
+            if best:
+                return best
+    return None
+
+
+def split_sentences(text: str, max_chars: int) -> List[str]:
+    """
+    문장 끝(과 줄바꿈)에서 나누고, 이웃 문장은 max_chars 를 넘지 않는 만큼 묶는다 (TTS 조각 합성용)
+
+    한 문장이 max_chars 보다 길면 그 문장은 그대로 한 조각이 된다. 원문의 줄바꿈은 조각 안에 그대로 남는다.
+    """
+    text = (text or "").strip()
+    if len(text) <= max_chars:
+        return [text] if text else []
+    cuts = {end for end, strength, _ in _boundaries(graphemes(text)) if strength == _SENTENCE}
+    cuts.update(i + 1 for i, ch in enumerate(text) if ch == "\n")
+    cuts.add(len(text))
+
+    chunks, start, end = [], 0, 0
+    for cut in sorted(cuts):
+        if end > start and cut - start > max_chars:
+            chunks.append(text[start:end].strip())
+            start = end
+        end = cut
+    chunks.append(text[start:end].strip())
+    return [chunk for chunk in chunks if chunk]
+
+
+def try_fit(text: str, limit: int, loose: bool = False, stage: Optional[str] = None) -> Optional[str]:
+    """fit()과 같지만, 재생성 대신 잘라서 해결했는지(LLM 호출 절약) 메트릭에 남긴다 (stage 기본값: 현재 stage)"""
+    fitted = fit(text, limit, loose=loose)
+    if len((text or "").strip()) > limit:
+        metrics.registry.inc("natna_length_fit_total", stage=stage or metrics.current_stage(),
+                             result="fit" if fitted else "miss")
+        if fitted:
+            print(f"✂️ 길이 맞춤 ({len(text)} -> {len(fitted)}): {fitted}")
+    return fitted
@@ -0,0 +1,148 @@
+# token_calibration.py
+"""
+단계별 maxCompletionTokens / 길이 지시문 자동 보정
+
+REACT_PARAMS는 60자 리액션에 maxCompletionTokens 300, FEEDBACK_PARAMS는 300자 편지에 1024를 허용해서
+모델이 길게 생성하면 디코딩 시간도 늘고 길이 초과 재시도도 늘어난다.
+실제 응답의 completionTokens로 단계별 글자/토큰 비율을 배워서
+
+- 토큰 상한: (글자 한도 + 필드 밖 글자(화자 이름, JSON 키 등)) / 글자-토큰 비율 x 여유율
+  응답이 상한에 걸려 잘리면 그 단계의 여유율을 늘린다 (JSON 응답이 잘려 파싱 실패하는 것 방지)
+- 첫 시도 길이 지시문: 첫 시도 성공률이 CALIBRATION_HINT_BELOW 보다 낮으면,
+  지금까지 지시한 길이 대비 실제 길이 비율을 보고 한도의 CALIBRATION_FILL 정도가 나오도록 글자 수를 지시한다
+
+표본이 CALIBRATION_MIN_SAMPLES 개 모이기 전에는 설정값 그대로 쓴다. 워커별로 따로 배운다.
+"""
+import os
+import math
+import threading
+from typing import Dict, Optional
+
+import metrics
+
+CALIBRATION_ENABLED = os.getenv("CALIBRATION_ENABLED", "true").lower() == "true"
+CALIBRATION_MIN_SAMPLES = int(os.getenv("CALIBRATION_MIN_SAMPLES", "20"))
+CALIBRATION_ALPHA = float(os.getenv("CALIBRATION_ALPHA", "0.1"))           # EWMA 가중치
+CALIBRATION_HEADROOM = float(os.getenv("CALIBRATION_HEADROOM", "1.5"))     # 토큰 상한 여유율
+CALIBRATION_MIN_TOKENS = int(os.getenv("CALIBRATION_MIN_TOKENS", "32"))
+CALIBRATION_FILL = float(os.getenv("CALIBRATION_FILL", "0.85"))            # 첫 시도 목표 길이 (한도 대비)
+CALIBRATION_HINT_BELOW = float(os.getenv("CALIBRATION_HINT_BELOW", "0.9"))  # 첫 시도 성공률이 이보다 낮으면 지시문 추가
+
+_MAX_HEADROOM = 4.0
+
+
+def _ewma(current: Optional[float], value: float) -> float:
+    return value if current is None else current + CALIBRATION_ALPHA * (value - current)
+
+
+class _StageStats:
+    def __init__(self):
+        self.chars_per_token: Optional[float] = None
+        self.overhead: Optional[float] = None      # 응답 전체 글자 - 사용하는 필드 글자
+        self.overshoot: Optional[float] = None     # 실제 길이 / 지시한 길이(지시가 없으면 한도)
+        self.headroom = CALIBRATION_HEADROOM
+        self.token_samples = 0
+        self.first_tries = 0
+        self.first_ok = 0
+        self.truncated = 0
+
+    def first_try_rate(self) -> Optional[float]:
+        return self.first_ok / self.first_tries if self.first_tries else None
+
+
+class TokenCalibrator:
+    def __init__(self):
+        self.stages: Dict[str, _StageStats] = {}
+        self.lock = threading.Lock()
+
+    def _stats(self, stage: str) -> _StageStats:
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = _StageStats()
+        return stats
+
+    def observe_tokens(self, stage: str, chars: int, completion_tokens: int, max_tokens: Optional[int] = None):
+        """업스트림 응답 1건의 글자 수 / completionTokens (hcx_client에서 호출)"""
+        if not CALIBRATION_ENABLED or not completion_tokens or not chars:
+            return
+        with self.lock:
+            stats = self._stats(stage)
+            stats.chars_per_token = _ewma(stats.chars_per_token, chars / completion_tokens)
+            stats.token_samples += 1
+            if max_tokens and completion_tokens >= max_tokens:
+                # 상한에 걸려 잘림 → 여유율을 늘린다
+                stats.truncated += 1
+                stats.headroom = min(_MAX_HEADROOM, stats.headroom * 1.25)
+                metrics.registry.inc("natna_calibration_truncated_total", stage=stage)
+
+    def record(self, stage: str, raw_chars: int, field_chars: int, limit: int, first_try: bool,
+               requested: Optional[int] = None):
+        """
+        생성 결과 1건 (chat.py에서 호출)
+
+        Args:
+            raw_chars: 응답 전체 글자 수
+            field_chars: 길이 한도를 적용하는 필드의 글자 수
+            requested: 이번 시도에서 지시한 글자 수 (없으면 한도 기준)
+        """
+        if not CALIBRATION_ENABLED:
+            return
+        ok = field_chars <= limit
+        with self.lock:
+            stats = self._stats(stage)
+            stats.overhead = _ewma(stats.overhead, max(0, raw_chars - field_chars))
+            if first_try:
+                stats.first_tries += 1
+                stats.first_ok += ok
+                stats.overshoot = _ewma(stats.overshoot, field_chars / (requested or limit))
+        if first_try:
+            metrics.registry.inc("natna_calibration_first_try_total", stage=stage, result="ok" if ok else "over")
+
+    def params(self, stage: str, params: Dict, limit: int) -> Dict:
+        """maxCompletionTokens를 보정한 파라미터 (표본이 부족하면 원래 파라미터)"""
+        if not CALIBRATION_ENABLED:
+            return params
+        stats = self.stages.get(stage)
+        if stats is None or stats.token_samples < CALIBRATION_MIN_SAMPLES or not stats.chars_per_token:
+            return params
+        configured = int(params.get("maxCompletionTokens", 512))
+        cap = math.ceil((limit + (stats.overhead or 0)) / stats.chars_per_token * stats.headroom)
+        cap = max(CALIBRATION_MIN_TOKENS, min(configured, cap))
+        if cap == configured:
+            return params
+        return {**params, "maxCompletionTokens": cap}
+
+    def hint(self, stage: str, limit: int) -> Optional[int]:
+        """첫 시도에 지시할 글자 수 (지시가 필요 없으면 None)"""
+        if not CALIBRATION_ENABLED:
+            return None
+        stats = self.stages.get(stage)
+        if stats is None or stats.first_tries < CALIBRATION_MIN_SAMPLES or not stats.overshoot:
+            return None
+        if stats.first_try_rate() >= CALIBRATION_HINT_BELOW:
+            return None
+        target = limit * CALIBRATION_FILL / stats.overshoot
+        return int(max(limit * 0.4, min(limit * CALIBRATION_FILL, target)))
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                "enabled": CALIBRATION_ENABLED,
+                "stages": {
+                    stage: {
+                        "chars_per_token": round(s.chars_per_token, 3) if s.chars_per_token else None,
+                        "overhead_chars": round(s.overhead, 1) if s.overhead is not None else None,
+                        "overshoot": round(s.overshoot, 3) if s.overshoot else None,
+                        "headroom": round(s.headroom, 2),
+                        "samples": s.token_samples,
+                        "first_try_rate": round(s.first_try_rate(), 3) if s.first_tries else None,
+                        "first_tries": s.first_tries,
+                        "truncated": s.truncated,
+                    }
+                    for stage, s in self.stages.items()
+                },
+            }
+
+
+# 프로세스 공용 인스턴스
+calibration = TokenCalibrator()
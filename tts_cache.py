@@ -0,0 +1,138 @@
+# tts_cache.py
+"""
+TTS 조각 캐시 (내용 주소 + 디스크 LRU)
+
+편지마다 거의 같은 부분("안녕 {user_nickname}!", "빛나는 우리의 우정을 염원하며,", "{chatbot_name}가")은
+한 번 합성한 MP3를 디스크에 두고 다시 쓴다. 바뀌는 본문만 CLOVA Voice로 합성한다.
+
+- 키: sha256(정규화한 글, speaker, speed, pitch, alpha, volume, format) → {TTS_CACHE_DIR}/{키}.mp3
+  음성 파라미터가 바뀌면 키도 바뀌므로 다른 목소리 조각이 섞이지 않는다
+- LRU: 꺼낼 때 파일 수정 시각을 갱신하고, 전체 크기가 TTS_CACHE_MAX_MB 를 넘으면 오래된 파일부터 지운다
+- 파일은 임시 파일에 쓰고 rename 하므로 워커들이 같은 디렉토리를 같이 써도 반쯤 쓴 파일을 읽지 않는다
+"""
+import os
+import json
+import hashlib
+import unicodedata
+from typing import Dict, Optional
+
+import metrics
+
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "chat_data/tts_cache")
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", "200"))
+TTS_CACHE_MAX_CHARS = int(os.getenv("TTS_CACHE_MAX_CHARS", "60"))   # 이보다 긴 글은 캐시하지 않는다
+
+_VOICE_KEYS = ("speaker", "speed", "pitch", "alpha", "volume", "format")
+
+
+def segment_key(text: str, voice: Dict) -> str:
+    normalized = " ".join(unicodedata.normalize("NFC", text or "").split())
+    payload = json.dumps([normalized] + [str(voice.get(k, "")) for k in _VOICE_KEYS], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TtsSegmentCache:
+    def __init__(self, directory: str = TTS_CACHE_DIR, max_bytes: float = TTS_CACHE_MAX_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size: Optional[int] = None     # 이 워커가 아는 전체 크기 (처음 쓸 때 디렉토리를 훑어서 채운다)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0, "bytes_saved": 0}
+
+    def cacheable(self, text: str) -> bool:
+        return TTS_CACHE_ENABLED and bool(text and text.strip()) and len(text) <= TTS_CACHE_MAX_CHARS
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, text: str, voice: Dict) -> Optional[bytes]:
+        if not self.cacheable(text):
+            return None
+        path = self._path(segment_key(text, voice))
+        try:
+            with open(path, "rb") as f:
+                audio = f.read()
+            os.utime(path)   # LRU 순서 갱신
+        except OSError:
+            audio = None
+        if audio:
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += len(audio)
+            metrics.registry.inc("natna_tts_cache_total", result="hit")
+            return audio
+        self.stats["misses"] += 1
+        metrics.registry.inc("natna_tts_cache_total", result="miss")
+        return None
+
+    def put(self, text: str, voice: Dict, audio: bytes):
+        if not audio or not self.cacheable(text):
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(segment_key(text, voice))
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(audio)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"TTS cache write failed: {e}")
+            return
+        self.stats["stores"] += 1
+        if self.size is None:
+            self.size = self._scan_size()
+        else:
+            self.size += len(audio)
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".mp3"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue   # 다른 워커가 방금 지움
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _scan_size(self) -> int:
+        try:
+            return sum(size for _, size, _ in self._entries())
+        except OSError:
+            return 0
+
+    def _evict(self):
+        """오래 안 쓴 파일부터 지워서 최대 크기의 90% 까지 줄인다"""
+        try:
+            entries = sorted(self._entries())
+        except OSError as e:
+            print(f"TTS cache eviction failed: {e}")
+            return
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            self.stats["evicted"] += 1
+            metrics.registry.inc("natna_tts_cache_total", result="evicted")
+        self.size = total
+
+    def snapshot(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "enabled": TTS_CACHE_ENABLED,
+            "bytes": self.size,
+            "max_bytes": int(self.max_bytes),
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            **self.stats,
+        }
+
+
+# 프로세스 공용 인스턴스
+tts_cache = TtsSegmentCache()
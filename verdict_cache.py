@@ -0,0 +1,173 @@
+# verdict_cache.py
+"""
+검증/점수(verification, score, reason_score) 결과 캐시 (LRU + TTL)
+
+"왜?", "괜찮아", "힘내" 같은 짧은 정형 답변은 대화 맥락과 상관없이 판정이 거의 같으므로
+매번 HCX를 부르지 않고 캐시된 판정을 쓴다.
+
+- 키: 정규화한 (직전 챗봇 발화, 사용자 응답)
+  VERDICT_CACHE_SHORT_REPLIES 목록에 있는 응답은 사용자 응답만으로 키를 만든다 (맥락 무관)
+- reason_score 안의 사용자/챗봇 이름은 자리표시자로 바꿔 저장하고 꺼낼 때 다시 채운다
+- VERDICT_CACHE_PATH를 주면 종료 시 저장하고 시작 시 불러온다 (워커별 캐시, 같은 파일 공유)
+"""
+import os
+import re
+import json
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import metrics
+
+VERDICT_CACHE_ENABLED = os.getenv("VERDICT_CACHE_ENABLED", "true").lower() == "true"
+VERDICT_CACHE_SIZE = int(os.getenv("VERDICT_CACHE_SIZE", "5000"))
+VERDICT_CACHE_TTL = float(os.getenv("VERDICT_CACHE_TTL", "86400"))   # 초
+VERDICT_CACHE_PATH = os.getenv("VERDICT_CACHE_PATH")                  # 없으면 저장 안 함
+VERDICT_CACHE_SHORT_REPLIES = os.getenv(
+    "VERDICT_CACHE_SHORT_REPLIES",
+    "왜?,왜,괜찮아,괜찮아?,힘내,힘내!,응,ㅇㅇ,아니,몰라,그래,그렇구나,헐,ㅋㅋ,ㅠㅠ,진짜?,어떡해,그래서?"
+)
+
+_USER = "{user}"
+_BOT = "{bot}"
+
+Verdict = Tuple[bool, int, str]
+
+
+def normalize(text: str) -> str:
+    """NFKC 정규화, 공백 정리, 반복 문장부호/자모 축약 ("왜???" -> "왜?", "ㅋㅋㅋㅋ" -> "ㅋㅋ")"""
+    text = unicodedata.normalize("NFKC", text or "").strip().lower()
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"([?!.~])\1+", r"\1", text)
+    text = re.sub(r"([ㄱ-ㅎㅏ-ㅣ])\1{2,}", r"\1\1", text)
+    return text
+
+
+SHORT_REPLIES = {normalize(r) for r in VERDICT_CACHE_SHORT_REPLIES.split(",") if r.strip()}
+
+
+class VerdictCache:
+    def __init__(self, max_size: int = VERDICT_CACHE_SIZE, ttl: float = VERDICT_CACHE_TTL,
+                 path: Optional[str] = VERDICT_CACHE_PATH):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.entries: "OrderedDict[str, Tuple[float, list]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+        self.loaded = False
+
+    @staticmethod
+    def key(conversation, chatbot_name: str) -> Tuple[str, str]:
+        """(키, 키 종류) - 키 종류는 reply(맥락 무관) 또는 context"""
+        reply = normalize(conversation[-1])
+        if chatbot_name:
+            reply = reply.replace(normalize(chatbot_name), _BOT)
+        if reply in SHORT_REPLIES:
+            return f"reply\x1f{reply}", "reply"
+        previous = normalize(conversation[-2]) if len(conversation) >= 2 else ""
+        return f"context\x1f{previous}\x1f{reply}", "context"
+
+    def get(self, conversation, chatbot_name: str, user_nickname: str) -> Optional[Verdict]:
+        if not VERDICT_CACHE_ENABLED:
+            return None
+        self._load()
+        key, kind = self.key(conversation, chatbot_name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+        metrics.registry.inc("natna_verdict_cache_total", result="hit" if entry else "miss", key=kind)
+        if entry is None:
+            return None
+        verification, score, reason_score = entry[1]
+        reason_score = reason_score.replace(_USER, user_nickname).replace(_BOT, chatbot_name)
+        return verification, score, reason_score
+
+    def contains(self, conversation, chatbot_name: str) -> bool:
+        """통계에 남기지 않고 유효한 항목이 있는지만 확인"""
+        if not VERDICT_CACHE_ENABLED:
+            return False
+        self._load()
+        key, _ = self.key(conversation, chatbot_name)
+        with self.lock:
+            entry = self.entries.get(key)
+        return entry is not None and entry[0] >= time.time()
+
+    def put(self, conversation, chatbot_name: str, user_nickname: str, verdict: Verdict):
+        if not VERDICT_CACHE_ENABLED:
+            return
+        key, _ = self.key(conversation, chatbot_name)
+        verification, score, reason_score = verdict
+        reason_score = (reason_score or "")
+        if user_nickname:
+            reason_score = reason_score.replace(user_nickname, _USER)
+        if chatbot_name:
+            reason_score = reason_score.replace(chatbot_name, _BOT)
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, [verification, score, reason_score])
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def _read_file(self):
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Verdict cache load failed: {e}")
+            return []
+
+    def _load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        now = time.time()
+        saved = self._read_file()
+        with self.lock:
+            for key, expires_at, verdict in reversed(saved):
+                if expires_at > now and key not in self.entries:
+                    self.entries[key] = (expires_at, verdict)
+                    self.entries.move_to_end(key, last=False)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        if saved:
+            print(f"Verdict cache loaded: {len(self.entries)} entries")
+
+    def save(self):
+        """VERDICT_CACHE_PATH에 저장 (앱 종료 시 호출, 다른 워커가 먼저 저장한 항목과 합친다)"""
+        if not self.path or not VERDICT_CACHE_ENABLED:
+            return
+        now = time.time()
+        merged = OrderedDict((key, [key, expires_at, verdict]) for key, expires_at, verdict in self._read_file()
+                             if expires_at > now)
+        with self.lock:
+            for key, (expires_at, verdict) in self.entries.items():
+                if expires_at > now:
+                    merged.pop(key, None)
+                    merged[key] = [key, expires_at, verdict]
+        data = list(merged.values())[-self.max_size:]
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Verdict cache save failed: {e}")
+
+    def snapshot(self):
+        return {"enabled": VERDICT_CACHE_ENABLED, "size": len(self.entries), **self.stats}
+
+
+# 프로세스 공용 인스턴스
+verdict_cache = VerdictCache()